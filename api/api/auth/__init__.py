@@ -0,0 +1,5 @@
+from .auth import auth, forbidden, owner_required, refuse_unless_admin, refuse_unless_authenticated, \
+    refuse_unless_owner, setup_auth, unauthorized, Auth
+from .passwords import HasherBusy, PasswordHasher
+from .principals import Principal, PrincipalCache
+from .tokens import InvalidToken, RevocationList, TokenSigner
@@ -0,0 +1,110 @@
+from .passwords import PasswordHasher
+from .principals import PrincipalCache
+from .tokens import InvalidToken, RevocationList, TokenSigner
+
+from functools import wraps
+
+from flask import g, jsonify, request, session
+
+
+class Auth:
+    def __init__(self):
+        self.signer = None
+        self.hasher = None
+        self.revoked = RevocationList()
+        self.principals = PrincipalCache()
+        self.admins = frozenset()
+
+    def init_app(self, app, db):
+        app.config.setdefault('AUTH_TOKEN_MAX_AGE', 24 * 60 * 60)
+        # ids of the users allowed to run maintenance over everyone's data, e.g. the rollup rebuild jobs
+        app.config.setdefault('AUTH_ADMINS', [])
+        app.config.setdefault('AUTH_HASH_WORKERS', 2)
+        app.config.setdefault('AUTH_HASH_QUEUE', 16)
+        self.signer = TokenSigner(app.config['SECRET_KEY'], app.config['AUTH_TOKEN_MAX_AGE'])
+        self.hasher = PasswordHasher(app.config['AUTH_HASH_WORKERS'], app.config['AUTH_HASH_QUEUE'])
+        self.revoked.init_app(app, db)
+        self.admins = frozenset(str(user_id) for user_id in app.config['AUTH_ADMINS'])
+
+    # claims of the bearer token sent with the request, None without one, InvalidToken if it is bad or revoked
+    def request_claims(self):
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not token.strip():
+            return None
+        claims = self.signer.verify(token.strip())
+        if claims['jti'] in self.revoked:
+            raise InvalidToken('Token revoked.')
+        return claims
+
+    # from the bearer token, or from the session of a cookie login; neither reads the database
+    def user_id(self):
+        claims = self.request_claims()
+        if claims is not None:
+            return claims['uid']
+        if session.get('logged_in'):
+            return session.get('user_id')
+        return None
+
+
+auth = Auth()
+
+
+def setup_auth(app, db):
+    auth.init_app(app, db)
+    return auth
+
+
+def unauthorized(message):
+    response = jsonify(errors={'token': [message]})
+    response.status_code = 401
+    response.headers['WWW-Authenticate'] = 'Bearer'
+    return response
+
+
+def forbidden(message):
+    response = jsonify(errors={'user': [message]})
+    response.status_code = 403
+    return response
+
+
+# None when the caller is signed in, otherwise the response refusing the request
+def refuse_unless_authenticated():
+    try:
+        user_id = auth.user_id()
+    except InvalidToken as e:
+        return unauthorized(str(e))
+    if user_id is None:
+        return unauthorized('Authentication required.')
+    g.user_id = user_id
+    return None
+
+
+# None when the caller is the given user, otherwise the response refusing the request
+def refuse_unless_owner(owner_id):
+    refused = refuse_unless_authenticated()
+    if refused is not None:
+        return refused
+    if str(g.user_id) != str(owner_id):
+        return forbidden('Not allowed for this user.')
+    return None
+
+
+# None when the caller is one of AUTH_ADMINS, otherwise the response refusing the request
+def refuse_unless_admin():
+    refused = refuse_unless_authenticated()
+    if refused is not None:
+        return refused
+    if str(g.user_id) not in auth.admins:
+        return forbidden('Not allowed for this user.')
+    return None
+
+
+# the caller has to be the user the url names
+def owner_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        refused = refuse_unless_owner(kwargs.get('user_id'))
+        if refused is not None:
+            return refused
+        return view(*args, **kwargs)
+    return wrapper
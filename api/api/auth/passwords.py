@@ -0,0 +1,38 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from threading import BoundedSemaphore
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HasherBusy(Exception):
+    pass
+
+
+# password hashes are deliberately slow, so they run on a few threads of their own; hashlib releases the GIL while
+# it hashes, and once workers + queue hashes are pending further ones are refused instead of piling up. A hash
+# still waiting after the timeout is refused the same way, and finishes in the background
+class PasswordHasher:
+    def __init__(self, workers=2, queue=16, timeout=10):
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._slots = BoundedSemaphore(workers + queue)
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda future: self._slots.release())
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            raise HasherBusy()
+
+    def check(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def generate(self, password):
+        return self._run(generate_password_hash, password)
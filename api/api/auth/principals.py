@@ -0,0 +1,40 @@
+from api.database.models import pokedex
+
+from collections import OrderedDict, namedtuple
+from threading import Lock
+
+PRINCIPAL_CACHE_SIZE = 1024
+
+Principal = namedtuple('Principal', ['id', 'username', 'team_id'])
+
+
+# the few user columns requests need about who is calling, kept per process for the most recent users
+class PrincipalCache:
+    def __init__(self, size=PRINCIPAL_CACHE_SIZE):
+        self.size = size
+        self._principals = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            principal = self._principals.get(user_id)
+            if principal is not None:
+                self._principals.move_to_end(user_id)
+                return principal
+        row = pokedex.User.query.with_entities(pokedex.User.id, pokedex.User.username, pokedex.User.team_id) \
+            .filter_by(id=user_id).first()
+        if row is None:
+            return None
+        return self.put(Principal(*row))
+
+    def put(self, principal):
+        with self._lock:
+            self._principals[principal.id] = principal
+            self._principals.move_to_end(principal.id)
+            while len(self._principals) > self.size:
+                self._principals.popitem(last=False)
+        return principal
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._principals.pop(user_id, None)
@@ -0,0 +1,116 @@
+from api.database import uncounted
+from api.database.models import pokedex
+
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
+from uuid import uuid4
+import logging
+import os
+
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+from sqlalchemy.exc import IntegrityError
+
+log = logging.getLogger(__name__)
+
+TOKEN_SALT = 'api-token'
+
+
+class InvalidToken(Exception):
+    pass
+
+
+# bearer tokens are the user id and a token id signed with SECRET_KEY (HMAC) and a timestamp, so checking one
+# needs the key and the clock but not the database
+class TokenSigner:
+    def __init__(self, secret_key, max_age):
+        self.max_age = max_age
+        self._serializer = URLSafeTimedSerializer(secret_key, salt=TOKEN_SALT)
+
+    def issue(self, user_id):
+        return self._serializer.dumps({'uid': user_id, 'jti': uuid4().hex})
+
+    # the claims of a valid token, with the time it expires as 'exp', InvalidToken otherwise
+    def verify(self, token):
+        try:
+            claims, issued = self._serializer.loads(token, max_age=self.max_age, return_timestamp=True)
+        except SignatureExpired:
+            raise InvalidToken('Token expired.')
+        except BadSignature:
+            raise InvalidToken('Invalid token.')
+        if not isinstance(claims, dict) or 'uid' not in claims or 'jti' not in claims:
+            raise InvalidToken('Invalid token.')
+        # naive utc like the rest of the tables, newer itsdangerous releases return an aware datetime
+        claims['exp'] = issued.replace(tzinfo=None) + timedelta(seconds=self.max_age)
+        return claims
+
+
+# ids of revoked tokens that have not expired yet; revocations are written to the revoked_token table and every
+# process reloads the table in the background, so checking a token is a set lookup. The first lookup of a process
+# loads the table itself, so a fresh or forked worker never accepts a revoked token
+class RevocationList:
+    def __init__(self):
+        self._app = None
+        self._db = None
+        self._revoked = frozenset()
+        self._lock = Lock()
+        self._pid = None
+        self._stopped = Event()
+
+    def init_app(self, app, db):
+        app.config.setdefault('AUTH_REVOCATION_REFRESH', 30)
+        self._app = app
+        self._db = db
+
+    def __contains__(self, jti):
+        self._ensure_refreshing()
+        return jti in self._revoked
+
+    # kept until the token would have expired anyway, see TokenSigner.verify; revoking a token twice, say from a
+    # worker that has not reloaded the table since, is a no-op
+    def revoke(self, jti, expires):
+        session = self._db.session
+        session.add(pokedex.RevokedToken(jti=jti, expires=expires))
+        try:
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+        with self._lock:
+            self._revoked = self._revoked | {jti}
+
+    def refresh(self):
+        session = self._db.session
+        now = datetime.utcnow()
+        pokedex.RevokedToken.query.filter(pokedex.RevokedToken.expires <= now).delete(synchronize_session=False)
+        session.commit()
+        revoked = frozenset(jti for jti, in session.query(pokedex.RevokedToken.jti))
+        with self._lock:
+            self._revoked = revoked
+
+    # unexpired revocations, read without committing as the caller may be in the middle of a request
+    def _load(self):
+        with uncounted():
+            return frozenset(jti for jti, in self._db.session.query(pokedex.RevokedToken.jti)
+                             .filter(pokedex.RevokedToken.expires > datetime.utcnow()))
+
+    # threads do not survive a fork, so every process loads the table and starts its own refresher on first use;
+    # lookups wait for the load rather than pass revoked tokens
+    def _ensure_refreshing(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._revoked = self._load()
+            self._pid = os.getpid()
+        Thread(target=self._refresh_forever, name='token-revocations', daemon=True).start()
+
+    def _refresh_forever(self):
+        with self._app.app_context():
+            while True:
+                try:
+                    self.refresh()
+                except Exception:
+                    log.exception('could not reload revoked tokens')
+                    self._db.session.rollback()
+                if self._stopped.wait(self._app.config['AUTH_REVOCATION_REFRESH']):
+                    return
@@ -0,0 +1,3 @@
+from .explain import explain_routes, query_plan, LARGE_TABLES
+from .population import seed_population
+from .runner import compare_results, run_benchmark, ROUTES
@@ -0,0 +1,85 @@
+from api.database import engines
+from .runner import ROUTES, Targets
+
+from collections import namedtuple, OrderedDict
+import random
+import re
+
+from sqlalchemy import event
+
+# tables that grow with the users, a full scan of any of them gets slower with every sign up. revoked_token is
+# left out: it only holds unexpired revocations and the revocation list reads it whole on purpose
+LARGE_TABLES = frozenset([
+    'user', 'user_pokemon', 'user_pokemon_appraisal_iv', 'user_item', 'user_medal', 'user_egg', 'user_candy',
+    'user_log', 'tombstone', 'spawn_cell', 'job',
+])
+# statements whose plan can change with the tables, inserts of literal rows always have the same one
+EXPLAINED = re.compile(r'^\s*(SELECT|UPDATE|DELETE|WITH)\b', re.IGNORECASE)
+# SCAN user_pokemon, SCAN TABLE user_pokemon AS u USING INDEX ..., before and after sqlite 3.36
+SQLITE_SCAN = re.compile(r'^SCAN (?:TABLE )?"?(\w+)"?')
+POSTGRES_SCAN = re.compile(r'Seq Scan on "?(\w+)"?')
+
+Statement = namedtuple('Statement', 'sql parameters plan scans')
+
+
+class StatementLog:
+    def __init__(self, app):
+        self.statements = []
+        self._engines = engines(app)
+        for engine in self._engines:
+            event.listen(engine, 'before_cursor_execute', self.append)
+
+    def append(self, conn, cursor, statement, parameters, context, executemany):
+        if not executemany and EXPLAINED.match(statement):
+            self.statements.append((conn.engine, statement, parameters))
+
+    def close(self):
+        for engine in self._engines:
+            event.remove(engine, 'before_cursor_execute', self.append)
+
+
+# the plan as text lines and the large tables it reads in full; EXPLAIN without ANALYZE runs nothing
+def query_plan(engine, statement, parameters):
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        if engine.dialect.name == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+            plan = [row[-1] for row in cursor.fetchall()]
+            pattern = SQLITE_SCAN
+        else:
+            cursor.execute('EXPLAIN ' + statement, parameters)
+            plan = [row[0] for row in cursor.fetchall()]
+            pattern = POSTGRES_SCAN
+        cursor.close()
+    finally:
+        connection.close()
+    scans = sorted({match.group(1) for match in map(pattern.search, plan) if match} & LARGE_TABLES)
+    return plan, scans
+
+
+# one request per route through the test client, every statement it runs explained afterwards; returns
+# route name: [Statement], each distinct statement once. A first unlogged request leaves out what is loaded on
+# first use, like the catalog snapshot. Postgres prefers sequential scans of small tables, so the database should
+# hold a seeded population, see seed-benchmark
+def explain_routes(app, db, routes=None, seed=0):
+    targets = Targets(db)
+    client = app.test_client()
+    results = OrderedDict()
+    for name in routes or list(ROUTES):
+        rng = random.Random(seed)
+        method, path, data = ROUTES[name](targets, rng)
+        client.open(path, method=method, data=data, headers=targets.headers(path)).get_data()
+        method, path, data = ROUTES[name](targets, rng)
+        log = StatementLog(app)
+        try:
+            client.open(path, method=method, data=data, headers=targets.headers(path)).get_data()
+        finally:
+            log.close()
+        statements = OrderedDict()
+        for engine, statement, parameters in log.statements:
+            if statement not in statements:
+                plan, scans = query_plan(engine, statement, parameters)
+                statements[statement] = Statement(statement, parameters, plan, scans)
+        results[name] = list(statements.values())
+    return results
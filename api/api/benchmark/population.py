@@ -0,0 +1,112 @@
+from api.catalog import catalog
+from api.catalog.iv import CP_MULTIPLIERS, LEVEL_STARDUST, LEVELS, MAX_IV, MIN_HP, OVERALL_IV_RANGES
+from api.database.models import pokedex
+from api.spawns import rebuild_spawn_cells
+from api.spawns.tiles import geohash
+from api.stats import rebuild_rollups
+
+from datetime import date, timedelta
+import logging
+import uuid
+
+import numpy as np
+from sqlalchemy import func
+from werkzeug.security import generate_password_hash
+
+log = logging.getLogger(__name__)
+
+USERNAME = 'bench{0}'
+PASSWORD = 'benchmark'
+TEAM_IDS = (1, 2, 3)
+# catches are scattered over this box, (south, west, north, east), roughly the San Francisco bay
+CATCH_AREA = (37.2, -122.6, 38.0, -121.8)
+FIRST_CATCH = date(2016, 7, 6)
+CATCH_DAYS = 365
+BATCH_SIZE = 10000
+
+
+def _overall(total):
+    overall = np.zeros(len(total), dtype=np.intp)
+    for overall_id, (low, high) in OVERALL_IV_RANGES.items():
+        overall[(total >= low) & (total <= high)] = overall_id
+    return overall
+
+
+# pokemon whose cp, hp and power up cost come from real levels and ivs, so the iv and evolution routes have
+# candidates to find
+def _user_pokemon(rng, snapshot, user_ids):
+    count = len(user_ids)
+    calculator = snapshot.ivs
+    species = np.array(sorted(snapshot.pokemon), dtype=np.intp)
+    pokemon_id = species[rng.randint(len(species), size=count)]
+    level = rng.randint(len(LEVELS), size=count)
+    attack, defense, stamina = (rng.randint(MAX_IV + 1, size=count) for _ in range(3))
+    cp = calculator.cp(pokemon_id, LEVELS[level], attack, defense, stamina)
+    hp = np.maximum(np.floor(calculator.stamina[pokemon_id, stamina] * CP_MULTIPLIERS[level]), MIN_HP)
+    overall = _overall(attack + defense + stamina)
+    latitude = rng.uniform(CATCH_AREA[0], CATCH_AREA[2], size=count)
+    longitude = rng.uniform(CATCH_AREA[1], CATCH_AREA[3], size=count)
+    days = rng.randint(CATCH_DAYS, size=count)
+
+    rows = []
+    for i in range(count):
+        pokemon = snapshot.pokemon[int(pokemon_id[i])]
+        fast = pokemon.fast_attacks[rng.randint(len(pokemon.fast_attacks))] if pokemon.fast_attacks else None
+        charge = pokemon.charge_attacks[rng.randint(len(pokemon.charge_attacks))] if pokemon.charge_attacks else None
+        rows.append({
+            'user_id': int(user_ids[i]),
+            'pokemon_id': pokemon.id,
+            'guid': uuid.UUID(int=int(rng.randint(1 << 62)) << 64 | int(rng.randint(1 << 62))),
+            'cp': int(cp[i]),
+            'hp': int(hp[i]),
+            'attack': int(attack[i]),
+            'defense': int(defense[i]),
+            'stamina': int(stamina[i]),
+            'power_up_stardust': int(LEVEL_STARDUST[level[i]]),
+            'fast_attack_id': fast and fast.id,
+            'charge_attack_id': charge and charge.id,
+            'appraisal_overall_id': int(overall[i]) or None,
+            'caught_location': '{0:.6f},{1:.6f}'.format(latitude[i], longitude[i]),
+            'caught_latitude': float(latitude[i]),
+            'caught_longitude': float(longitude[i]),
+            'caught_geohash': geohash(latitude[i], longitude[i]),
+            'caught_date': FIRST_CATCH + timedelta(days=int(days[i])),
+        })
+    return rows
+
+
+# adds users, bench0 and up, with pokemon_per_user pokemon and candy for each of their families; rows are written
+# with core inserts a batch at a time and the rollups and spawn counts are rebuilt once at the end
+def seed_population(db, users, pokemon_per_user, seed=0, batch_size=BATCH_SIZE):
+    session = db.session
+    snapshot = catalog.snapshot
+    rng = np.random.RandomState(seed)
+    password = generate_password_hash(PASSWORD)
+    first_user_id = (session.query(func.max(pokedex.User.id)).scalar() or 0) + 1
+    first_name = session.query(func.count(pokedex.User.id)) \
+        .filter(pokedex.User.username.like(USERNAME.format('%'))).scalar()
+    users_per_batch = max(1, batch_size // max(1, pokemon_per_user))
+
+    for start in range(0, users, users_per_batch):
+        user_ids = np.arange(first_user_id + start, first_user_id + min(users, start + users_per_batch))
+        session.execute(pokedex.User.__table__.insert(), [{
+            'id': int(user_id),
+            'username': USERNAME.format(first_name + user_id - first_user_id),
+            'email': '{0}@example.com'.format(USERNAME.format(first_name + user_id - first_user_id)),
+            'password': password,
+            'team_id': TEAM_IDS[rng.randint(len(TEAM_IDS))],
+        } for user_id in user_ids])
+        rows = _user_pokemon(rng, snapshot, np.repeat(user_ids, pokemon_per_user))
+        if rows:
+            session.execute(pokedex.UserPokemon.__table__.insert(), rows)
+        families = sorted({(row['user_id'], int(snapshot.evolutions.family[row['pokemon_id']])) for row in rows})
+        if families:
+            session.execute(pokedex.UserCandy.__table__.insert(), [
+                {'user_id': user_id, 'pokemon_id': pokemon_id, 'count': int(rng.randint(400))}
+                for user_id, pokemon_id in families])
+        session.commit()
+        log.info('seeded %d of %d users', min(users, start + users_per_batch), users)
+
+    rebuild_rollups(session)
+    rebuild_spawn_cells(session)
+    return first_user_id, first_user_id + users - 1
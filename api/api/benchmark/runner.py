@@ -0,0 +1,282 @@
+from api.auth import auth
+from api.database import engines
+from api.database.models import pokedex
+from .population import CATCH_AREA, PASSWORD, USERNAME
+
+from collections import OrderedDict
+from datetime import datetime
+from http.client import HTTPConnection
+from threading import Thread
+from time import perf_counter
+from urllib.parse import urlencode, urlsplit
+import os
+import random
+import re
+import subprocess
+import uuid
+
+import numpy as np
+from sqlalchemy import event, func
+
+TARGET_SAMPLE = 1000
+PERCENTILES = (50, 95, 99)
+USER_PATH = re.compile(r'^/api/users/(\d+)')
+
+
+# ids and names the routes are driven with, sampled once from the database
+class Targets:
+    def __init__(self, db):
+        session = db.session
+        self.pokemon = session.query(pokedex.Pokemon.id, pokedex.Pokemon.name).order_by(pokedex.Pokemon.id).all()
+        self.users = [user_id for user_id, in session.query(pokedex.UserPokemon.user_id).distinct()
+                      .order_by(pokedex.UserPokemon.user_id).limit(TARGET_SAMPLE)]
+        # users created by seed_population, whose password is known
+        self.usernames = [username for username, in session.query(pokedex.User.username)
+                          .filter(pokedex.User.username.like(USERNAME.format('%'))).limit(TARGET_SAMPLE)]
+        self.user_pokemon = session.query(pokedex.UserPokemon.user_id, pokedex.UserPokemon.id) \
+            .order_by(pokedex.UserPokemon.id.desc()).limit(TARGET_SAMPLE).all()
+        self.population = {
+            'users': session.query(func.count(pokedex.User.id)).scalar(),
+            'user_pokemon': session.query(func.count(pokedex.UserPokemon.id)).scalar(),
+        }
+        self._tokens = {}
+        session.remove()
+
+    # user routes are called as their owner
+    def headers(self, path):
+        match = USER_PATH.match(path)
+        if match is None:
+            return {}
+        user_id = int(match.group(1))
+        if user_id not in self._tokens:
+            self._tokens[user_id] = auth.signer.issue(user_id)
+        return {'Authorization': 'Bearer ' + self._tokens[user_id]}
+
+
+def _name(targets, rng):
+    return rng.choice(targets.pokemon)[1]
+
+
+def _user(targets, rng):
+    return rng.choice(targets.users)
+
+
+def _spawns(targets, rng):
+    south, west, north, east = CATCH_AREA
+    return 'GET', '/api/pokemon/{0}/spawns?bbox={1},{2},{3},{4}&zoom=10'.format(
+        _name(targets, rng), west, south, east, north), None
+
+
+def _add_pokemon(targets, rng):
+    pokemon_id = rng.choice(targets.pokemon)[0]
+    return 'POST', '/api/users/{0}/pokemon'.format(_user(targets, rng)), {
+        'pokemon_id': pokemon_id, 'cp': rng.randint(10, 2000), 'hp': rng.randint(10, 150), 'guid': str(uuid.uuid4())}
+
+
+# route name: (targets, rng) -> (method, path, form data)
+ROUTES = OrderedDict([
+    ('health', lambda targets, rng: ('GET', '/api/health', None)),
+    ('login', lambda targets, rng: ('POST', '/api/login', {'username': rng.choice(targets.usernames),
+                                                           'password': PASSWORD})),
+    ('pokemon', lambda targets, rng: ('GET', '/api/pokemon/{0}'.format(_name(targets, rng)), None)),
+    ('pokemon-id', lambda targets, rng: ('GET', '/api/pokemon/{0}'.format(rng.choice(targets.pokemon)[0]), None)),
+    ('ideal-moveset', lambda targets, rng: ('GET', '/api/pokemon/{0}/ideal-moveset'.format(_name(targets, rng)),
+                                            None)),
+    ('vs', lambda targets, rng: ('GET', '/api/pokemon/{0}/vs/{1}'.format(_name(targets, rng), _name(targets, rng)),
+                                 None)),
+    ('counters', lambda targets, rng: ('GET', '/api/pokemon/{0}/counters'.format(_name(targets, rng)), None)),
+    ('pokemon-evolutions', lambda targets, rng: ('GET', '/api/pokemon/{0}/evolutions'.format(_name(targets, rng)),
+                                                 None)),
+    ('spawns', _spawns),
+    ('user', lambda targets, rng: ('GET', '/api/users/{0}'.format(_user(targets, rng)), None)),
+    ('user-pokemon', lambda targets, rng: ('GET', '/api/users/{0}/pokemon'.format(_user(targets, rng)), None)),
+    ('user-pokemon-ndjson', lambda targets, rng: (
+        'GET', '/api/users/{0}/pokemon?format=ndjson&limit=1000'.format(_user(targets, rng)), None)),
+    ('user-pokemon-filtered', lambda targets, rng: ('GET', '/api/users/{0}/pokemon?pokemon_id={1}'.format(
+        _user(targets, rng), rng.choice(targets.pokemon)[0]), None)),
+    ('user-pokemon-export', lambda targets, rng: (
+        'GET', '/api/users/{0}/pokemon/export?format=ndjson'.format(_user(targets, rng)), None)),
+    ('user-changes', lambda targets, rng: ('GET', '/api/users/{0}/changes'.format(_user(targets, rng)), None)),
+    ('user-ivs', lambda targets, rng: ('GET', '/api/users/{0}/pokemon/iv'.format(_user(targets, rng)), None)),
+    ('user-pokemon-iv', lambda targets, rng: (
+        'GET', '/api/users/{0}/pokemon/{1}/iv'.format(*rng.choice(targets.user_pokemon)), None)),
+    ('user-evolutions', lambda targets, rng: ('GET', '/api/users/{0}/evolutions'.format(_user(targets, rng)), None)),
+    ('stats', lambda targets, rng: ('GET', '/api/stats/pokemon', None)),
+    ('stats-pokemon', lambda targets, rng: ('GET', '/api/stats/pokemon/{0}'.format(_name(targets, rng)), None)),
+    ('stats-teams', lambda targets, rng: ('GET', '/api/stats/teams', None)),
+    ('add-pokemon', _add_pokemon),
+])
+
+
+# resident set size of this process right now, None where /proc is missing. ru_maxrss would be the peak of the whole
+# process, so a route would inherit the peak of every route run before it
+def rss_kb():
+    try:
+        with open('/proc/self/statm') as statm:
+            resident = int(statm.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+# rss is (at the start of the route, highest sampled after each request), reported as that peak and its growth
+def summarize(latencies, elapsed, errors, statements=None, rss=None):
+    latencies = np.array(latencies) * 1000
+    summary = OrderedDict([
+        ('requests', len(latencies)),
+        ('errors', errors),
+        ('seconds', round(elapsed, 3)),
+        ('throughput', round(len(latencies) / elapsed, 1) if elapsed else None),
+        ('latency_ms', OrderedDict(
+            [('mean', round(float(latencies.mean()), 3))] +
+            [('p{0}'.format(p), round(float(np.percentile(latencies, p)), 3)) for p in PERCENTILES] +
+            [('max', round(float(latencies.max()), 3))]) if len(latencies) else None),
+        ('sql_statements', None),
+        ('peak_rss_kb', None),
+        ('rss_growth_kb', None),
+    ])
+    if rss and None not in rss:
+        summary['peak_rss_kb'] = rss[1]
+        summary['rss_growth_kb'] = rss[1] - rss[0]
+    if statements:
+        summary['sql_statements'] = OrderedDict([('mean', round(float(np.mean(statements)), 2)),
+                                                 ('max', int(np.max(statements)))])
+    return summary
+
+
+class StatementCounter:
+    def __init__(self, app):
+        self.count = 0
+        self._engines = engines(app)
+        for engine in self._engines:
+            event.listen(engine, 'before_cursor_execute', self.increment)
+
+    def increment(self, *args):
+        self.count += 1
+
+    def close(self):
+        for engine in self._engines:
+            event.remove(engine, 'before_cursor_execute', self.increment)
+
+
+# every route in turn through the test client, in this process, so statements and rss can be measured
+def run_client(app, targets, routes, requests, warmup=5, seed=0):
+    client = app.test_client()
+    counter = StatementCounter(app)
+    results = OrderedDict()
+    try:
+        for name in routes:
+            rng = random.Random(seed)
+            plan = [ROUTES[name](targets, rng) for _ in range(warmup + requests)]
+            for method, path, data in plan[:warmup]:
+                client.open(path, method=method, data=data, headers=targets.headers(path)).get_data()
+            latencies, statements = [], []
+            errors = 0
+            baseline = peak = rss_kb()
+            start = perf_counter()
+            for method, path, data in plan[warmup:]:
+                counter.count = 0
+                begin = perf_counter()
+                response = client.open(path, method=method, data=data, headers=targets.headers(path))
+                response.get_data()
+                latencies.append(perf_counter() - begin)
+                statements.append(counter.count)
+                errors += response.status_code >= 400
+                if baseline is not None:
+                    peak = max(peak, rss_kb())
+            results[name] = summarize(latencies, perf_counter() - start, errors, statements, (baseline, peak))
+    finally:
+        counter.close()
+    return results
+
+
+def _http_worker(host, port, targets, plan, latencies, statements, errors):
+    connection = HTTPConnection(host, port)
+    for method, path, data in plan:
+        body = urlencode(data) if data else None
+        headers = targets.headers(path)
+        if data:
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        begin = perf_counter()
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+        except (OSError, ValueError):
+            connection.close()
+            connection = HTTPConnection(host, port)
+            errors.append(path)
+            continue
+        latencies.append(perf_counter() - begin)
+        if response.status >= 400:
+            errors.append(path)
+        # only sent by servers running in debug mode
+        count = response.getheader('X-SQL-Statements')
+        if count is not None:
+            statements.append(int(count))
+    connection.close()
+
+
+# every route in turn against a running server, concurrency keep-alive connections at a time
+def run_http(base_url, targets, routes, requests, concurrency=8, warmup=5, seed=0):
+    url = urlsplit(base_url)
+    results = OrderedDict()
+    for name in routes:
+        rng = random.Random(seed)
+        plan = [ROUTES[name](targets, rng) for _ in range(warmup + requests)]
+        _http_worker(url.hostname, url.port or 80, targets, plan[:warmup], [], [], [])
+        latencies, statements, errors = [], [], []
+        threads = [Thread(target=_http_worker, args=(url.hostname, url.port or 80, targets,
+                                                     plan[warmup + i::concurrency], latencies, statements, errors))
+                   for i in range(concurrency)]
+        start = perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results[name] = summarize(latencies, perf_counter() - start, len(errors), statements)
+    return results
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(app, db, routes=None, requests=200, warmup=5, url=None, concurrency=8, seed=0):
+    targets = Targets(db)
+    routes = routes or list(ROUTES)
+    if url:
+        results = run_http(url, targets, routes, requests, concurrency, warmup, seed)
+    else:
+        results = run_client(app, targets, routes, requests, warmup, seed)
+    return OrderedDict([
+        ('created', datetime.utcnow().isoformat() + 'Z'),
+        ('commit', current_commit()),
+        ('mode', 'http' if url else 'client'),
+        ('url', url),
+        ('concurrency', concurrency if url else 1),
+        ('population', targets.population),
+        ('routes', results),
+    ])
+
+
+# (route, metric, base, new, change in percent) for the routes both runs measured
+def compare_results(base, new):
+    rows = []
+    for name, result in new['routes'].items():
+        previous = base['routes'].get(name)
+        if previous is None:
+            continue
+        metrics = [('throughput', previous['throughput'], result['throughput'])]
+        if previous['latency_ms'] and result['latency_ms']:
+            metrics += [('p{0}'.format(p), previous['latency_ms']['p{0}'.format(p)],
+                         result['latency_ms']['p{0}'.format(p)]) for p in PERCENTILES]
+        if previous['sql_statements'] and result['sql_statements']:
+            metrics.append(('sql', previous['sql_statements']['mean'], result['sql_statements']['mean']))
+        for metric, before, after in metrics:
+            change = (after - before) * 100.0 / before if before and after is not None else None
+            rows.append((name, metric, before, after, change))
+    return rows
@@ -0,0 +1,2 @@
+from .responses import versioned_response
+from .snapshot import catalog, setup_catalog
@@ -0,0 +1,215 @@
+from .cache import ResponseCache
+from .iv import CP_MULTIPLIERS, MAX_IV, MIN_HP
+from .moveset import STAB_BONUS
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import os
+import zlib
+
+import numpy as np
+
+BATTLE_SECONDS = 100
+BATTLE_LEVEL = 30
+MAX_ENERGY = 100
+# gym defenders waited this long on top of each move's cooldown
+DEFENDER_DELAY = (1.5, 2.0)
+# chance a defender with enough energy uses its charge move instead of its fast move
+DEFENDER_CHARGE_CHANCE = 0.5
+BATTLES = 200
+MAX_BATTLES = 10000
+# requests simulate on their own thread, so they get far fewer battles than the jobs on the process pool
+MAX_REQUEST_BATTLES = 1000
+# battles of one task on the process pool, big enough to amortize pickling and small enough to spread out
+POOL_CHUNK = 500
+SIMULATION_CACHE_SIZE = 65536
+
+# base stats and both moves of one side, with stab and effectiveness against the other side already applied
+Combatant = namedtuple('Combatant', [
+    'attack', 'defense', 'stamina',
+    'fast_power', 'fast_energy', 'fast_cooldown', 'fast_multiplier',
+    'charge_power', 'charge_energy', 'charge_cooldown', 'charge_multiplier',
+])
+# sums over a number of battles, so chunks simulated apart add up
+BattleTotals = namedtuple('BattleTotals', ['battles', 'wins', 'win_seconds', 'damage', 'damage_taken', 'seconds'])
+
+
+def _stats(rng, combatant, battles, multiplier):
+    attack = (combatant.attack + rng.randint(MAX_IV + 1, size=battles)) * multiplier
+    defense = (combatant.defense + rng.randint(MAX_IV + 1, size=battles)) * multiplier
+    hp = np.maximum(np.floor((combatant.stamina + rng.randint(MAX_IV + 1, size=battles)) * multiplier), MIN_HP)
+    return attack, defense, hp
+
+
+def _damage(power, move_multiplier, attack, defense):
+    return np.floor(0.5 * power * attack / defense * move_multiplier) + 1
+
+
+# battles of the attacker against the defender with random ivs on both sides, played move by move: fast moves gain
+# energy, charge moves spend it once enough has been gained, taking damage gains half of it as energy and the
+# defender waits between moves; a battle is won when the defender faints first within BATTLE_SECONDS
+def simulate(attacker, defender, battles=BATTLES, seed=0, level=BATTLE_LEVEL):
+    rng = np.random.RandomState(seed)
+    multiplier = CP_MULTIPLIERS[int(level * 2) - 2]
+    attacker_attack, attacker_defense, attacker_hp = _stats(rng, attacker, battles, multiplier)
+    defender_attack, defender_defense, defender_hp = _stats(rng, defender, battles, multiplier)
+    attacker_fast = _damage(attacker.fast_power, attacker.fast_multiplier, attacker_attack, defender_defense)
+    attacker_charge = _damage(attacker.charge_power, attacker.charge_multiplier, attacker_attack, defender_defense)
+    defender_fast = _damage(defender.fast_power, defender.fast_multiplier, defender_attack, attacker_defense)
+    defender_charge = _damage(defender.charge_power, defender.charge_multiplier, defender_attack, attacker_defense)
+
+    attacker_energy = np.zeros(battles)
+    defender_energy = np.zeros(battles)
+    attacker_next = np.zeros(battles)
+    defender_next = rng.uniform(*DEFENDER_DELAY, size=battles)
+    damage = np.zeros(battles)
+    damage_taken = np.zeros(battles)
+    ended = np.full(battles, float(BATTLE_SECONDS))
+    won = np.zeros(battles, dtype=bool)
+    active = np.ones(battles, dtype=bool)
+
+    while active.any():
+        now = np.minimum(attacker_next, defender_next)
+        active &= now < BATTLE_SECONDS
+
+        acts = active & (attacker_next <= defender_next)
+        charge = acts & (attacker_energy >= attacker.charge_energy)
+        hit = np.where(charge, attacker_charge, attacker_fast) * acts
+        attacker_energy += (acts & ~charge) * attacker.fast_energy - charge * attacker.charge_energy
+        attacker_next += acts * np.where(charge, attacker.charge_cooldown, attacker.fast_cooldown)
+        damage += np.minimum(hit, np.maximum(defender_hp, 0))
+        defender_hp -= hit
+        defender_energy += np.ceil(hit / 2)
+
+        acts = active & ~acts
+        charge = acts & (defender_energy >= defender.charge_energy) & \
+            (rng.random_sample(battles) < DEFENDER_CHARGE_CHANCE)
+        hit = np.where(charge, defender_charge, defender_fast) * acts
+        defender_energy += (acts & ~charge) * defender.fast_energy - charge * defender.charge_energy
+        defender_next += acts * (np.where(charge, defender.charge_cooldown, defender.fast_cooldown) +
+                                 rng.uniform(*DEFENDER_DELAY, size=battles))
+        damage_taken += np.minimum(hit, np.maximum(attacker_hp, 0))
+        attacker_hp -= hit
+        attacker_energy += np.ceil(hit / 2)
+
+        np.minimum(attacker_energy, MAX_ENERGY, out=attacker_energy)
+        np.minimum(defender_energy, MAX_ENERGY, out=defender_energy)
+        finished = active & ((defender_hp <= 0) | (attacker_hp <= 0))
+        won |= finished & (defender_hp <= 0)
+        ended[finished] = now[finished]
+        active &= ~finished
+
+    return BattleTotals(battles, int(won.sum()), float(ended[won].sum()), float(damage.sum()),
+                        float(damage_taken.sum()), float(ended.sum()))
+
+
+def _simulate_task(args):
+    return simulate(*args)
+
+
+def summarize(totals):
+    return {
+        'battles': totals.battles,
+        'win_rate': round(totals.wins / totals.battles, 4),
+        'time_to_win': round(totals.win_seconds / totals.wins, 2) if totals.wins else None,
+        'damage': round(totals.damage / totals.battles, 1),
+        'damage_taken': round(totals.damage_taken / totals.battles, 1),
+        'dps': round(totals.damage / totals.seconds, 2) if totals.seconds else None,
+    }
+
+
+_pool = None
+_pool_pid = None
+
+
+# one pool per process, a forked server worker starts its own. Only jobs use it: the pool forks its processes on
+# first use, and forking a threaded server from a request can deadlock on locks other threads hold
+def battle_pool(workers=None):
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count())
+        _pool_pid = os.getpid()
+    return _pool
+
+
+class BattleSimulator:
+    def __init__(self, snapshot):
+        self.movesets = snapshot.movesets
+        self._results = ResponseCache(SIMULATION_CACHE_SIZE)
+
+    def combatant(self, pokemon, fast, charge, opponent):
+        engine = self.movesets
+        own_types = engine.type_mask(pokemon.types)
+        effectiveness = engine.defender_multiplier(engine.type_mask(opponent.types))
+
+        def multiplier(attack):
+            attack_type = engine.attack_type[engine.attack_index[attack.id]]
+            return (STAB_BONUS if own_types[attack_type] else 1.0) * effectiveness[attack_type]
+
+        return Combatant(float(pokemon.attack), float(pokemon.defense), float(pokemon.stamina),
+                         float(fast.power), float(fast.energy), float(fast.cooldown_time), multiplier(fast),
+                         float(charge.power), float(-charge.energy), float(charge.cooldown_time), multiplier(charge))
+
+    # the defender answers with its best moveset by dps against the attacker
+    def matchup(self, attacker, fast, charge, defender):
+        defender_fast, defender_charge = self.movesets.best_moveset(defender, attacker)
+        return (self.combatant(attacker, fast, charge, defender),
+                self.combatant(defender, defender_fast, defender_charge, attacker))
+
+    # totals of every (attacker, fast, charge, defender) matchup, cached; seeds derive from the matchup so a result
+    # never depends on what else was simulated. Given a process pool, see battle_pool, uncached battles beyond one
+    # chunk are spread over it, otherwise they run on the calling thread
+    def simulate_all(self, matchups, battles=BATTLES, pool=None):
+        keys = [(attacker.id, fast.id, charge.id, defender.id, battles)
+                for attacker, fast, charge, defender in matchups]
+        results = {key: self._results.get(key) for key in keys}
+        missing = [(key, matchup) for key, matchup in zip(keys, matchups) if results[key] is None]
+
+        tasks = []
+        for key, (attacker, fast, charge, defender) in missing:
+            sides = self.matchup(attacker, fast, charge, defender)
+            seed = zlib.crc32(repr(key).encode('utf-8'))
+            for start in range(0, battles, POOL_CHUNK):
+                tasks.append((key, sides + (min(POOL_CHUNK, battles - start), seed + start)))
+        if pool is not None and len(tasks) > 1:
+            totals = pool.map(_simulate_task, [args for _, args in tasks])
+        else:
+            totals = (_simulate_task(args) for _, args in tasks)
+
+        for (key, _), chunk in zip(tasks, totals):
+            previous = results[key]
+            results[key] = chunk if previous is None else BattleTotals(*(a + b for a, b in zip(previous, chunk)))
+        for key, _ in missing:
+            self._results.put(key, results[key])
+        return [results[key] for key in keys]
+
+    # every moveset of the attacker against the defender, best first
+    def movesets_against(self, attacker, defender, battles=BATTLES, pool=None):
+        movesets = [(fast, charge) for fast in attacker.fast_attacks for charge in attacker.charge_attacks]
+        totals = self.simulate_all([(attacker, fast, charge, defender) for fast, charge in movesets], battles,
+                                   pool)
+        ranked = sorted(zip(movesets, totals), key=lambda item: _rank(item[1]))
+        return [(fast, charge, summarize(total)) for (fast, charge), total in ranked]
+
+    def best_moveset(self, attacker, defender, battles=BATTLES, pool=None):
+        fast, charge, _ = self.movesets_against(attacker, defender, battles, pool)[0]
+        return fast, charge
+
+    # every moveset of every species against the defender, keeping the best per species, best first
+    def counters(self, defender, battles=BATTLES, pool=None):
+        engine = self.movesets
+        roster = [(pokemon, engine.attacks[fast], engine.attacks[charge])
+                  for pokemon, fast, charge in zip(engine.roster, engine.roster_fast, engine.roster_charge)]
+        totals = self.simulate_all([(pokemon, fast, charge, defender) for pokemon, fast, charge in roster], battles,
+                                   pool)
+        best = {}
+        for (pokemon, fast, charge), total in zip(roster, totals):
+            if pokemon.id not in best or _rank(total) < _rank(best[pokemon.id][3]):
+                best[pokemon.id] = pokemon, fast, charge, total
+        ranked = sorted(best.values(), key=lambda item: (_rank(item[3]), item[0].id))
+        return [(pokemon, fast, charge, summarize(total)) for pokemon, fast, charge, total in ranked]
+
+
+# most wins, then fastest wins, then most damage
+def _rank(totals):
+    return -totals.wins, totals.win_seconds / totals.wins if totals.wins else 0, -totals.damage
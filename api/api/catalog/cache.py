@@ -0,0 +1,28 @@
+from collections import OrderedDict
+from threading import Lock
+
+RESPONSE_CACHE_SIZE = 4096
+
+
+class ResponseCache:
+    def __init__(self, size=RESPONSE_CACHE_SIZE):
+        self.size = size
+        self._responses = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            response = self._responses.get(key)
+            if response is not None:
+                self._responses.move_to_end(key)
+            return response
+
+    def put(self, key, response):
+        with self._lock:
+            self._responses[key] = response
+            self._responses.move_to_end(key)
+            while len(self._responses) > self.size:
+                self._responses.popitem(last=False)
+
+    def __len__(self):
+        return len(self._responses)
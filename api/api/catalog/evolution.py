@@ -0,0 +1,84 @@
+import numpy as np
+
+
+class EvolutionIndex:
+    def __init__(self, snapshot):
+        size = max(snapshot.pokemon) + 1 if snapshot.pokemon else 1
+        # first species of every evolution family, candy is shared by the whole family
+        self.family = np.arange(size)
+        for pokemon_id in sorted(snapshot.pokemon):
+            pokemon = snapshot.pokemon[pokemon_id]
+            while pokemon.evolves_from:
+                pokemon = pokemon.evolves_from[0]
+            self.family[pokemon_id] = pokemon.id
+
+        # transitive closure of evolves_to, one (from, to, cumulative candy, steps) path per reachable species
+        self.chains = {}
+        for pokemon_id in sorted(snapshot.pokemon):
+            paths = []
+            pending = [(snapshot.pokemon[pokemon_id], 0, 0)]
+            while pending:
+                pokemon, candy, steps = pending.pop(0)
+                for evolution in pokemon.evolves_to:
+                    path = (evolution, candy + snapshot.evolution_candy[pokemon.id, evolution.id], steps + 1)
+                    paths.append(path)
+                    pending.append(path)
+            self.chains[pokemon_id] = tuple(paths)
+
+        # the same paths as flat arrays grouped by the species they start from, for whole collections at once
+        ordered = [(pokemon_id, path) for pokemon_id in sorted(self.chains) for path in self.chains[pokemon_id]]
+        self.path_to = np.array([to.id for _, (to, _, _) in ordered], dtype=np.intp)
+        self.path_candy = np.array([candy for _, (_, candy, _) in ordered], dtype=np.intp)
+        self.path_steps = np.array([steps for _, (_, _, steps) in ordered], dtype=np.intp)
+        self.path_count = np.zeros(size, dtype=np.intp)
+        for pokemon_id, paths in self.chains.items():
+            self.path_count[pokemon_id] = len(paths)
+        self.path_offsets = np.concatenate(([0], np.cumsum(self.path_count)[:-1]))
+
+    # every evolution open to each entry with its candy cost, whether the family candy covers it and the cp range
+    # of the result over the iv candidates of the entry (None without candidates)
+    def plan(self, calculator, pokemon_id, candidates, candy):
+        size = len(self.family)
+        pokemon_id = np.array([i if 0 <= i < size else 0 for i in pokemon_id], dtype=np.intp)
+        family_candy = np.zeros(size, dtype=np.intp)
+        for candy_pokemon_id, count in candy:
+            if 0 <= candy_pokemon_id < size:
+                family_candy[self.family[candy_pokemon_id]] += count or 0
+
+        counts = self.path_count[pokemon_id]
+        entry = np.repeat(np.arange(len(pokemon_id)), counts)
+        path = _expand(self.path_offsets[pokemon_id], counts)
+        owned = family_candy[self.family[pokemon_id[entry]]]
+        affordable = owned >= self.path_candy[path]
+
+        # every iv candidate of an entry against every evolution of that entry
+        first_option = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        candidate_counts = counts[candidates.entry]
+        option = _expand(first_option[candidates.entry], candidate_counts)
+        expanded = np.repeat(np.arange(len(candidates.entry)), candidate_counts)
+        cp = calculator.cp(self.path_to[path[option]], candidates.level[expanded], candidates.attack[expanded],
+                           candidates.defense[expanded], candidates.stamina[expanded])
+
+        cp_min = np.full(len(entry), np.nan)
+        cp_max = np.full(len(entry), np.nan)
+        if len(option):
+            order = np.argsort(option, kind='mergesort')
+            option, cp = option[order], cp[order]
+            starts = np.flatnonzero(np.concatenate(([True], option[1:] != option[:-1])))
+            cp_min[option[starts]] = np.minimum.reduceat(cp, starts)
+            cp_max[option[starts]] = np.maximum.reduceat(cp, starts)
+
+        return [(int(entry[i]), int(self.path_to[path[i]]), int(self.path_candy[path[i]]),
+                 int(self.path_steps[path[i]]), int(owned[i]), bool(affordable[i]), _cp(cp_min[i]), _cp(cp_max[i]))
+                for i in range(len(entry))]
+
+
+def _cp(value):
+    return None if np.isnan(value) else int(value)
+
+
+# offsets[i], offsets[i] + 1, ... counts[i] times for every i, concatenated
+def _expand(offsets, counts):
+    total = counts.sum()
+    within = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(offsets, counts) + within
@@ -0,0 +1,165 @@
+import numpy as np
+
+MAX_IV = 15
+IV_VALUES = np.arange(MAX_IV + 1)
+
+# cp multiplier of every whole level from 1 to 40, half levels lie halfway between their neighbours when squared
+WHOLE_LEVEL_CP_MULTIPLIERS = [
+    0.094, 0.16639787, 0.21573247, 0.25572005, 0.29024988, 0.3210876, 0.34921268, 0.37523559, 0.39956728,
+    0.42250001, 0.44310755, 0.46279839, 0.48168495, 0.49985844, 0.51739395, 0.53435433, 0.55079269, 0.56675452,
+    0.58227891, 0.59740001, 0.61215729, 0.62656713, 0.64065295, 0.65443563, 0.667934, 0.68116492, 0.69414365,
+    0.70688421, 0.71939909, 0.7317, 0.73776948, 0.74378943, 0.74976104, 0.75568551, 0.76156384, 0.76739717,
+    0.7731865, 0.77893275, 0.78463697, 0.79030001,
+]
+# stardust per power up, each price covers two whole levels (four half levels) starting at level 1
+STARDUST_COSTS = [200, 400, 600, 800, 1000, 1300, 1600, 1900, 2200, 2500, 3000, 3500, 4000, 4500, 5000, 6000, 7000,
+                  8000, 9000, 10000]
+
+LEVELS = np.arange(2, 81) / 2
+_whole = np.array(WHOLE_LEVEL_CP_MULTIPLIERS)
+CP_MULTIPLIERS = np.empty(len(LEVELS))
+CP_MULTIPLIERS[0::2] = _whole
+CP_MULTIPLIERS[1::2] = np.sqrt((_whole[:-1] ** 2 + _whole[1:] ** 2) / 2)
+LEVEL_STARDUST = np.repeat(STARDUST_COSTS, 4)[:len(LEVELS)]
+MIN_CP = MIN_HP = 10
+
+# (entry, level, stamina) triples whose cp grid is evaluated at once, bounds the size of the temporary arrays
+CHUNK_SIZE = 4096
+
+# appraisal rows by id: the range of the iv total for the overall verdict and of the best iv for the stats verdict
+OVERALL_IV_RANGES = {1: (0, 22), 2: (23, 29), 3: (30, 36), 4: (37, 45)}
+STATS_IV_RANGES = {1: (0, 7), 2: (8, 12), 3: (13, 14), 4: (15, 15)}
+# appraisal_iv ids of the stats named as the best, as bits of a mask
+APPRAISAL_IV_BITS = {1: 4, 2: 1, 3: 2}
+ATTACK_BIT, DEFENSE_BIT, STAMINA_BIT = 1, 2, 4
+
+
+class IvCandidates:
+    def __init__(self, count, entry, level, attack, defense, stamina):
+        self.count = count
+        self.entry = entry
+        self.level = level
+        self.attack = attack
+        self.defense = defense
+        self.stamina = stamina
+        self.perfection = (attack + defense + stamina) * 100.0 / (3 * MAX_IV)
+        # candidates are grouped by entry, so entry i owns the slice offsets[i]:offsets[i + 1]
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(entry, minlength=count))))
+
+    def __len__(self):
+        return self.count
+
+    def candidates(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return [(float(level), int(attack), int(defense), int(stamina), float(perfection))
+                for level, attack, defense, stamina, perfection in zip(
+                    self.level[start:end], self.attack[start:end], self.defense[start:end],
+                    self.stamina[start:end], self.perfection[start:end])]
+
+    # number of candidates, perfection range and average, level range of entry i, or None without any candidate
+    def summary(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        if start == end:
+            return None
+        perfection = self.perfection[start:end]
+        level = self.level[start:end]
+        return (int(end - start), float(perfection.min()), float(perfection.max()), float(perfection.mean()),
+                float(level.min()), float(level.max()))
+
+
+class IvCalculator:
+    def __init__(self, snapshot):
+        size = max(snapshot.pokemon) + 1 if snapshot.pokemon else 1
+        self.known = np.zeros(size, dtype=bool)
+        base_attack, base_defense, base_stamina = np.zeros(size), np.zeros(size), np.zeros(size)
+        for pokemon in snapshot.pokemon.values():
+            self.known[pokemon.id] = True
+            base_attack[pokemon.id] = pokemon.attack
+            base_defense[pokemon.id] = pokemon.defense
+            base_stamina[pokemon.id] = pokemon.stamina
+        # per species and iv: attack, square root of defense and stamina, the factors of the cp formula
+        self.attack = base_attack[:, None] + IV_VALUES[None, :]
+        self.defense_root = np.sqrt(base_defense[:, None] + IV_VALUES[None, :])
+        self.stamina = base_stamina[:, None] + IV_VALUES[None, :]
+
+    # every (level, attack, defense, stamina) that reproduces the cp, hp and power up cost of each entry and agrees
+    # with its appraisal; unknown values (None or 0) are left unconstrained, except cp and hp which are required.
+    # hp narrows (level, stamina) first, so cp is only evaluated for the few pairs left instead of all 79 * 16 ** 3
+    def calculate(self, pokemon_id, cp, hp, stardust=None, overall=None, stats=None, best=None):
+        count = len(pokemon_id)
+        pokemon_id = _column(pokemon_id, count)
+        cp = _column(cp, count)
+        hp = _column(hp, count)
+        stardust = _column(stardust, count)
+        overall = _column(overall, count)
+        stats = _column(stats, count)
+        best = _column(best, count)
+
+        valid = (pokemon_id > 0) & (pokemon_id < len(self.known)) & (cp > 0) & (hp > 0)
+        valid[valid] = self.known[pokemon_id[valid]]
+        entries = np.flatnonzero(valid)
+        species = pokemon_id[entries]
+
+        hp_grid = np.floor(self.stamina[species][:, None, :] * CP_MULTIPLIERS[None, :, None])
+        matches = np.maximum(hp_grid, MIN_HP) == hp[entries][:, None, None]
+        dust = stardust[entries][:, None, None]
+        matches &= (dust == 0) | (LEVEL_STARDUST[None, :, None] == dust)
+        entry, level, stamina = np.nonzero(matches)
+        species = species[entry]
+        # everything in the cp formula but attack and defense is fixed by the triple
+        factor = np.sqrt(self.stamina[species, stamina]) * CP_MULTIPLIERS[level] ** 2 / 10
+        target = cp[entries][entry]
+
+        found = [(np.zeros(0, dtype=np.intp),) * 3]
+        for start in range(0, len(entry), CHUNK_SIZE):
+            chunk = slice(start, start + CHUNK_SIZE)
+            cp_grid = (self.attack[species[chunk]] * factor[chunk, None])[:, :, None] * \
+                self.defense_root[species[chunk]][:, None, :]
+            np.floor(cp_grid, out=cp_grid)
+            np.maximum(cp_grid, MIN_CP, out=cp_grid)
+            pair, attack, defense = np.nonzero(cp_grid == target[chunk, None, None])
+            found.append((pair + start, attack, defense))
+        pair, attack, defense = (np.concatenate(columns) for columns in zip(*found))
+        entry, level, stamina = entries[entry[pair]], level[pair], stamina[pair]
+
+        keep = _appraisal_mask(attack, defense, stamina, overall[entry], stats[entry], best[entry])
+        return IvCandidates(count, entry[keep], LEVELS[level[keep]], attack[keep], defense[keep], stamina[keep])
+
+    # cp of the given species at the given levels and ivs, multiplied in the same order as calculate
+    def cp(self, pokemon_id, level, attack, defense, stamina):
+        multiplier = CP_MULTIPLIERS[(np.asarray(level) * 2).astype(np.intp) - 2]
+        factor = np.sqrt(self.stamina[pokemon_id, stamina]) * multiplier ** 2 / 10
+        return np.maximum(np.floor(self.attack[pokemon_id, attack] * factor * self.defense_root[pokemon_id, defense]),
+                          MIN_CP)
+
+
+def _column(values, count):
+    if values is None:
+        return np.zeros(count, dtype=np.intp)
+    return np.array([value or 0 for value in values], dtype=np.intp)
+
+
+def _range_mask(values, range_ids, ranges):
+    low = np.zeros(len(range_ids), dtype=np.intp)
+    high = np.full(len(range_ids), 3 * MAX_IV, dtype=np.intp)
+    for range_id, (range_low, range_high) in ranges.items():
+        low[range_ids == range_id] = range_low
+        high[range_ids == range_id] = range_high
+    return (values >= low) & (values <= high)
+
+
+def _appraisal_mask(attack, defense, stamina, overall, stats, best):
+    top = np.maximum(np.maximum(attack, defense), stamina)
+    keep = _range_mask(attack + defense + stamina, overall, OVERALL_IV_RANGES)
+    keep &= _range_mask(top, stats, STATS_IV_RANGES)
+    # the named stats share the top iv and every other stat is lower
+    top_bits = (attack == top) * ATTACK_BIT | (defense == top) * DEFENSE_BIT | (stamina == top) * STAMINA_BIT
+    keep &= (best == 0) | (top_bits == best)
+    return keep
+
+
+def appraisal_mask(appraisal_iv_ids):
+    mask = 0
+    for appraisal_iv_id in appraisal_iv_ids:
+        mask |= APPRAISAL_IV_BITS.get(appraisal_iv_id, 0)
+    return mask
@@ -0,0 +1,131 @@
+import numpy as np
+
+STAB_BONUS = 1.25
+SUPER_EFFECTIVE_BONUS = 1.25
+NOT_EFFECTIVE_PENALTY = 0.8
+
+# scores are compared at this precision so float noise does not reorder equal movesets
+SCORE_DECIMALS = 9
+
+
+# moveset_key used to score in Decimal, where Decimal(0.8) is a hair above 0.8, so an attack hit by the
+# not-effective penalty won ties against an otherwise equal attack; keep that tie-break so rankings do not move
+def best_index(scores, penalties):
+    scores = np.round(scores, SCORE_DECIMALS)
+    candidates = scores == scores.max()
+    candidates &= penalties == penalties[candidates].max()
+    return np.flatnonzero(candidates)[0]
+
+
+class MovesetEngine:
+    def __init__(self, snapshot):
+        type_ids = sorted(snapshot.types)
+        self.type_index = {type_id: i for i, type_id in enumerate(type_ids)}
+
+        # type x type lookup of the effectiveness rows, indexed [attack type, defending type]
+        self.super_effective = np.zeros((len(type_ids), len(type_ids)), dtype=bool)
+        self.not_effective = np.zeros((len(type_ids), len(type_ids)), dtype=bool)
+        for type_record in snapshot.types.values():
+            from_index = self.type_index[type_record.id]
+            for to_type in type_record.strong_against:
+                self.super_effective[from_index, self.type_index[to_type.id]] = True
+            for to_type in type_record.weak_against:
+                self.not_effective[from_index, self.type_index[to_type.id]] = True
+
+        attacks = self.attacks = [snapshot.attacks[attack_id] for attack_id in sorted(snapshot.attacks)]
+        self.attack_index = {attack.id: i for i, attack in enumerate(attacks)}
+        self.attack_type = np.array([self.type_index[attack.type_id] for attack in attacks], dtype=np.intp)
+        cooldown = np.array([float(attack.cooldown_time) for attack in attacks])
+        self.attack_dps = np.array([attack.power for attack in attacks], dtype=float) / cooldown
+        # energy per second, for rankings that weigh how fast a fast attack charges; the battle simulator keeps
+        # to the energy of each attack
+        self.attack_eps = np.array([attack.energy for attack in attacks], dtype=float) / cooldown
+
+        # every (pokemon, fast attack, charge attack) combination in the roster, as flat parallel arrays
+        roster, fast_attacks, charge_attacks = [], [], []
+        for pokemon in (snapshot.pokemon[pokemon_id] for pokemon_id in sorted(snapshot.pokemon)):
+            for fast in pokemon.fast_attacks:
+                for charge in pokemon.charge_attacks:
+                    roster.append(pokemon)
+                    fast_attacks.append(self.attack_index[fast.id])
+                    charge_attacks.append(self.attack_index[charge.id])
+        self.roster = roster
+        self.roster_pokemon = np.array([pokemon.id for pokemon in roster], dtype=np.intp)
+        self.roster_fast = np.array(fast_attacks, dtype=np.intp)
+        self.roster_charge = np.array(charge_attacks, dtype=np.intp)
+        roster_types = np.array([self.type_mask(pokemon.types) for pokemon in roster], dtype=bool)
+        roster_types = roster_types.reshape(len(roster), len(type_ids))
+        rows = np.arange(len(roster))
+        self.roster_fast_dps = self.attack_dps[self.roster_fast] * np.where(
+            roster_types[rows, self.attack_type[self.roster_fast]], STAB_BONUS, 1.0)
+        self.roster_charge_dps = self.attack_dps[self.roster_charge] * np.where(
+            roster_types[rows, self.attack_type[self.roster_charge]], STAB_BONUS, 1.0)
+        self._counters = {}
+
+    def type_mask(self, types):
+        mask = np.zeros(len(self.type_index), dtype=bool)
+        mask[[self.type_index[t.id] for t in types]] = True
+        return mask
+
+    def attack_indices(self, attacks):
+        return np.array([self.attack_index[attack.id] for attack in attacks], dtype=np.intp)
+
+    # per attack type multiplier against a (possibly dual typed) defender; each bonus applies at most once
+    def defender_multiplier(self, defender_mask):
+        multiplier = np.ones(len(self.type_index))
+        multiplier[self.super_effective[:, defender_mask].any(axis=1)] *= SUPER_EFFECTIVE_BONUS
+        multiplier[self.not_effective[:, defender_mask].any(axis=1)] *= NOT_EFFECTIVE_PENALTY
+        return multiplier
+
+    # dps of each attack including stab and, given a defender, type effectiveness; also returns whether the
+    # not-effective penalty applied to each attack
+    def attack_scores(self, attacker, attacks, defender=None):
+        indices = self.attack_indices(attacks)
+        attack_type = self.attack_type[indices]
+        scores = self.attack_dps[indices] * np.where(self.type_mask(attacker.types)[attack_type], STAB_BONUS, 1.0)
+        if defender is None:
+            return scores, np.zeros(len(indices), dtype=int)
+        defender_mask = self.type_mask(defender.types)
+        scores *= self.defender_multiplier(defender_mask)[attack_type]
+        return scores, self.not_effective[:, defender_mask].any(axis=1)[attack_type].astype(int)
+
+    # fast x charge grid of combined dps for every moveset the attacker can learn
+    def moveset_scores(self, attacker, defender=None):
+        fast, fast_penalties = self.attack_scores(attacker, attacker.fast_attacks, defender)
+        charge, charge_penalties = self.attack_scores(attacker, attacker.charge_attacks, defender)
+        return (fast[:, np.newaxis] + charge[np.newaxis, :],
+                fast_penalties[:, np.newaxis] + charge_penalties[np.newaxis, :])
+
+    def best_moveset(self, attacker, defender=None):
+        scores, penalties = self.moveset_scores(attacker, defender)
+        fast_index, charge_index = np.unravel_index(best_index(scores.ravel(), penalties.ravel()), scores.shape)
+        return attacker.fast_attacks[fast_index], attacker.charge_attacks[charge_index]
+
+    # best moveset of every species against the defender, strongest first and species with equal scores by id;
+    # cached per defender
+    def counters(self, defender):
+        ranking = self._counters.get(defender.id)
+        if ranking is None:
+            ranking = self._counters[defender.id] = self._rank_counters(defender)
+        return ranking
+
+    def _rank_counters(self, defender):
+        defender_mask = self.type_mask(defender.types)
+        multiplier = self.defender_multiplier(defender_mask)
+        penalized = self.not_effective[:, defender_mask].any(axis=1).astype(int)
+        fast_type = self.attack_type[self.roster_fast]
+        charge_type = self.attack_type[self.roster_charge]
+        scores = self.roster_fast_dps * multiplier[fast_type] + self.roster_charge_dps * multiplier[charge_type]
+        penalties = penalized[fast_type] + penalized[charge_type]
+        rounded = np.round(scores, SCORE_DECIMALS)
+
+        # same tie-break as best_index: per species keep the first combination with the highest score and penalty
+        order = np.lexsort((np.arange(len(scores)), -penalties, -rounded, self.roster_pokemon))
+        _, first = np.unique(self.roster_pokemon[order], return_index=True)
+        best = order[first]
+        # strongest first; the pokemon id, the last key lexsort compares, orders species that tie on score and
+        # penalties, so equal counters always come out the same way
+        best = best[np.lexsort((self.roster_pokemon[best], -penalties[best], -rounded[best]))]
+
+        return [(self.roster[i], self.attacks[self.roster_fast[i]], self.attacks[self.roster_charge[i]],
+                 float(scores[i])) for i in best]
@@ -0,0 +1,49 @@
+from .snapshot import catalog
+
+from functools import wraps
+from hashlib import sha1
+
+from flask import current_app, make_response, request
+
+DEFAULT_MAX_AGE = 60
+
+
+# everything that changes the bytes of a catalog response besides the data: the route, its arguments and
+# whether jsonify pretty prints, which depends on the XHR header
+def request_key():
+    return request.path, tuple(sorted(request.args.items(multi=True))), request.is_xhr
+
+
+def version_etag(version, key):
+    return sha1('{0}:{1!r}'.format(version, key).encode('utf-8')).hexdigest()
+
+
+def cache_headers(response, etag):
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config.get('CATALOG_CACHE_MAX_AGE', DEFAULT_MAX_AGE)
+    response.vary.add('X-Requested-With')
+    return response
+
+
+# catalog responses only change on import, so they are tagged with the data version of the snapshot; a matching
+# If-None-Match is answered without running the view and rendered 200s are kept until the snapshot is replaced
+def versioned_response(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        snapshot = catalog.snapshot
+        key = request_key()
+        etag = version_etag(snapshot.version, key)
+        if etag in request.if_none_match:
+            return cache_headers(current_app.response_class(status=304), etag)
+
+        cached = snapshot.responses.get(key)
+        if cached is None:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            cached = response.get_data(), response.mimetype
+            snapshot.responses.put(key, cached)
+        body, mimetype = cached
+        return cache_headers(current_app.response_class(body, mimetype=mimetype), etag)
+    return wrapper
@@ -0,0 +1,170 @@
+from .cache import ResponseCache
+
+from collections import Counter, defaultdict
+import re
+import unicodedata
+
+KINDS = ('pokemon', 'attack', 'type', 'item')
+# score of a document for each way a query word can match it; the whole query matching the start of a name
+# outranks matching its words one by one
+EXACT_NAME = 100
+NAME_PREFIX = 60
+WORD_PREFIX = 40
+FUZZY_WORD = 20
+FUZZY_EDIT_PENALTY = 5
+DESCRIPTION_PREFIX = 5
+# typos are only looked for in words this long, one edit up to MAX_ONE_EDIT_LENGTH characters and two beyond
+MIN_FUZZY_LENGTH = 3
+MAX_ONE_EDIT_LENGTH = 5
+NGRAM_SIZE = 3
+SEARCH_LIMIT = 10
+# scores of recently typed words, autocomplete sends the same prefixes over and over
+WORD_CACHE_SIZE = 16384
+MAX_SEARCH_LIMIT = 50
+
+_WORD = re.compile(r'[a-z0-9]+')
+_SYMBOLS = {'♀': ' f', '♂': ' m'}
+
+
+# lowercase words without accents, so 'Pokémon' finds 'pokemon' and 'Nidoran♀' is 'nidoran f'
+def words(text):
+    text = ''.join(_SYMBOLS.get(c, c) for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    return _WORD.findall(text.lower())
+
+
+# only the start is padded, so the ngrams of a prefix are a subset of those of the word
+def ngrams(word):
+    padded = '$' + word
+    return {padded[i:i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1)}
+
+
+# edit distance of a and b, giving up with limit + 1 as soon as it cannot be within limit
+def edit_distance(a, b, limit):
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+# every node keeps the documents of all the words below it, so a prefix lookup is one walk down
+class Trie:
+    def __init__(self):
+        self.root = ({}, set())
+
+    def add(self, word, document):
+        children, documents = self.root
+        documents.add(document)
+        for c in word:
+            if c not in children:
+                children[c] = ({}, set())
+            children, documents = children[c]
+            documents.add(document)
+
+    def prefix(self, word):
+        children, documents = self.root
+        for c in word:
+            node = children.get(c)
+            if node is None:
+                return ()
+            children, documents = node
+        return documents
+
+
+class SearchIndex:
+    def __init__(self, snapshot):
+        records = (
+            ('pokemon', snapshot.pokemon),
+            ('attack', snapshot.attacks),
+            ('type', snapshot.types),
+            ('item', snapshot.items),
+        )
+        # documents are (kind, id, name) with the whole name run together, e.g. 'mrmime' for 'Mr. Mime'
+        self.documents = []
+        self.compact = []
+        self.names = Trie()
+        self.name_words = Trie()
+        self.descriptions = Trie()
+        self.word_documents = defaultdict(set)
+        for kind, by_id in records:
+            for record_id in sorted(by_id):
+                record = by_id[record_id]
+                document = len(self.documents)
+                name_words = words(record.name)
+                self.documents.append((kind, record.id, record.name))
+                self.compact.append(''.join(name_words))
+                self.names.add(self.compact[document], document)
+                for word in name_words:
+                    self.name_words.add(word, document)
+                    self.word_documents[word].add(document)
+                for word in set(words(record.description or '')):
+                    self.descriptions.add(word, document)
+
+        self.word_ngrams = defaultdict(set)
+        for word in self.word_documents:
+            for gram in ngrams(word):
+                self.word_ngrams[gram].add(word)
+        self._word_scores = ResponseCache(WORD_CACHE_SIZE)
+
+    # documents with a name word within one or two edits of the word, or of a typo in the start of one
+    def fuzzy(self, word):
+        limit = 1 if len(word) <= MAX_ONE_EDIT_LENGTH else 2
+        grams = ngrams(word)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.word_ngrams.get(gram, ()))
+        # every edit changes at most NGRAM_SIZE ngrams, so anything sharing fewer is too far off
+        needed = max(1, len(grams) - NGRAM_SIZE * limit)
+        scores = {}
+        for candidate in (candidate for candidate, count in shared.items() if count >= needed):
+            distance = min(edit_distance(word, candidate, limit), edit_distance(word, candidate[:len(word)], limit))
+            if distance <= limit:
+                score = FUZZY_WORD - FUZZY_EDIT_PENALTY * distance
+                for document in self.word_documents[candidate]:
+                    scores[document] = max(scores.get(document, 0), score)
+        return scores
+
+    # typos are only looked for when the word starts no name word
+    def word_scores(self, word):
+        scores = self._word_scores.get(word)
+        if scores is None:
+            scores = dict.fromkeys(self.descriptions.prefix(word), DESCRIPTION_PREFIX)
+            prefixed = self.name_words.prefix(word)
+            if not prefixed and len(word) >= MIN_FUZZY_LENGTH:
+                scores.update(self.fuzzy(word))
+            scores.update(dict.fromkeys(prefixed, WORD_PREFIX))
+            self._word_scores.put(word, scores)
+        return scores
+
+    # ranked (kind, id, name, score) of the documents matching every word of the query, each as the start of a
+    # word, with a typo or in the description, or matching the start of the whole name
+    def search(self, query, kind=None, limit=SEARCH_LIMIT):
+        query_words = words(query)
+        if not query_words:
+            return []
+        compact = ''.join(query_words)
+        scores = {document: EXACT_NAME if self.compact[document] == compact else NAME_PREFIX
+                  for document in self.names.prefix(compact)}
+
+        matched = None
+        for word in query_words:
+            word_scores = self.word_scores(word)
+            if matched is None:
+                matched = word_scores
+            else:
+                matched = {document: score + word_scores[document]
+                           for document, score in matched.items() if document in word_scores}
+        for document, score in matched.items():
+            scores[document] = max(scores.get(document, 0), score)
+
+        found = [(self.documents[document], score) for document, score in scores.items()
+                 if kind is None or self.documents[document][0] == kind]
+        found.sort(key=lambda item: (-item[1], len(item[0][2]), KINDS.index(item[0][0]), item[0][2]))
+        return [(document_kind, document_id, name, score) for (document_kind, document_id, name), score
+                in found[:limit]]
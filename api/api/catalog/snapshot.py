@@ -0,0 +1,236 @@
+from api.database import uncounted
+from api.database.models import pokedex
+from .battle import BattleSimulator
+from .cache import ResponseCache
+from .evolution import EvolutionIndex
+from .iv import IvCalculator
+from .moveset import MovesetEngine
+from .search import SearchIndex
+
+from collections import defaultdict
+from threading import Lock
+from time import monotonic
+
+FAST_ATTACK_SPEED_ID = 1
+CHARGE_ATTACK_SPEED_ID = 2
+NOT_EFFECTIVE_ID = 1
+SUPER_EFFECTIVE_ID = 2
+# data imported before versions were recorded
+UNVERSIONED = 'unversioned'
+
+
+# records carry the attribute names of the models they copy, so the compiled schemas dump them like ORM objects
+class CategoryRecord:
+    __slots__ = ('id', 'name', 'description')
+
+    def __init__(self, row):
+        self.id = row.id
+        self.name = row.name
+        self.description = row.description
+
+
+class EggRecord:
+    __slots__ = ('id', 'name', 'description')
+
+    def __init__(self, row):
+        self.id = row.id
+        self.name = row.name
+        self.description = row.description
+
+
+class ItemRecord:
+    __slots__ = ('id', 'name', 'description')
+
+    def __init__(self, row):
+        self.id = row.id
+        self.name = row.name
+        self.description = row.description
+
+
+class TypeRecord:
+    __slots__ = ('id', 'name', 'description', 'strong_against', 'weak_against')
+
+    def __init__(self, row):
+        self.id = row.id
+        self.name = row.name
+        self.description = row.description
+        self.strong_against = ()
+        self.weak_against = ()
+
+
+class AttackRecord:
+    __slots__ = ('id', 'name', 'description', 'type_id', 'power', 'energy', 'cooldown_time', 'attack_speed_id',
+                 'type', 'pokemon')
+
+    def __init__(self, row, types):
+        self.id = row.id
+        self.name = row.name
+        self.description = row.description
+        self.type_id = row.type_id
+        self.power = row.power
+        self.energy = row.energy
+        self.cooldown_time = row.cooldown_time
+        self.attack_speed_id = row.attack_speed_id
+        self.type = types[row.type_id]
+        self.pokemon = ()
+
+
+class PokemonRecord:
+    __slots__ = ('id', 'name', 'description', 'height', 'weight', 'category_id', 'stamina', 'attack', 'defense',
+                 'cp_gain', 'cp_max', 'buddy_distance', 'category', 'types', 'attacks', 'fast_attacks',
+                 'charge_attacks', 'egg', 'evolves_to', 'evolves_from')
+
+    def __init__(self, row, categories):
+        self.id = row.id
+        self.name = row.name
+        self.description = row.description
+        self.height = row.height
+        self.weight = row.weight
+        self.category_id = row.category_id
+        self.stamina = row.stamina
+        self.attack = row.attack
+        self.defense = row.defense
+        self.cp_gain = row.cp_gain
+        self.cp_max = row.cp_max
+        self.buddy_distance = row.buddy_distance
+        self.category = categories[row.category_id]
+        self.types = ()
+        self.attacks = ()
+        self.fast_attacks = ()
+        self.charge_attacks = ()
+        self.egg = ()
+        self.evolves_to = ()
+        self.evolves_from = ()
+
+
+def latest_version(session):
+    version = session.query(pokedex.DataVersion.version).order_by(pokedex.DataVersion.id.desc()).limit(1).scalar()
+    return version if version is not None else UNVERSIONED
+
+
+def _group(pairs):
+    groups = defaultdict(list)
+    for key, value in pairs:
+        groups[key].append(value)
+    return groups
+
+
+class PokedexSnapshot:
+    def __init__(self, db):
+        session = db.session
+        self.version = latest_version(session)
+        self.categories = {row.id: CategoryRecord(row) for row in session.query(pokedex.Category)}
+        self.types = {row.id: TypeRecord(row) for row in session.query(pokedex.Type)}
+        self.eggs = {row.id: EggRecord(row) for row in session.query(pokedex.Egg)}
+        self.items = {row.id: ItemRecord(row) for row in session.query(pokedex.Item)}
+        self.attacks = {row.id: AttackRecord(row, self.types) for row in session.query(pokedex.Attack)}
+        self.pokemon = {row.id: PokemonRecord(row, self.categories) for row in session.query(pokedex.Pokemon)}
+
+        type_effectiveness = session.query(pokedex.TypeEffectiveness).all()
+        pokemon_types = session.query(pokedex.PokemonType).all()
+        pokemon_attacks = session.query(pokedex.PokemonAttack).all()
+        pokemon_eggs = session.query(pokedex.PokemonEgg).all()
+        evolutions = session.query(pokedex.PokemonEvolution).all()
+
+        strong = _group((row.from_type_id, row.to_type_id) for row in type_effectiveness
+                        if row.effectiveness_id == SUPER_EFFECTIVE_ID)
+        weak = _group((row.from_type_id, row.to_type_id) for row in type_effectiveness
+                      if row.effectiveness_id == NOT_EFFECTIVE_ID)
+        for type_id, type_record in self.types.items():
+            type_record.strong_against = tuple(self.types[i] for i in sorted(strong[type_id]))
+            type_record.weak_against = tuple(self.types[i] for i in sorted(weak[type_id]))
+
+        types_by_pokemon = _group((row.pokemon_id, row.type_id) for row in pokemon_types)
+        attacks_by_pokemon = _group((row.pokemon_id, row.attack_id) for row in pokemon_attacks)
+        eggs_by_pokemon = _group((row.pokemon_id, row.egg_id) for row in pokemon_eggs)
+        evolves_to = _group((row.from_pokemon_id, row.to_pokemon_id) for row in evolutions)
+        evolves_from = _group((row.to_pokemon_id, row.from_pokemon_id) for row in evolutions)
+        for pokemon_id, pokemon in self.pokemon.items():
+            pokemon.types = tuple(self.types[i] for i in sorted(types_by_pokemon[pokemon_id]))
+            pokemon.attacks = tuple(self.attacks[i] for i in sorted(attacks_by_pokemon[pokemon_id]))
+            pokemon.fast_attacks = tuple(a for a in pokemon.attacks if a.attack_speed_id == FAST_ATTACK_SPEED_ID)
+            pokemon.charge_attacks = tuple(a for a in pokemon.attacks if a.attack_speed_id == CHARGE_ATTACK_SPEED_ID)
+            pokemon.egg = tuple(self.eggs[i] for i in sorted(eggs_by_pokemon[pokemon_id]))
+            pokemon.evolves_to = tuple(self.pokemon[i] for i in sorted(evolves_to[pokemon_id]))
+            pokemon.evolves_from = tuple(self.pokemon[i] for i in sorted(evolves_from[pokemon_id]))
+
+        self.evolution_candy = {(row.from_pokemon_id, row.to_pokemon_id): row.candy for row in evolutions}
+
+        pokemon_by_attack = _group((row.attack_id, row.pokemon_id) for row in pokemon_attacks)
+        for attack_id, attack in self.attacks.items():
+            attack.pokemon = tuple(self.pokemon[i] for i in sorted(pokemon_by_attack[attack_id]))
+
+        self.pokemon_by_name = {pokemon.name: pokemon for pokemon in self.pokemon.values()}
+        self.movesets = MovesetEngine(self)
+        self.ivs = IvCalculator(self)
+        self.evolutions = EvolutionIndex(self)
+        self.battles = BattleSimulator(self)
+        self.search = SearchIndex(self)
+        self.responses = ResponseCache()
+
+    def __repr__(self):
+        return '<{0}(version={1!r} pokemon={2} attacks={3} types={4})>'.format(
+            self.__class__.__name__, self.version, len(self.pokemon), len(self.attacks), len(self.types))
+
+
+# imports in other processes only show in the data version table, so the version of the snapshot is compared to
+# it at most every CATALOG_VERSION_CHECK seconds; a snapshot found out of date is dropped along with the responses
+# cached with it
+class Catalog:
+    def __init__(self):
+        self._db = None
+        self._snapshot = None
+        self._lock = Lock()
+        self._checked = 0
+        self._check_interval = 0
+
+    def init_app(self, app, db):
+        app.config.setdefault('CATALOG_VERSION_CHECK', 5)
+        self._db = db
+        self._check_interval = app.config['CATALOG_VERSION_CHECK']
+
+    @property
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is not None and monotonic() - self._checked >= self._check_interval:
+            snapshot = self._check(snapshot)
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = self._load()
+                snapshot = self._snapshot
+        return snapshot
+
+    def reload(self):
+        with self._lock:
+            self._snapshot = self._load()
+        return self._snapshot
+
+    def _load(self):
+        self._checked = monotonic()
+        with uncounted():
+            return PokedexSnapshot(self._db)
+
+    # the snapshot if it is still current, otherwise None; concurrent requests see the new check time and skip it
+    def _check(self, snapshot):
+        self._checked = monotonic()
+        with uncounted():
+            version = latest_version(self._db.session)
+        if version == snapshot.version:
+            return snapshot
+        with self._lock:
+            if self._snapshot is snapshot:
+                self._snapshot = None
+        return None
+
+    def invalidate(self):
+        self._snapshot = None
+
+
+catalog = Catalog()
+
+
+# the snapshot is loaded by its first use
+def setup_catalog(app, db):
+    catalog.init_app(app, db)
+    return catalog
@@ -1,42 +1,229 @@
 # from api.database.database import Base, engine, Session, clear_database, setup_database
+from api.catalog import catalog
 from api.database.models import pokedex
 
-from csv import DictReader
+from concurrent.futures import ThreadPoolExecutor
+from csv import DictReader, writer
+from io import StringIO
+from itertools import islice
+from time import perf_counter
+from uuid import uuid4
+import logging
+import os
 
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
 
-def import_from_file(db, table, file):
-    with open(file) as f:
+log = logging.getLogger(__name__)
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+BATCH_SIZE = 1000
+TRUNCATE = 'truncate'
+UPSERT = 'upsert'
+
+TABLE_FILES = [
+    (pokedex.Category, 'table_category.csv'),
+    (pokedex.Pokemon, 'table_pokemon.csv'),
+    (pokedex.PokemonEvolution, 'table_pokemon_evolution.csv'),
+    (pokedex.Type, 'table_type.csv'),
+    (pokedex.Effectiveness, 'table_effectiveness.csv'),
+    (pokedex.TypeEffectiveness, 'table_type_effectiveness.csv'),
+    (pokedex.PokemonType, 'table_pokemon_type.csv'),
+    (pokedex.AttackSpeed, 'table_attack_speed.csv'),
+    (pokedex.Attack, 'table_attack.csv'),
+    (pokedex.PokemonAttack, 'table_pokemon_attack.csv'),
+    (pokedex.Egg, 'table_egg.csv'),
+    (pokedex.PokemonEgg, 'table_pokemon_egg.csv'),
+    (pokedex.Team, 'table_team.csv'),
+    (pokedex.AppraisalOverall, 'table_appraisal_overall.csv'),
+    (pokedex.TeamAppraisalOverall, 'table_team_appraisal_overall.csv'),
+    (pokedex.AppraisalStats, 'table_appraisal_stats.csv'),
+    (pokedex.TeamAppraisalStats, 'table_team_appraisal_stats.csv'),
+    (pokedex.AppraisalSize, 'table_appraisal_size.csv'),
+    (pokedex.TeamAppraisalSize, 'table_team_appraisal_size.csv'),
+    (pokedex.AppraisalIv, 'table_appraisal_iv.csv'),
+    (pokedex.Item, 'table_item.csv'),
+    (pokedex.Medal, 'table_medal.csv'),
+    (pokedex.MedalLevel, 'table_medal_level.csv'),
+    (pokedex.MedalLevelRequirement, 'table_medal_level_requirement.csv'),
+]
+
+
+def read_rows(table, file):
+    nullable = {column.name for column in table.columns if column.nullable}
+    # the csv files have old Mac line endings, newline='' lets the reader handle them
+    with open(file, newline='', encoding='utf-8') as f:
         reader = DictReader(f)
-        # session = Session()
-        try:
-            db.session.add_all([table(**line) for line in reader])
-            db.session.commit()
-        finally:
-            db.session.close()
-
-
-def import_all_data(db):
-    import_from_file(db, pokedex.Category, './data_import/table_category.csv')
-    import_from_file(db, pokedex.Pokemon, './data_import/table_pokemon.csv')
-    import_from_file(db, pokedex.PokemonEvolution, './data_import/table_pokemon_evolution.csv')
-    import_from_file(db, pokedex.Type, './data_import/table_type.csv')
-    import_from_file(db, pokedex.Effectiveness, './data_import/table_effectiveness.csv')
-    import_from_file(db, pokedex.TypeEffectiveness, './data_import/table_type_effectiveness.csv')
-    import_from_file(db, pokedex.PokemonType, './data_import/table_pokemon_type.csv')
-    import_from_file(db, pokedex.AttackSpeed, './data_import/table_attack_speed.csv')
-    import_from_file(db, pokedex.Attack, './data_import/table_attack.csv')
-    import_from_file(db, pokedex.PokemonAttack, './data_import/table_pokemon_attack.csv')
-    import_from_file(db, pokedex.Egg, './data_import/table_egg.csv')
-    import_from_file(db, pokedex.PokemonEgg, './data_import/table_pokemon_egg.csv')
-    import_from_file(db, pokedex.Team, './data_import/table_team.csv')
-    import_from_file(db, pokedex.AppraisalOverall, './data_import/table_appraisal_overall.csv')
-    import_from_file(db, pokedex.TeamAppraisalOverall, './data_import/table_team_appraisal_overall.csv')
-    import_from_file(db, pokedex.AppraisalStats, './data_import/table_appraisal_stats.csv')
-    import_from_file(db, pokedex.TeamAppraisalStats, './data_import/table_team_appraisal_stats.csv')
-    import_from_file(db, pokedex.AppraisalSize, './data_import/table_appraisal_size.csv')
-    import_from_file(db, pokedex.TeamAppraisalSize, './data_import/table_team_appraisal_size.csv')
-    import_from_file(db, pokedex.AppraisalIv, './data_import/table_appraisal_iv.csv')
-    import_from_file(db, pokedex.Item, './data_import/table_item.csv')
-    import_from_file(db, pokedex.Medal, './data_import/table_medal.csv')
-    import_from_file(db, pokedex.MedalLevel, './data_import/table_medal_level.csv')
-    import_from_file(db, pokedex.MedalLevelRequirement, './data_import/table_medal_level_requirement.csv')
+        add_id = 'id' in table.columns and 'id' not in reader.fieldnames
+        # rows without an id column are numbered by line, so a reload always reproduces the same keys
+        for number, line in enumerate(reader, start=1):
+            row = {key: (None if value == '' and key in nullable else value) for key, value in line.items()}
+            if add_id:
+                row['id'] = number
+            yield row
+
+
+def batches(rows, size=BATCH_SIZE):
+    rows = iter(rows)
+    batch = list(islice(rows, size))
+    while batch:
+        yield batch
+        batch = list(islice(rows, size))
+
+
+# updates existing rows in place rather than deleting and inserting them again, as INSERT OR REPLACE would, so the
+# rows referencing them are left alone
+def insert_statement(connection, table, mode, names):
+    if mode == TRUNCATE:
+        return table.insert()
+    if connection.dialect.name == 'postgresql':
+        statement = postgresql.insert(table)
+        keys = [column.name for column in table.primary_key]
+        values = {column.name: statement.excluded[column.name] for column in table.columns
+                  if not column.primary_key}
+        if values:
+            return statement.on_conflict_do_update(index_elements=keys, set_=values)
+        return statement.on_conflict_do_nothing(index_elements=keys)
+    # sqlalchemy only builds ON CONFLICT for postgres, sqlite has it since 3.24
+    quote = connection.dialect.identifier_preparer.quote
+    keys = [quote(column.name) for column in table.primary_key]
+    values = [quote(name) for name in names if not table.columns[name].primary_key]
+    return text('INSERT INTO {0} ({1}) VALUES ({2}) ON CONFLICT ({3}) DO {4}'.format(
+        quote(table.name), ', '.join(quote(name) for name in names), ', '.join(':' + name for name in names),
+        ', '.join(keys),
+        'UPDATE SET ' + ', '.join('{0} = excluded.{0}'.format(name) for name in values) if values else 'NOTHING'))
+
+
+def copy_rows(connection, table, rows):
+    columns = [column.name for column in table.columns]
+    # an unquoted empty field is NULL to COPY, which would break the blank descriptions
+    not_null = [column.name for column in table.columns if not column.nullable]
+    count = 0
+    cursor = connection.connection.cursor()
+    try:
+        for batch in batches(rows):
+            buffer = StringIO()
+            csv_writer = writer(buffer)
+            csv_writer.writerows([row.get(name) for name in columns] for row in batch)
+            buffer.seek(0)
+            cursor.copy_expert('COPY {0} ({1}) FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL ({2}))'.format(
+                table.name, ', '.join(columns), ', '.join(not_null)), buffer)
+            count += len(batch)
+    finally:
+        cursor.close()
+    return count
+
+
+def reset_sequence(connection, table):
+    if connection.dialect.name == 'postgresql' and 'id' in table.columns:
+        connection.execute("SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+                           "COALESCE((SELECT MAX(id) FROM {0}), 1))".format(table.name))
+
+
+def load_table(engine, table, file, mode=UPSERT):
+    with engine.begin() as connection:
+        return load_rows(connection, table, file, mode)
+
+
+# loads a file within the caller's transaction
+def load_rows(connection, table, file, mode=UPSERT):
+    table = getattr(table, '__table__', table)
+    start = perf_counter()
+    count = 0
+    rows = read_rows(table, file)
+    if mode == TRUNCATE and connection.dialect.name == 'postgresql':
+        count = copy_rows(connection, table, rows)
+    else:
+        statement = None
+        for batch in batches(rows):
+            if statement is None:
+                statement = insert_statement(connection, table, mode,
+                                             [column.name for column in table.columns if column.name in batch[0]])
+            connection.execute(statement, batch)
+            count += len(batch)
+    reset_sequence(connection, table)
+    elapsed = perf_counter() - start
+    log.info('%s: %d rows in %.3fs (%.0f rows/s)', table.name, count, elapsed, count / elapsed if elapsed else 0)
+    return {'table': table.name, 'rows': count, 'seconds': elapsed}
+
+
+# stamps the imported data with a new version, which the catalog responses use as their ETag
+def record_data_version(engine):
+    version = uuid4().hex
+    with engine.begin() as connection:
+        connection.execute(pokedex.DataVersion.__table__.insert(), version=version)
+    log.info('data version %s', version)
+    return version
+
+
+def import_from_file(db, table, file, mode=UPSERT):
+    stats = load_table(db.engine, table, file, mode)
+    record_data_version(db.engine)
+    catalog.invalidate()
+    return stats
+
+
+# groups tables so that every table only references tables in earlier groups
+def dependency_levels(tables):
+    names = {table.name for table in tables}
+    levels = {}
+
+    def level(table):
+        if table.name not in levels:
+            levels[table.name] = 0
+            parents = {key.column.table for key in table.foreign_keys
+                       if key.column.table.name in names and key.column.table is not table}
+            levels[table.name] = max([level(parent) + 1 for parent in parents] or [0])
+        return levels[table.name]
+
+    grouped = {}
+    for table in tables:
+        grouped.setdefault(level(table), []).append(table)
+    return [grouped[key] for key in sorted(grouped)]
+
+
+# tables outside the catalog with rows that reference it
+def referencing_tables(connection, metadata, catalog_tables):
+    referencing = []
+    for table in metadata.sorted_tables:
+        if table in catalog_tables or not any(key.column.table in catalog_tables for key in table.foreign_keys):
+            continue
+        if connection.execute(table.select().limit(1)).first() is not None:
+            referencing.append(table.name)
+    return referencing
+
+
+# TRUNCATE empties the catalog before loading it, which is only possible before any user data refers to it. It
+# empties and reloads in a single transaction, one table after another, so a server reading meanwhile sees the old
+# catalog or the new one, never an empty one, and a failed load leaves the old one. UPSERT updates it in place
+def import_all_data(db, mode=UPSERT, workers=4):
+    engine = db.engine
+    files = {model.__table__: os.path.join(DATA_DIR, file) for model, file in TABLE_FILES}
+    levels = dependency_levels(list(files))
+
+    # sqlite allows a single writer, so only load tables side by side on other backends
+    if engine.dialect.name == 'sqlite':
+        workers = 1
+
+    stats = []
+    start = perf_counter()
+    if mode == TRUNCATE:
+        with engine.begin() as connection:
+            referencing = referencing_tables(connection, db.metadata, set(files))
+            if referencing:
+                raise ValueError('Cannot truncate the catalog, {0} refer to it; import with upsert instead.'.format(
+                    ', '.join(referencing)))
+            for tables in reversed(levels):
+                for table in tables:
+                    connection.execute(table.delete())
+            for tables in levels:
+                stats.extend(load_rows(connection, table, files[table], mode) for table in tables)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for tables in levels:
+                stats.extend(executor.map(lambda table: load_table(engine, table, files[table], mode), tables))
+    log.info('imported %d tables in %.3fs', len(stats), perf_counter() - start)
+
+    record_data_version(engine)
+    catalog.invalidate()
+    return stats
@@ -1 +1,5 @@
-from .database import setup_database, db
+from .database import create_schema, engines, plan_schema, setup_database, db
+from .routing import read_only, RoutingSession
+from .budget import setup_statement_counter, statement_budget, uncounted, StatementBudgetExceeded
+from .keyset import keyset_page, keyset_batches
+from .bulk import increment_counters, insert_ignoring_conflicts
@@ -0,0 +1,67 @@
+from .database import engines
+
+from contextlib import contextmanager
+import logging
+import threading
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+log = logging.getLogger(__name__)
+
+_paused = threading.local()
+
+
+class StatementBudgetExceeded(Exception):
+    pass
+
+
+# caps the SQL statements a view may run per request, optionally per method, e.g. statement_budget(10, PUT=20)
+def statement_budget(limit, **methods):
+    def decorator(fn):
+        fn.statement_budget = dict(methods, default=limit)
+        return fn
+    return decorator
+
+
+# statements run inside are not counted against the request, for loads done once per process by whichever request
+# needs them first, like the catalog snapshot
+@contextmanager
+def uncounted():
+    depth = getattr(_paused, 'depth', 0)
+    _paused.depth = depth + 1
+    try:
+        yield
+    finally:
+        _paused.depth = depth
+
+
+def setup_statement_counter(app, db):
+    app.config.setdefault('SQL_STATEMENT_BUDGET_STRICT', app.testing)
+
+    def count_statement(*args):
+        if has_request_context() and not getattr(_paused, 'depth', 0):
+            g.sql_statements = g.get('sql_statements', 0) + 1
+
+    for engine in engines(app):
+        event.listen(engine, 'before_cursor_execute', count_statement)
+
+    # setup_database keeps an app context pushed, so g outlives the request and has to be reset here
+    @app.before_request
+    def reset_statement_count():
+        g.sql_statements = 0
+
+    @app.after_request
+    def check_statement_budget(response):
+        count = g.get('sql_statements', 0)
+        budget = getattr(app.view_functions.get(request.endpoint), 'statement_budget', {})
+        limit = budget.get(request.method, budget.get('default'))
+        if limit is not None and count > limit:
+            message = '{0} {1} ran {2} SQL statements, budget is {3}'.format(request.method, request.path,
+                                                                            count, limit)
+            if app.config['SQL_STATEMENT_BUDGET_STRICT']:
+                raise StatementBudgetExceeded(message)
+            log.warning(message)
+        if app.debug:
+            response.headers['X-SQL-Statements'] = str(count)
+        return response
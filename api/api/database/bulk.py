@@ -0,0 +1,43 @@
+from sqlalchemy import and_, bindparam, func, select
+from sqlalchemy.dialects import postgresql
+
+
+# inserts all rows in a single statement, skipping rows that clash with an existing row on the unique keys.
+# Returns the keys, as tuples, of the rows actually inserted
+def insert_ignoring_conflicts(session, table, rows, keys):
+    if not rows:
+        return set()
+    columns = sorted({key for row in rows for key in row})
+    rows = [{column: row.get(column) for column in columns} for row in rows]
+    key_columns = [table.c[key] for key in keys]
+    if session.get_bind().dialect.name == 'postgresql':
+        return set(map(tuple, session.execute(postgresql.insert(table).values(rows)
+                                              .on_conflict_do_nothing(index_elements=keys)
+                                              .returning(*key_columns))))
+    # sqlite caps the bound variables of a statement, so it runs one prepared statement over all rows. It has a
+    # single writer, and a write matching no row makes this transaction the writer until it commits, so rows with
+    # an id above the highest one read after it were inserted here; of those only the submitted keys count
+    primary_key, = table.primary_key.columns
+    session.execute(table.delete().where(primary_key.is_(None)))
+    last_id = session.execute(select([func.coalesce(func.max(primary_key), 0)])).scalar()
+    if not session.execute(table.insert().prefix_with('OR IGNORE'), rows).rowcount:
+        return set()
+    submitted = {tuple(row[key] for key in keys) for row in rows}
+    return set(map(tuple, session.execute(select(key_columns).where(primary_key > last_id)))) & submitted
+
+# adds each row's values to counter columns, creating the rows that do not exist yet
+def increment_counters(session, table, rows, keys, columns):
+    if not rows:
+        return
+    if session.get_bind().dialect.name == 'postgresql':
+        statement = postgresql.insert(table)
+        session.execute(statement.on_conflict_do_update(
+            index_elements=keys, set_={column: table.c[column] + statement.excluded[column] for column in columns}),
+            rows)
+        return
+    session.execute(table.insert().prefix_with('OR IGNORE'), [dict(row, **{column: 0 for column in columns})
+                                                              for row in rows])
+    # bound names must differ from the column names of an UPDATE
+    session.execute(table.update().where(and_(*[table.c[key] == bindparam('_' + key) for key in keys]))
+                    .values({column: table.c[column] + bindparam('_' + column) for column in columns}),
+                    [{'_' + key: value for key, value in row.items()} for row in rows])
@@ -1,18 +1,106 @@
+from .routing import replica_binds, RoutingSession
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect
 from sqlalchemy.engine.url import URL
+from sqlalchemy.pool import QueuePool
 
 # url = URL('sqlite', database=':memory:')
 url = URL('sqlite', database='pokedex.sqlite')
 # url = URL('postgresql+psycopg2', username='postgres', password='postgres',
 #           host='localhost', port='5432', database='pokedex')
 
-db = SQLAlchemy()
 
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return RoutingSession(self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        SQLAlchemy.apply_driver_hacks(self, app, info, options)
+        # a file database gets a pool once a size is configured instead of a connection per checkout; pooled
+        # connections are handed between threads, one at a time
+        if info.drivername == 'sqlite' and options.get('pool_size') and 'poolclass' not in options:
+            options['poolclass'] = QueuePool
+            options.setdefault('connect_args', {})['check_same_thread'] = False
+
+
+db = RoutingSQLAlchemy()
+
+
+def engines(app):
+    return [db.get_engine(app)] + [db.get_engine(app, bind=bind) for bind in replica_binds(app)]
+
+
+# WAL lets readers run alongside the writer, synchronous NORMAL only syncs at checkpoints in WAL mode and mmap
+# serves reads from the page cache without copying
+def tune_sqlite(engine, config):
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode={0}'.format(config['SQLITE_JOURNAL_MODE']))
+        cursor.execute('PRAGMA synchronous={0}'.format(config['SQLITE_SYNCHRONOUS']))
+        cursor.execute('PRAGMA mmap_size={0:d}'.format(config['SQLITE_MMAP_SIZE']))
+        cursor.close()
 
+
+# the engine is configured through the Flask-SQLAlchemy keys (SQLALCHEMY_DATABASE_URI, SQLALCHEMY_POOL_SIZE,
+# SQLALCHEMY_MAX_OVERFLOW, SQLALCHEMY_POOL_RECYCLE), replicas through SQLALCHEMY_REPLICA_URIS
 def setup_database(app):
-    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', url)
+    app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+    app.config.setdefault('SQLITE_JOURNAL_MODE', 'WAL')
+    app.config.setdefault('SQLITE_SYNCHRONOUS', 'NORMAL')
+    app.config.setdefault('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    binds.update(zip(replica_binds(app), app.config['SQLALCHEMY_REPLICA_URIS']))
+    app.config['SQLALCHEMY_BINDS'] = binds
     db.init_app(app)
     app.app_context().push()
-    db.create_all()
+    for engine in engines(app):
+        tune_sqlite(engine, app.config)
+
+    # the pushed app context is never torn down, so the session is handed back at the end of every request
+    @app.teardown_request
+    def remove_session(exception=None):
+        db.session.remove()
+
     return db
+
+
+# tables missing from the database, and indexes missing from the tables it has, which create_all leaves out;
+# indexes over columns the table does not have yet are skipped, adding columns takes a migration.
+# Returns the names of the tables, the indexes to create and the names of those skipped
+def plan_schema(db):
+    inspector = inspect(db.engine)
+    tables, indexes, skipped = [], [], []
+    existing_tables = set(inspector.get_table_names())
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            tables.append(table.name)
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name in existing:
+                continue
+            if all(column.name in columns for column in index.columns):
+                indexes.append(index)
+            else:
+                skipped.append(index.name)
+    return tables, indexes, skipped
+
+
+# applies plan_schema, then refreshes the planner statistics so queries pick up the new indexes right away.
+# Returns the names of the indexes created and of those skipped
+def create_schema(db):
+    tables, indexes, skipped = plan_schema(db)
+    db.create_all()
+    for index in indexes:
+        index.create(db.engine)
+    if indexes:
+        db.engine.execute('ANALYZE')
+    return [index.name for index in indexes], skipped
@@ -0,0 +1,19 @@
+# keyset pagination: rows come back ordered by a unique column and the next page starts after the last value seen,
+# so deep pages cost the same as the first one, unlike OFFSET
+def keyset_page(query, column, limit, after=None):
+    if after is not None:
+        query = query.filter(column > after)
+    rows = query.order_by(column).limit(limit + 1).all()
+    if len(rows) > limit:
+        return rows[:limit], getattr(rows[limit - 1], column.key)
+    return rows, None
+
+
+# walks the whole result one page at a time, so only a single batch of rows is held in memory
+def keyset_batches(query, column, size, after=None):
+    while True:
+        rows, after = keyset_page(query, column, size, after)
+        if rows:
+            yield rows
+        if after is None:
+            return
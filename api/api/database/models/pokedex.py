@@ -1,4 +1,5 @@
 from api.database import db
+from api.lib.guid import GUID
 
 
 # TODO - convert to class mix-in
@@ -41,6 +42,7 @@ class Pokemon(db.Model):
     charge_attacks = db.relationship('Attack', secondary='pokemon_attack',
                                      primaryjoin='and_(Pokemon.id==PokemonAttack.pokemon_id, '
                                                  'Attack.attack_speed_id==2)')
+    attacks = db.relationship('Attack', secondary='pokemon_attack', back_populates='pokemon')
     category = db.relationship('Category')
     egg = db.relationship('Egg', secondary='pokemon_egg', back_populates='pokemon')
     evolves_to = db.relationship('Pokemon', secondary='pokemon_evolution', back_populates='evolves_from',
@@ -60,7 +62,8 @@ class PokemonEvolution(db.Model):
     __tablename__ = 'pokemon_evolution'
 
     from_pokemon_id = db.Column(db.Integer, db.ForeignKey('pokemon.id'), primary_key=True)
-    to_pokemon_id = db.Column(db.Integer, db.ForeignKey('pokemon.id'), primary_key=True)
+    # Pokemon.evolves_from joins on the second column of the primary key
+    to_pokemon_id = db.Column(db.Integer, db.ForeignKey('pokemon.id'), primary_key=True, index=True)
     candy = db.Column(db.Integer, nullable=False)
 
     def __repr__(self):
@@ -103,7 +106,7 @@ class TypeEffectiveness(db.Model):
     __tablename__ = 'type_effectiveness'
 
     from_type_id = db.Column(db.Integer, db.ForeignKey('type.id'), primary_key=True)
-    to_type_id = db.Column(db.Integer, db.ForeignKey('type.id'), primary_key=True)
+    to_type_id = db.Column(db.Integer, db.ForeignKey('type.id'), primary_key=True, index=True)
     effectiveness_id = db.Column(db.Integer, db.ForeignKey('effectiveness.id'), primary_key=True)
 
     def __repr__(self):
@@ -114,7 +117,7 @@ class PokemonType(db.Model):
     __tablename__ = 'pokemon_type'
 
     pokemon_id = db.Column(db.Integer, db.ForeignKey('pokemon.id'), primary_key=True)
-    type_id = db.Column(db.Integer, db.ForeignKey('type.id'), primary_key=True)
+    type_id = db.Column(db.Integer, db.ForeignKey('type.id'), primary_key=True, index=True)
 
     def __repr__(self):
         return repr_gen(self, ['pokemon_id', 'type_id'])
@@ -157,7 +160,7 @@ class PokemonAttack(db.Model):
     __tablename__ = 'pokemon_attack'
 
     pokemon_id = db.Column(db.Integer, db.ForeignKey('pokemon.id'), primary_key=True)
-    attack_id = db.Column(db.Integer, db.ForeignKey('attack.id'), primary_key=True)
+    attack_id = db.Column(db.Integer, db.ForeignKey('attack.id'), primary_key=True, index=True)
 
     def __repr__(self):
         return repr_gen(self, ['pokemon_id', 'attack_id'])
@@ -180,7 +183,7 @@ class PokemonEgg(db.Model):
     __tablename__ = 'pokemon_egg'
 
     pokemon_id = db.Column(db.Integer, db.ForeignKey('pokemon.id'), primary_key=True)
-    egg_id = db.Column(db.Integer, db.ForeignKey('egg.id'), primary_key=True)
+    egg_id = db.Column(db.Integer, db.ForeignKey('egg.id'), primary_key=True, index=True)
 
     def __repr__(self):
         return repr_gen(self, ['pokemon_id', 'egg_id'])
@@ -318,12 +321,13 @@ class User(db.Model):
     notes = db.Column(db.Text)
     coins = db.Column(db.Integer)
     stardust = db.Column(db.Integer)
-    buddy_pokemon_id = db.Column(db.Integer, db.ForeignKey('user_pokemon.id'))
+    # deleting a user_pokemon looks up the users that still reference it
+    buddy_pokemon_id = db.Column(db.Integer, db.ForeignKey('user_pokemon.id'), index=True)
     bag_size = db.Column(db.Integer)
     pokemon_storage_size = db.Column(db.Integer)
     team_id = db.Column(db.Integer, db.ForeignKey('team.id'))
     created = db.Column(db.TIMESTAMP(timezone=True), server_default=db.func.now())
-    last_modified = db.Column(db.TIMESTAMP(timezone=True), onupdate=db.func.now())
+    last_modified = db.Column(db.TIMESTAMP(timezone=True), default=db.func.now(), onupdate=db.func.now())
 
     pokemon = db.relationship('UserPokemon', primaryjoin='User.id==UserPokemon.user_id')
     team = db.relationship('Team')
@@ -359,10 +363,22 @@ class UserMedal(db.Model):
 
 class UserPokemon(db.Model):
     __tablename__ = 'user_pokemon'
+    __table_args__ = (
+        # keyset pagination of a user's collection
+        db.Index('ix_user_pokemon_user_id_id', 'user_id', 'id'),
+        # the same filtered by species, e.g. ?pokemon_id=25
+        db.Index('ix_user_pokemon_user_id_pokemon_id_id', 'user_id', 'pokemon_id', 'id'),
+        # client generated ids make replayed uploads idempotent
+        db.UniqueConstraint('user_id', 'guid', name='uq_user_pokemon_user_id_guid'),
+        # delta syncs of a user's collection
+        db.Index('ix_user_pokemon_user_id_last_modified', 'user_id', 'last_modified'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    pokemon_id = db.Column(db.Integer, db.ForeignKey('pokemon.id'), nullable=False)
+    # exports of a species across users, and the foreign key check when a species is deleted
+    pokemon_id = db.Column(db.Integer, db.ForeignKey('pokemon.id'), nullable=False, index=True)
+    guid = db.Column(GUID)
     name = db.Column(db.String(24))
     notes = db.Column(db.Text)
     height = db.Column(db.Numeric(5, 2))
@@ -380,9 +396,13 @@ class UserPokemon(db.Model):
     appraisal_stats_id = db.Column(db.Integer, db.ForeignKey('appraisal_stats.id'))
     appraisal_size_id = db.Column(db.Integer, db.ForeignKey('appraisal_size.id'))
     caught_location = db.Column(db.String)
+    # parsed from caught_location
+    caught_latitude = db.Column(db.Float)
+    caught_longitude = db.Column(db.Float)
+    caught_geohash = db.Column(db.String(12), index=True)
     caught_date = db.Column(db.Date)
     created = db.Column(db.TIMESTAMP(timezone=True), server_default=db.func.now())
-    last_modified = db.Column(db.TIMESTAMP(timezone=True), onupdate=db.func.now())
+    last_modified = db.Column(db.TIMESTAMP(timezone=True), default=db.func.now(), onupdate=db.func.now())
 
     user = db.relationship('User', foreign_keys=[user_id], back_populates='pokemon')
     pokemon = db.relationship('Pokemon')
@@ -394,10 +414,11 @@ class UserPokemon(db.Model):
     appraisal_iv = db.relationship('AppraisalIv', secondary='user_pokemon_appraisal_iv')
 
     def __repr__(self):
-        return repr_gen(self, ['user_id', 'pokemon_id', 'name', 'notes', 'height', 'weight', 'stamina', 'attack',
-                               'defense', 'cp', 'hp', 'power_up_stardust', 'power_up_candy', 'fast_attack_id',
+        return repr_gen(self, ['user_id', 'pokemon_id', 'guid', 'name', 'notes', 'height', 'weight', 'stamina',
+                               'attack', 'defense', 'cp', 'hp', 'power_up_stardust', 'power_up_candy', 'fast_attack_id',
                                'charge_attack_id', 'appraisal_overall_id', 'appraisal_stats_id', 'caught_location',
-                               'caught_date', 'created', 'last_modified'])
+                               'caught_latitude', 'caught_longitude', 'caught_geohash', 'caught_date', 'created',
+                               'last_modified'])
 
 
 class AppraisalIv(db.Model):
@@ -445,12 +466,128 @@ class UserCandy(db.Model):
 
 class UserLog(db.Model):
     __tablename__ = 'user_log'
+    __table_args__ = (
+        # a user's logs in order
+        db.Index('ix_user_log_user_id_id', 'user_id', 'id'),
+        db.Index('ix_user_log_user_id_last_modified', 'user_id', 'last_modified'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     notes = db.Column(db.Text, nullable=False)
     created = db.Column(db.TIMESTAMP(timezone=True), server_default=db.func.now())
-    last_modified = db.Column(db.TIMESTAMP(timezone=True), onupdate=db.func.now())
+    last_modified = db.Column(db.TIMESTAMP(timezone=True), default=db.func.now(), onupdate=db.func.now())
 
     def __repr__(self):
         return repr_gen(self, ['user_id', 'notes', 'date', 'created', 'last_modified'])
+
+
+class DataVersion(db.Model):
+    __tablename__ = 'data_version'
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.String(32), unique=True, nullable=False)
+    created = db.Column(db.TIMESTAMP(timezone=True), server_default=db.func.now())
+
+    def __repr__(self):
+        return repr_gen(self, ['version', 'created'])
+
+
+# catches per species and slippy map tile, for every zoom level up to api.spawns.MAX_ZOOM
+class SpawnCell(db.Model):
+    __tablename__ = 'spawn_cell'
+
+    pokemon_id = db.Column(db.Integer, db.ForeignKey('pokemon.id'), primary_key=True)
+    zoom = db.Column(db.Integer, primary_key=True)
+    x = db.Column(db.Integer, primary_key=True)
+    y = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return repr_gen(self, ['pokemon_id', 'zoom', 'x', 'y', 'count'])
+
+
+# user_pokemon totals per species and team (0 for players without a team), kept up to date by api.stats
+class SpeciesStats(db.Model):
+    __tablename__ = 'species_stats'
+
+    pokemon_id = db.Column(db.Integer, db.ForeignKey('pokemon.id'), primary_key=True)
+    team_id = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.BigInteger, nullable=False)
+    cp_count = db.Column(db.BigInteger, nullable=False)
+    cp_sum = db.Column(db.BigInteger, nullable=False)
+    cp_sum_squares = db.Column(db.BigInteger, nullable=False)
+    hp_count = db.Column(db.BigInteger, nullable=False)
+    hp_sum = db.Column(db.BigInteger, nullable=False)
+    hp_sum_squares = db.Column(db.BigInteger, nullable=False)
+
+    def __repr__(self):
+        return repr_gen(self, ['pokemon_id', 'team_id', 'count', 'cp_count', 'cp_sum', 'cp_sum_squares', 'hp_count',
+                               'hp_sum', 'hp_sum_squares'])
+
+
+class SpeciesHistogram(db.Model):
+    __tablename__ = 'species_histogram'
+
+    pokemon_id = db.Column(db.Integer, db.ForeignKey('pokemon.id'), primary_key=True)
+    team_id = db.Column(db.Integer, primary_key=True)
+    metric = db.Column(db.String(8), primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.BigInteger, nullable=False)
+
+    def __repr__(self):
+        return repr_gen(self, ['pokemon_id', 'team_id', 'metric', 'bucket', 'count'])
+
+
+# queue and result cache of api.jobs; key identifies the kind and parameters, so identical jobs are shared
+class Job(db.Model):
+    __tablename__ = 'job'
+    __table_args__ = (
+        # one queued or running job per result, however many submissions race for it
+        db.Index('uq_job_kind_key_active', 'kind', 'key', unique=True,
+                 sqlite_where=db.text("status IN ('queued', 'running')"),
+                 postgresql_where=db.text("status IN ('queued', 'running')")),
+    )
+
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(32), nullable=False)
+    params = db.Column(db.Text, nullable=False)
+    key = db.Column(db.String(40), nullable=False, index=True)
+    status = db.Column(db.String(16), nullable=False, index=True)
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    created = db.Column(db.TIMESTAMP(timezone=True), nullable=False)
+    started = db.Column(db.TIMESTAMP(timezone=True))
+    finished = db.Column(db.TIMESTAMP(timezone=True))
+    expires = db.Column(db.TIMESTAMP(timezone=True))
+
+    def __repr__(self):
+        return repr_gen(self, ['kind', 'params', 'status', 'error', 'created', 'started', 'finished', 'expires'])
+
+
+# bearer tokens revoked before they expire, see api.auth
+class RevokedToken(db.Model):
+    __tablename__ = 'revoked_token'
+
+    jti = db.Column(db.String(32), primary_key=True)
+    expires = db.Column(db.TIMESTAMP(timezone=True), nullable=False, index=True)
+
+    def __repr__(self):
+        return repr_gen(self, ['jti', 'expires'])
+
+
+# rows deleted from a user's data, kept so delta syncs can tell clients to drop them, see api.sync
+class Tombstone(db.Model):
+    __tablename__ = 'tombstone'
+    __table_args__ = (
+        db.Index('ix_tombstone_user_id_deleted', 'user_id', 'deleted'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    table_name = db.Column(db.String(32), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    deleted = db.Column(db.TIMESTAMP(timezone=True), default=db.func.now(), nullable=False, index=True)
+
+    def __repr__(self):
+        return repr_gen(self, ['user_id', 'table_name', 'row_id', 'deleted'])
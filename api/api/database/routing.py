@@ -0,0 +1,40 @@
+from flask import current_app, has_request_context, request
+from flask_sqlalchemy import SignallingSession
+
+import random
+
+REPLICA_BIND = 'replica{0}'
+READ_METHODS = ('GET', 'HEAD')
+
+
+# marks a view whose GETs only read, so their queries may be answered by a replica that lags the primary
+def read_only(fn):
+    fn.read_only = True
+    return fn
+
+
+def replica_binds(app):
+    return [REPLICA_BIND.format(i) for i in range(len(app.config['SQLALCHEMY_REPLICA_URIS']))]
+
+
+def _reads_replica():
+    if not has_request_context() or request.method not in READ_METHODS:
+        return False
+    return getattr(current_app.view_functions.get(request.endpoint), 'read_only', False)
+
+
+# sends the queries of read only views to one replica per session, picked at random, and everything else,
+# flushes included, to the primary
+class RoutingSession(SignallingSession):
+    def __init__(self, db, **options):
+        self._db = db
+        self._replica = None
+        SignallingSession.__init__(self, db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        binds = replica_binds(self.app)
+        if not binds or self._flushing or not _reads_replica():
+            return SignallingSession.get_bind(self, mapper, clause)
+        if self._replica is None:
+            self._replica = self._db.get_engine(self.app, bind=random.choice(binds))
+        return self._replica
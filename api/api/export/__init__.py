@@ -0,0 +1 @@
+from .export import export, export_query, COLUMNS, EXPORT_CHUNK_SIZE, FORMATS
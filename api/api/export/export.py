@@ -0,0 +1,159 @@
+from api.database.models import pokedex
+
+from collections import namedtuple
+import csv
+from datetime import date, datetime, timezone
+from decimal import Decimal
+import io
+import json
+import zipfile
+
+import numpy as np
+
+# rows fetched from the cursor at a time, also the rows of one npz row group
+EXPORT_CHUNK_SIZE = 10000
+
+Column = namedtuple('Column', ['name', 'expression', 'dtype'])
+# every catch with the base stats of its species; nullable numbers are floats in npz so they can hold NaN
+COLUMNS = [
+    Column('id', pokedex.UserPokemon.id, np.int64),
+    Column('user_id', pokedex.UserPokemon.user_id, np.int64),
+    Column('pokemon_id', pokedex.UserPokemon.pokemon_id, np.int64),
+    Column('species', pokedex.Pokemon.name, str),
+    Column('base_stamina', pokedex.Pokemon.stamina, np.float64),
+    Column('base_attack', pokedex.Pokemon.attack, np.float64),
+    Column('base_defense', pokedex.Pokemon.defense, np.float64),
+    Column('name', pokedex.UserPokemon.name, str),
+    Column('cp', pokedex.UserPokemon.cp, np.float64),
+    Column('hp', pokedex.UserPokemon.hp, np.float64),
+    Column('attack', pokedex.UserPokemon.attack, np.float64),
+    Column('defense', pokedex.UserPokemon.defense, np.float64),
+    Column('stamina', pokedex.UserPokemon.stamina, np.float64),
+    Column('height', pokedex.UserPokemon.height, np.float64),
+    Column('weight', pokedex.UserPokemon.weight, np.float64),
+    Column('fast_attack_id', pokedex.UserPokemon.fast_attack_id, np.float64),
+    Column('charge_attack_id', pokedex.UserPokemon.charge_attack_id, np.float64),
+    Column('caught_latitude', pokedex.UserPokemon.caught_latitude, np.float64),
+    Column('caught_longitude', pokedex.UserPokemon.caught_longitude, np.float64),
+    Column('caught_geohash', pokedex.UserPokemon.caught_geohash, str),
+    Column('caught_date', pokedex.UserPokemon.caught_date, 'datetime64[D]'),
+    Column('created', pokedex.UserPokemon.created, 'datetime64[us]'),
+]
+NAMES = [column.name for column in COLUMNS]
+
+
+# the ORM query of the export, so the filters of the collection route apply to it unchanged
+def export_query(session):
+    return session.query(*[column.expression.label(column.name) for column in COLUMNS]) \
+        .join(pokedex.Pokemon, pokedex.Pokemon.id == pokedex.UserPokemon.pokemon_id)
+
+
+# lists of rows read from a server side cursor, so only one chunk is in memory however many rows match
+def export_chunks(session, query, chunk_size=EXPORT_CHUNK_SIZE):
+    connection = session.connection().execution_options(stream_results=True)
+    result = connection.execute(query.order_by(pokedex.UserPokemon.id).statement)
+    try:
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield rows
+    finally:
+        result.close()
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def write_csv(chunks):
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator='\n')
+    writer.writerow(NAMES)
+    for rows in chunks:
+        writer.writerows([_text(value) for value in row] for row in rows)
+        yield out.getvalue().encode('utf-8')
+        out.seek(0)
+        out.truncate()
+    if out.tell():
+        yield out.getvalue().encode('utf-8')
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(repr(value))
+
+
+def write_ndjson(chunks):
+    for rows in chunks:
+        yield ''.join(json.dumps(dict(zip(NAMES, row)), default=_json_default, separators=(',', ':')) + '\n'
+                      for row in rows).encode('utf-8')
+
+
+# numpy datetimes carry no offset, so timestamps are stored in UTC
+def _naive_utc(value):
+    if getattr(value, 'tzinfo', None) is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _array(column, values):
+    if column.dtype is str:
+        return np.array(['' if value is None else value for value in values], dtype=str)
+    if column.dtype in ('datetime64[D]', 'datetime64[us]'):
+        return np.array([_naive_utc(value) for value in values], dtype=column.dtype)
+    if column.dtype is np.float64:
+        return np.array([np.nan if value is None else float(value) for value in values], dtype=np.float64)
+    return np.array(values, dtype=column.dtype)
+
+
+# collects what zipfile writes, it only needs write() to stream an archive
+class _Buffer:
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+# a numpy npz archive holding one .npy per column and row group, named like 'rows000000/cp'; np.load reads it and
+# np.concatenate of a column over its groups gives the whole column
+def write_npz(chunks):
+    out = _Buffer()
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for group, rows in enumerate(chunks):
+            for i, column in enumerate(COLUMNS):
+                array = io.BytesIO()
+                np.save(array, _array(column, [row[i] for row in rows]), allow_pickle=False)
+                archive.writestr('rows{0:06d}/{1}.npy'.format(group, column.name), array.getvalue())
+            yield out.take()
+    yield out.take()
+
+
+Format = namedtuple('Format', ['mimetype', 'extension', 'write'])
+FORMATS = {
+    'csv': Format('text/csv', 'csv', write_csv),
+    'ndjson': Format('application/x-ndjson', 'ndjson', write_ndjson),
+    'npz': Format('application/octet-stream', 'npz', write_npz),
+}
+
+
+# the rows of the query in the given format, as chunks of bytes
+def export(session, query, export_format, chunk_size=EXPORT_CHUNK_SIZE):
+    return FORMATS[export_format].write(export_chunks(session, query, chunk_size))
@@ -0,0 +1 @@
+from .runner import jobs, setup_jobs, JobRunner, QUEUED, RUNNING, DONE, FAILED
@@ -0,0 +1,164 @@
+from api.database import uncounted
+from api.database.models import pokedex
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from hashlib import sha1
+from uuid import uuid4
+import json
+import logging
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.exc import IntegrityError
+
+log = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def job_key(kind, params):
+    return sha1('{0}:{1}'.format(kind, json.dumps(params, sort_keys=True)).encode('utf-8')).hexdigest()
+
+
+# runs registered tasks on a thread pool, off the request threads; the job table is the queue, so jobs survive a
+# restart, and keeps finished results around as a cache until they expire or get evicted
+class JobRunner:
+    def __init__(self):
+        self.tasks = {}
+        self.admin_tasks = set()
+        self._app = None
+        self._db = None
+        self._executor = None
+
+    # admin tasks work over every user's data and are submitted by admins only, see api.auth.refuse_unless_admin
+    def task(self, kind, schema=None, admin=False):
+        def decorator(fn):
+            self.tasks[kind] = fn, schema
+            if admin:
+                self.admin_tasks.add(kind)
+            return fn
+        return decorator
+
+    def init_app(self, app, db):
+        app.config.setdefault('JOB_WORKERS', 2)
+        app.config.setdefault('JOB_RESULT_TTL', 3600)
+        app.config.setdefault('JOB_TIMEOUT', 600)
+        app.config.setdefault('JOB_CACHE_SIZE', 256)
+        app.config.setdefault('JOB_CACHE_BYTES', 64 * 1024 * 1024)
+        self._app = app
+        self._db = db
+        self._executor = ThreadPoolExecutor(max_workers=app.config['JOB_WORKERS'])
+
+    # the threads of the pool stay behind in the parent of a fork, so a forked worker starts a pool of its own
+    def after_fork(self):
+        self._executor = ThreadPoolExecutor(max_workers=self._app.config['JOB_WORKERS'])
+
+    # queued jobs left over by a previous process; runs before the first request, which is not charged for it
+    def recover(self):
+        with uncounted():
+            job_ids = self._db.session.query(pokedex.Job.id).filter_by(status=QUEUED) \
+                .order_by(pokedex.Job.created).all()
+        for job_id, in job_ids:
+            self._executor.submit(self._run, job_id)
+
+    # the job computing or holding the result of the given key, if any
+    def _current(self, kind, key, now):
+        return pokedex.Job.query.filter(pokedex.Job.kind == kind, pokedex.Job.key == key, or_(
+            pokedex.Job.status == QUEUED,
+            and_(pokedex.Job.status == RUNNING,
+                 pokedex.Job.started > now - timedelta(seconds=self._app.config['JOB_TIMEOUT'])),
+            and_(pokedex.Job.status == DONE, pokedex.Job.expires > now),
+        )).order_by(pokedex.Job.created.desc()).first()
+
+    # returns the job computing or holding the same result when there is one, otherwise queues a new one
+    def submit(self, kind, params):
+        session = self._db.session
+        config = self._app.config
+        now = datetime.utcnow()
+        key = job_key(kind, params)
+        job = self._current(kind, key, now)
+        if job is not None:
+            return job
+
+        # a job running past the timeout is given up on, which frees its place among the active jobs
+        pokedex.Job.query.filter(
+            pokedex.Job.kind == kind, pokedex.Job.key == key, pokedex.Job.status == RUNNING,
+            pokedex.Job.started <= now - timedelta(seconds=config['JOB_TIMEOUT']),
+        ).update({'status': FAILED, 'error': 'Timed out.', 'finished': now,
+                  'expires': now + timedelta(seconds=config['JOB_RESULT_TTL'])}, synchronize_session=False)
+        job = pokedex.Job(id=uuid4().hex, kind=kind, params=json.dumps(params, sort_keys=True), key=key,
+                          status=QUEUED, created=now)
+        session.add(job)
+        try:
+            session.commit()
+        except IntegrityError:
+            # another submission queued the same job since the lookup above
+            session.rollback()
+            return self._current(kind, key, now)
+        self._executor.submit(self._run, job.id)
+        return job
+
+    # the job unless its result has expired
+    def get(self, job_id):
+        return pokedex.Job.query.filter(pokedex.Job.id == job_id, or_(
+            pokedex.Job.expires.is_(None), pokedex.Job.expires > datetime.utcnow())).first()
+
+    def _run(self, job_id):
+        with self._app.app_context():
+            session = self._db.session
+            # claiming the row makes sure only one worker, of any process, runs the job
+            claimed = pokedex.Job.query.filter_by(id=job_id, status=QUEUED) \
+                .update({'status': RUNNING, 'started': datetime.utcnow()}, synchronize_session=False)
+            session.commit()
+            if not claimed:
+                return
+
+            job = pokedex.Job.query.get(job_id)
+            values = {}
+            try:
+                fn, _ = self.tasks[job.kind]
+                values['result'] = json.dumps(fn(**json.loads(job.params)), separators=(',', ':'))
+                values['status'] = DONE
+            except Exception as e:
+                session.rollback()
+                log.exception('job %s (%s) failed', job_id, job.kind)
+                values['status'] = FAILED
+                values['error'] = str(e) or e.__class__.__name__
+            now = datetime.utcnow()
+            values['finished'] = now
+            values['expires'] = now + timedelta(seconds=self._app.config['JOB_RESULT_TTL'])
+            pokedex.Job.query.filter_by(id=job_id).update(values, synchronize_session=False)
+            session.commit()
+            self.evict()
+
+    # drops expired results, then the oldest ones beyond the configured number and size of cached results
+    def evict(self):
+        session = self._db.session
+        config = self._app.config
+        finished = pokedex.Job.status.in_([DONE, FAILED])
+        pokedex.Job.query.filter(finished, pokedex.Job.expires <= datetime.utcnow()) \
+            .delete(synchronize_session=False)
+
+        evicted = []
+        kept = size = 0
+        for job_id, length in session.query(pokedex.Job.id, func.coalesce(func.length(pokedex.Job.result), 0)) \
+                .filter(finished).order_by(pokedex.Job.finished.desc()):
+            kept += 1
+            size += length
+            if kept > config['JOB_CACHE_SIZE'] or size > config['JOB_CACHE_BYTES']:
+                evicted.append(job_id)
+        if evicted:
+            pokedex.Job.query.filter(pokedex.Job.id.in_(evicted)).delete(synchronize_session=False)
+        session.commit()
+
+
+jobs = JobRunner()
+
+
+def setup_jobs(app, db):
+    jobs.init_app(app, db)
+    app.before_first_request(jobs.recover)
+    return jobs
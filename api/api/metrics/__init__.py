@@ -0,0 +1,3 @@
+from .instrument import add_serialize_time, registry, setup_metrics
+from .profiler import SlowRequestProfiler
+from .registry import Counter, Histogram, Registry
@@ -0,0 +1,93 @@
+from api.database import engines
+from .profiler import SlowRequestProfiler
+from .registry import Counter, Histogram, Registry, COUNT_BUCKETS, SIZE_BUCKETS
+
+from time import perf_counter
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+registry = Registry()
+request_seconds = registry.register(Histogram(
+    'pokedex_request_duration_seconds', 'Time from the start of the request until the view returned.',
+    ('endpoint', 'method', 'status')))
+request_sql_statements = registry.register(Histogram(
+    'pokedex_request_sql_statements', 'SQL statements run per request.', ('endpoint',), COUNT_BUCKETS))
+request_sql_seconds = registry.register(Histogram(
+    'pokedex_request_sql_seconds', 'Time per request spent executing SQL statements.', ('endpoint',)))
+request_serialize_seconds = registry.register(Histogram(
+    'pokedex_request_serialize_seconds', 'Time per request spent dumping responses.', ('endpoint',)))
+response_bytes = registry.register(Histogram(
+    'pokedex_response_size_bytes', 'Size of response bodies, streamed responses excluded.', ('endpoint',),
+    SIZE_BUCKETS))
+slow_requests = registry.register(Counter(
+    'pokedex_slow_requests_profiled_total', 'Requests slower than PROFILE_SLOW_REQUESTS that were profiled.',
+    ('endpoint',)))
+
+
+def add_serialize_time(seconds):
+    if has_request_context():
+        g.serialize_seconds = g.get('serialize_seconds', 0.0) + seconds
+
+
+# per endpoint timings and sizes, collected per process; statements are the ones setup_statement_counter counts.
+# PROFILE_SLOW_REQUESTS, in seconds, turns on the sampling profiler, which is off by default
+def setup_metrics(app, db):
+    app.config.setdefault('PROFILE_SLOW_REQUESTS', None)
+    app.config.setdefault('PROFILE_INTERVAL', 0.005)
+    profiler = None
+    if app.config['PROFILE_SLOW_REQUESTS'] is not None:
+        profiler = SlowRequestProfiler(app.config['PROFILE_SLOW_REQUESTS'], app.config['PROFILE_INTERVAL'])
+
+    # a connection runs one statement at a time; a statement that raises never reaches after_cursor_execute, so its
+    # start is dropped in handle_error rather than left for the next statement to find
+    def start_statement(conn, *args):
+        conn.info['statement_started'] = perf_counter()
+
+    def end_statement(conn, *args):
+        started = conn.info.pop('statement_started', None)
+        if started is not None and has_request_context():
+            g.sql_seconds = g.get('sql_seconds', 0.0) + perf_counter() - started
+
+    def drop_statement(context):
+        if context.connection is not None:
+            context.connection.info.pop('statement_started', None)
+
+    for engine in engines(app):
+        event.listen(engine, 'before_cursor_execute', start_statement)
+        event.listen(engine, 'after_cursor_execute', end_statement)
+        event.listen(engine, 'handle_error', drop_statement)
+
+    # setup_database keeps an app context pushed, so g outlives the request and has to be reset here
+    @app.before_request
+    def start_request():
+        g.request_started = perf_counter()
+        g.sql_seconds = 0.0
+        g.serialize_seconds = 0.0
+        if profiler is not None:
+            profiler.begin()
+
+    @app.after_request
+    def record_request(response):
+        endpoint = request.endpoint or 'none'
+        request_seconds.observe(perf_counter() - g.request_started, endpoint, request.method,
+                                str(response.status_code))
+        request_sql_statements.observe(g.get('sql_statements', 0), endpoint)
+        request_sql_seconds.observe(g.sql_seconds, endpoint)
+        request_serialize_seconds.observe(g.serialize_seconds, endpoint)
+        # streamed responses carry no length, and measuring them would buffer the whole body
+        if response.content_length is not None:
+            response_bytes.observe(response.content_length, endpoint)
+        return response
+
+    # teardown also runs after errors, so the profiler never keeps sampling a finished request
+    @app.teardown_request
+    def end_profile(exception=None):
+        if profiler is not None and 'request_started' in g:
+            duration = perf_counter() - g.request_started
+            if duration >= profiler.threshold:
+                slow_requests.inc(request.endpoint or 'none')
+            profiler.end(request.method, request.path, request.endpoint, duration)
+
+    app.extensions['profiler'] = profiler
+    return profiler
@@ -0,0 +1,58 @@
+from collections import Counter, deque
+from threading import Event, Lock, Thread, get_ident
+import sys
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return '{0} ({1}:{2})'.format(code.co_name, code.co_filename, code.co_firstlineno)
+
+
+# samples the stacks of the threads serving requests every interval seconds and keeps the folded stacks
+# (root;...;leaf count, the input of flamegraph.pl and speedscope) of requests slower than the threshold; the
+# sampler thread only runs when a threshold is configured and only walks the threads with a request in flight
+class SlowRequestProfiler:
+    def __init__(self, threshold, interval=0.005, keep=50):
+        self.threshold = threshold
+        self.interval = interval
+        self.profiles = deque(maxlen=keep)
+        self._active = {}
+        self._lock = Lock()
+        self._stopped = Event()
+        self._thread = Thread(target=self._sample, name='slow-request-profiler', daemon=True)
+        self._thread.start()
+
+    def begin(self):
+        with self._lock:
+            self._active[get_ident()] = Counter()
+
+    # the stacks of the finished request, kept when it took at least threshold seconds
+    def end(self, method, path, endpoint, duration):
+        with self._lock:
+            stacks = self._active.pop(get_ident(), None)
+        if stacks and duration >= self.threshold:
+            self.profiles.append({
+                'method': method,
+                'path': path,
+                'endpoint': endpoint,
+                'duration': round(duration, 6),
+                'samples': sum(stacks.values()),
+                'folded': '\n'.join('{0} {1}'.format(stack, count) for stack, count in stacks.most_common()),
+            })
+
+    def stop(self):
+        self._stopped.set()
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for ident, stacks in self._active.items():
+                    frame = frames.get(ident)
+                    names = []
+                    while frame is not None:
+                        names.append(_frame_name(frame))
+                        frame = frame.f_back
+                    stacks[';'.join(reversed(names))] += 1
@@ -0,0 +1 @@
+from .compiled import compile_all, compile_schema, dumps, json_response
@@ -0,0 +1,275 @@
+from api.metrics import add_serialize_time
+
+from decimal import Decimal
+from time import perf_counter
+
+from flask import current_app, request
+from marshmallow import fields
+from marshmallow.compat import basestring
+from marshmallow_sqlalchemy.fields import Related
+from simplejson.encoder import encode_basestring, encode_basestring_ascii
+from sqlalchemy import inspect
+from sqlalchemy.orm.interfaces import MANYTOONE
+
+# values of these exact types are written as they are, anything else goes through the field's own _serialize
+FAST_TYPES = (
+    (fields.Integer, int),
+    (fields.String, str),
+    (fields.Boolean, bool),
+)
+
+
+class Dumped:
+    __slots__ = ('schema', 'obj', 'many')
+
+    def __init__(self, schema, obj, many):
+        self.schema = schema
+        self.obj = obj
+        self.many = many
+
+
+class Context:
+    def __init__(self, indent, ensure_ascii, encoder):
+        self.pretty = indent is not None
+        self.indent = ' ' * (indent or 0)
+        self.key_separator = ': ' if self.pretty else ':'
+        self.encode_string = encode_basestring_ascii if ensure_ascii else encode_basestring
+        self.encoder = encoder
+        self.memo = {}
+        self._newlines = {}
+        self._separators = {}
+
+    def newline(self, level):
+        try:
+            return self._newlines[level]
+        except KeyError:
+            value = self._newlines[level] = '\n' + self.indent * level if self.pretty else ''
+            return value
+
+    def separator(self, level):
+        try:
+            return self._separators[level]
+        except KeyError:
+            value = self._separators[level] = (', ' if self.pretty else ',') + self.newline(level)
+            return value
+
+    def key(self, name):
+        return self.encode_string(name) + self.key_separator
+
+
+def write_scalar(value, context):
+    value_type = type(value)
+    if value is None:
+        return 'null'
+    if value_type is str:
+        return context.encode_string(value)
+    if value_type is bool:
+        return 'true' if value else 'false'
+    if value_type is int:
+        return int.__repr__(value)
+    if value_type is Decimal:
+        return str(value)
+    return context.encoder.encode(value)
+
+
+def write_value(value, level, out, context):
+    if isinstance(value, Dumped):
+        if value.many:
+            write_list(value.obj, level, out, context, value.schema.write)
+        elif value.obj is None:
+            out.append('null')
+        else:
+            value.schema.write(value.obj, level, out, context)
+    elif isinstance(value, dict):
+        if not value:
+            out.append('{}')
+            return
+        out.append('{')
+        separator = context.newline(level + 1)
+        for key in sorted(value):
+            out.append(separator)
+            out.append(context.key(key))
+            write_value(value[key], level + 1, out, context)
+            separator = context.separator(level + 1)
+        out.append(context.newline(level))
+        out.append('}')
+    elif isinstance(value, (list, tuple)):
+        write_list(value, level, out, context, write_value)
+    else:
+        out.append(write_scalar(value, context))
+
+
+def write_list(items, level, out, context, write):
+    if not items:
+        out.append('[]')
+        return
+    out.append('[')
+    separator = context.newline(level + 1)
+    for item in items:
+        out.append(separator)
+        write(item, level + 1, out, context)
+        separator = context.separator(level + 1)
+    out.append(context.newline(level))
+    out.append(']')
+
+
+def many_to_one_column(model, name):
+    relationship = inspect(model).relationships.get(name)
+    if relationship is None or relationship.direction is not MANYTOONE or len(relationship.local_columns) != 1:
+        return None
+    column = next(iter(relationship.local_columns))
+    return inspect(model).get_property_by_column(column).key
+
+
+def compile_field(schema, name, field):
+    attribute = field.attribute or name
+    model = schema.opts.model
+
+    if isinstance(field, Related) and len(field.related_keys) == 1:
+        # the id of a many-to-one is already on the row, so read the foreign key instead of loading the object
+        column = many_to_one_column(model, attribute)
+        if column is not None:
+            return lambda obj, level, out, context: out.append(write_scalar(getattr(obj, column), context))
+
+    if isinstance(field, fields.List) and isinstance(field.container, Related) and \
+            len(field.container.related_keys) == 1:
+        key = field.container.related_keys[0].key
+
+        def write_related_list(obj, level, out, context):
+            write_list([getattr(item, key) for item in getattr(obj, attribute)], level, out, context,
+                       lambda value, level, out, context: out.append(write_scalar(value, context)))
+        return write_related_list
+
+    if isinstance(field, fields.Nested) and not isinstance(field.only, basestring):
+        nested = CompiledSchema(lambda: field.schema)
+        if field.many:
+            return lambda obj, level, out, context: write_list(getattr(obj, attribute), level, out, context,
+                                                               nested.write)
+
+        def write_nested(obj, level, out, context):
+            value = getattr(obj, attribute)
+            if value is None:
+                out.append('null')
+            else:
+                nested.write(value, level, out, context)
+        return write_nested
+
+    for field_class, value_type in FAST_TYPES:
+        if isinstance(field, field_class):
+            def write_fast(obj, level, out, context, value_type=value_type):
+                value = getattr(obj, attribute)
+                if value is not None and type(value) is not value_type:
+                    value = field._serialize(value, attribute, obj)
+                out.append(write_scalar(value, context))
+            return write_fast
+
+    if isinstance(field, fields.Decimal) and field.places is None and not field.as_string:
+        def write_decimal(obj, level, out, context):
+            value = getattr(obj, attribute)
+            if value is not None and type(value) is not Decimal:
+                value = field._serialize(value, attribute, obj)
+            out.append(write_scalar(value, context))
+        return write_decimal
+
+    return lambda obj, level, out, context: write_value(field.serialize(attribute, obj, schema.get_attribute),
+                                                        level, out, context)
+
+
+class CompiledSchema:
+    # the schema is only built on first use, so defining serializers costs nothing at import
+    def __init__(self, build_schema):
+        self._build_schema = build_schema
+        self._schema = None
+        self._writers = None
+
+    @property
+    def schema(self):
+        if self._schema is None:
+            self._schema = self._build_schema()
+        return self._schema
+
+    @property
+    def compiled(self):
+        return self._writers is not None
+
+    # fields are resolved on first use, so nested schemas referenced by name only have to exist by then
+    def compile(self):
+        model = self.schema.opts.model
+        writers = []
+        for name, field in self.schema.fields.items():
+            if field.load_only:
+                continue
+            # marshmallow leaves out fields whose attribute is missing, like PokemonSchema.type
+            if model is not None and not hasattr(model, field.attribute or name):
+                continue
+            writers.append((field.dump_to or name, compile_field(self.schema, name, field)))
+        self._writers = sorted(writers, key=lambda writer: writer[0])
+        return self._writers
+
+    def __call__(self, obj, many=False):
+        return Dumped(self, obj, many)
+
+    def write(self, obj, level, out, context):
+        # the same object at the same depth always renders the same text, e.g. the user nested in every
+        # UserPokemon; the memo keeps obj alive so its id cannot be reused during this dump
+        key = (id(self), id(obj), level)
+        memo = context.memo.get(key)
+        if memo is None:
+            parts = []
+            self._write(obj, level, parts, context)
+            memo = context.memo[key] = (obj, ''.join(parts))
+        out.append(memo[1])
+
+    def _write(self, obj, level, out, context):
+        writers = self._writers or self.compile()
+        if not writers:
+            out.append('{}')
+            return
+        out.append('{')
+        separator = context.newline(level + 1)
+        for name, write in writers:
+            out.append(separator)
+            out.append(context.key(name))
+            write(obj, level + 1, out, context)
+            separator = context.separator(level + 1)
+        out.append(context.newline(level))
+        out.append('}')
+
+
+_compiled = {}
+
+
+def compile_schema(schema_class, **options):
+    key = (schema_class, tuple(sorted(options.items())))
+    compiled = _compiled.get(key)
+    if compiled is None:
+        compiled = _compiled[key] = CompiledSchema(lambda: schema_class(**options))
+    return compiled
+
+
+# compiles every serializer not used yet, returns how many that was
+def compile_all():
+    pending = [compiled for compiled in _compiled.values() if not compiled.compiled]
+    for compiled in pending:
+        compiled.compile()
+    return len(pending)
+
+
+# same layout as flask.jsonify: pretty printed unless disabled or the request is an XHR
+def dumps(value, pretty=None):
+    started = perf_counter()
+    if pretty is None:
+        pretty = current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] and not request.is_xhr
+    indent = 2 if pretty else None
+    ensure_ascii = current_app.config['JSON_AS_ASCII']
+    encoder = current_app.json_encoder(indent=indent, ensure_ascii=ensure_ascii,
+                                       separators=(', ', ': ') if pretty else (',', ':'))
+    out = []
+    write_value(value, 0, out, Context(indent, ensure_ascii, encoder))
+    text = ''.join(out)
+    add_serialize_time(perf_counter() - started)
+    return text
+
+
+def json_response(value):
+    return current_app.response_class((dumps(value), '\n'), mimetype=current_app.config['JSONIFY_MIMETYPE'])
@@ -0,0 +1,115 @@
+from api.catalog import catalog
+from api.database import db, engines
+from api.jobs import jobs
+
+import asyncore
+import logging
+import os
+import signal
+import socket
+import time
+from threading import Event
+
+from waitress.server import TcpWSGIServer
+
+log = logging.getLogger(__name__)
+
+# set once the process is shutting down, readiness checks report it so load balancers stop sending requests
+stopping = Event()
+
+
+# waitress on a socket the master already bound and listens on, so every worker accepts from the same port
+class SharedSocketServer(TcpWSGIServer):
+    def bind_server_socket(self):
+        pass
+
+
+def listen(host, port, backlog):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def stop(signum, frame):
+    stopping.set()
+
+
+def stop_on_signals():
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+
+# serves until SIGTERM or SIGINT, then stops accepting and lets in-flight requests finish for up to grace seconds
+def run_worker(app, sock, threads, grace):
+    stop_on_signals()
+    socket_map = {}
+    server = SharedSocketServer(app, map=socket_map, _sock=sock, threads=threads,
+                                host=sock.getsockname()[0], port=sock.getsockname()[1])
+    log.info('worker %s serving on http://%s:%s', os.getpid(), server.effective_host, server.effective_port)
+    while not stopping.is_set():
+        asyncore.loop(timeout=1, map=socket_map, count=1)
+
+    server.close()
+    deadline = time.time() + grace
+    while server.active_channels and time.time() < deadline:
+        for channel in list(server.active_channels.values()):
+            if not channel.requests:
+                channel.will_close = True
+        asyncore.loop(timeout=0.1, map=socket_map, count=1)
+    server.task_dispatcher.shutdown()
+    log.info('worker %s stopped', os.getpid())
+
+
+def spawn(app, sock, threads, grace):
+    pid = os.fork()
+    if pid:
+        return pid
+    stop_on_signals()
+    # connections and pool threads of the master do not survive the fork, the warm catalog does
+    jobs.after_fork()
+    code = 0
+    try:
+        run_worker(app, sock, threads, grace)
+    except Exception:
+        log.exception('worker %s failed', os.getpid())
+        code = 1
+    finally:
+        os._exit(code)
+
+
+# with one worker the server runs in this process; with more, the catalog is loaded before forking so the
+# workers share its pages copy-on-write, and the master restarts workers that die until it is told to stop
+def serve(app, host, port, threads=4, workers=1, grace=30, backlog=1024):
+    catalog.snapshot
+    sock = listen(host, port, backlog)
+    if workers <= 1:
+        run_worker(app, sock, threads, grace)
+        return
+
+    db.session.remove()
+    for engine in engines(app):
+        engine.dispose()
+
+    def forward(signum, frame):
+        stopping.set()
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    children = set()
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for _ in range(workers):
+        children.add(spawn(app, sock, threads, grace))
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping.is_set():
+            log.warning('worker %s exited with status %s, restarting', pid, status)
+            children.add(spawn(app, sock, threads, grace))
+    sock.close()
@@ -0,0 +1 @@
+from .tiles import locate, parse_location, rebuild_spawn_cells, record_spawns, tile_range, MAX_ZOOM
@@ -0,0 +1,146 @@
+from api.database import increment_counters
+from api.database.models import pokedex
+
+from collections import Counter
+import math
+import re
+
+from sqlalchemy import bindparam, func
+
+MAX_ZOOM = 16
+MAX_LATITUDE = 85.0511287798
+GEOHASH_PRECISION = 9
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# "lat,lng", "lat lng" or "(lat, lng)"
+LOCATION = re.compile(r'^\s*\(?\s*([-+]?\d+(?:\.\d+)?)\s*[,; ]\s*([-+]?\d+(?:\.\d+)?)\s*\)?\s*$')
+
+
+def parse_location(text):
+    match = LOCATION.match(text or '')
+    if match is None:
+        return None
+    latitude, longitude = float(match.group(1)), float(match.group(2))
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    return latitude, longitude
+
+
+def geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    bounds = [[-90.0, 90.0], [-180.0, 180.0]]
+    value = (latitude, longitude)
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        # bits alternate between longitude and latitude, starting with longitude
+        axis = 1 if even else 0
+        middle = (bounds[axis][0] + bounds[axis][1]) / 2
+        bits <<= 1
+        if value[axis] >= middle:
+            bits |= 1
+            bounds[axis][0] = middle
+        else:
+            bounds[axis][1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits = bit_count = 0
+    return ''.join(chars)
+
+
+# slippy map tile of a point, the same grid map clients request their tiles in
+def tile(latitude, longitude, zoom):
+    latitude = max(-MAX_LATITUDE, min(MAX_LATITUDE, latitude))
+    scale = 1 << zoom
+    x = int((longitude + 180) / 360 * scale)
+    radians = math.radians(latitude)
+    y = int((1 - math.log(math.tan(radians) + 1 / math.cos(radians)) / math.pi) / 2 * scale)
+    return min(max(x, 0), scale - 1), min(max(y, 0), scale - 1)
+
+
+# tiles covering a west, south, east, north box as (min x, min y, max x, max y)
+def tile_range(west, south, east, north, zoom):
+    min_x, min_y = tile(north, west, zoom)
+    max_x, max_y = tile(south, east, zoom)
+    return min_x, min_y, max_x, max_y
+
+
+# latitude, longitude and geohash of a catch, parsed from its location text unless the coordinates were given
+def coordinates(location, latitude=None, longitude=None):
+    if latitude is None or longitude is None:
+        parsed = parse_location(location)
+        if parsed is None:
+            return None, None, None
+        latitude, longitude = parsed
+    return latitude, longitude, geohash(latitude, longitude)
+
+
+# fills in the coordinates of a UserPokemon, or of a row about to be inserted into user_pokemon
+def locate(user_pokemon):
+    if isinstance(user_pokemon, dict):
+        located = coordinates(user_pokemon.get('caught_location'), user_pokemon.get('caught_latitude'),
+                              user_pokemon.get('caught_longitude'))
+        user_pokemon['caught_latitude'], user_pokemon['caught_longitude'], user_pokemon['caught_geohash'] = located
+    else:
+        located = coordinates(user_pokemon.caught_location, user_pokemon.caught_latitude,
+                              user_pokemon.caught_longitude)
+        user_pokemon.caught_latitude, user_pokemon.caught_longitude, user_pokemon.caught_geohash = located
+    return located[:2] if located[0] is not None else None
+
+
+# adds catches, as (pokemon id, latitude, longitude), to the spawn counts of every zoom level, or with sign -1 takes
+# deleted ones away; the counts are kept per tile so a map request reads a bounded number of cells however many
+# catches there are
+def record_spawns(session, catches, sign=1):
+    counts = Counter()
+    for pokemon_id, latitude, longitude in catches:
+        _count_spawns(counts, pokemon_id, latitude, longitude, sign)
+    _write_spawns(session, counts)
+
+
+def _count_spawns(counts, pokemon_id, latitude, longitude, count):
+    for zoom in range(MAX_ZOOM + 1):
+        x, y = tile(latitude, longitude, zoom)
+        counts[pokemon_id, zoom, x, y] += count
+
+
+def _write_spawns(session, counts):
+    increment_counters(session, pokedex.SpawnCell.__table__, [
+        {'pokemon_id': pokemon_id, 'zoom': zoom, 'x': x, 'y': y, 'count': count}
+        for (pokemon_id, zoom, x, y), count in sorted(counts.items())
+    ], ['pokemon_id', 'zoom', 'x', 'y'], ['count'])
+
+
+# recounts every catch, for data stored before the counts existed. Only rows still lacking coordinates are written
+# to, so the last_modified of the others stays put, and the database groups the catches by species and spot,
+# which is all the recount reads
+def rebuild_spawn_cells(session):
+    user_pokemon = pokedex.UserPokemon
+    table = user_pokemon.__table__
+    located = []
+    for user_pokemon_id, location in session.query(user_pokemon.id, user_pokemon.caught_location).filter(
+            user_pokemon.caught_location.isnot(None),
+            user_pokemon.caught_latitude.is_(None) | user_pokemon.caught_longitude.is_(None)).yield_per(1000):
+        latitude, longitude, caught_geohash = coordinates(location)
+        if latitude is not None:
+            located.append({'_id': user_pokemon_id, 'caught_latitude': latitude, 'caught_longitude': longitude,
+                            'caught_geohash': caught_geohash})
+    if located:
+        session.execute(table.update().where(table.c.id == bindparam('_id')), located)
+
+    counts = Counter()
+    catches = 0
+    for pokemon_id, latitude, longitude, count in session.query(
+            user_pokemon.pokemon_id, user_pokemon.caught_latitude, user_pokemon.caught_longitude, func.count()) \
+            .filter(user_pokemon.caught_latitude.isnot(None), user_pokemon.caught_longitude.isnot(None)) \
+            .group_by(user_pokemon.pokemon_id, user_pokemon.caught_latitude, user_pokemon.caught_longitude) \
+            .yield_per(1000):
+        _count_spawns(counts, pokemon_id, latitude, longitude, count)
+        catches += count
+    session.query(pokedex.SpawnCell).delete()
+    _write_spawns(session, counts)
+    session.commit()
+    return catches
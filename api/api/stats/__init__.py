@@ -0,0 +1 @@
+from .rollup import rebuild_rollups, record_user_pokemon, setup_rollups, species_summary, HISTOGRAM_WIDTHS, NO_TEAM
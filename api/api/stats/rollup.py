@@ -0,0 +1,189 @@
+from api.database import increment_counters
+from api.database.models import pokedex
+
+from collections import Counter
+import math
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event, func, inspect
+
+NO_TEAM = 0
+HISTOGRAM_WIDTHS = {'cp': 100, 'hp': 10, 'iv': 5}
+STAT_COLUMNS = ['count', 'cp_count', 'cp_sum', 'cp_sum_squares', 'hp_count', 'hp_sum', 'hp_sum_squares']
+# user_pokemon columns the rollups depend on
+TRACKED = ['user_id', 'pokemon_id', 'cp', 'hp', 'attack', 'defense', 'stamina']
+
+
+def _int(value):
+    return None if value is None else int(value)
+
+
+class Rollup:
+    def __init__(self):
+        self.stats = Counter()
+        self.histograms = Counter()
+
+    # adds (sign 1) or removes (sign -1) the contribution of one user_pokemon row
+    def add(self, values, team_id, sign):
+        pokemon_id = _int(values['pokemon_id'])
+        if pokemon_id is None:
+            return
+        key = pokemon_id, team_id or NO_TEAM
+        self.stats[key + ('count',)] += sign
+        attack, defense, stamina = _int(values['attack']), _int(values['defense']), _int(values['stamina'])
+        iv = attack + defense + stamina if None not in (attack, defense, stamina) else None
+        for metric, value in (('cp', _int(values['cp'])), ('hp', _int(values['hp'])), ('iv', iv)):
+            if value is None:
+                continue
+            if metric != 'iv':
+                self.stats[key + (metric + '_count',)] += sign
+                self.stats[key + (metric + '_sum',)] += sign * value
+                self.stats[key + (metric + '_sum_squares',)] += sign * value * value
+            self.histograms[key + (metric, value // HISTOGRAM_WIDTHS[metric])] += sign
+
+    def apply(self, session):
+        stats = {}
+        for (pokemon_id, team_id, column), delta in self.stats.items():
+            row = stats.setdefault((pokemon_id, team_id), dict({column: 0 for column in STAT_COLUMNS},
+                                                               pokemon_id=pokemon_id, team_id=team_id))
+            row[column] = delta
+        increment_counters(session, pokedex.SpeciesStats.__table__,
+                           [row for _, row in sorted(stats.items()) if any(row[column] for column in STAT_COLUMNS)],
+                           ['pokemon_id', 'team_id'], STAT_COLUMNS)
+        increment_counters(session, pokedex.SpeciesHistogram.__table__, [
+            {'pokemon_id': pokemon_id, 'team_id': team_id, 'metric': metric, 'bucket': bucket, 'count': delta}
+            for (pokemon_id, team_id, metric, bucket), delta in sorted(self.histograms.items()) if delta
+        ], ['pokemon_id', 'team_id', 'metric', 'bucket'], ['count'])
+
+
+def _teams(session, user_ids):
+    user_ids = {int(user_id) for user_id in user_ids if user_id is not None}
+    if not user_ids:
+        return {}
+    return dict(session.query(pokedex.User.id, pokedex.User.team_id).filter(pokedex.User.id.in_(user_ids)))
+
+
+# adds rows inserted into user_pokemon without the orm, e.g. by the batch upload, in the caller's transaction
+def record_user_pokemon(session, rows):
+    teams = _teams(session, [row['user_id'] for row in rows])
+    rollup = Rollup()
+    for row in rows:
+        rollup.add({column: row.get(column) for column in TRACKED}, teams.get(int(row['user_id'])), 1)
+    rollup.apply(session)
+
+
+def _changed(user_pokemon):
+    state = inspect(user_pokemon)
+    return any(state.attrs[column].history.has_changes() for column in TRACKED)
+
+
+# the team each user changing teams in this flush moves to; set through User.team, the foreign key is only copied
+# over during the flush
+def _team_changes(session):
+    teams = {}
+    for user in session.dirty:
+        if not isinstance(user, pokedex.User) or user.id is None:
+            continue
+        state = inspect(user)
+        if state.attrs.team.history.has_changes():
+            teams[user.id] = user.team.id if user.team is not None else None
+        elif state.attrs.team_id.history.has_changes():
+            teams[user.id] = _int(user.team_id)
+    return teams
+
+
+# orm inserts, updates and deletes of UserPokemon adjust the rollups before they are flushed, so both land in the
+# same transaction; old values are read back from the database as the rows there are not updated yet. A user
+# changing teams takes the contributions of their whole collection along
+def track_user_pokemon(session, flush_context, instances):
+    user_pokemon = pokedex.UserPokemon
+    new = [obj for obj in session.new if isinstance(obj, user_pokemon)]
+    changed = [obj for obj in session.dirty if isinstance(obj, user_pokemon) and _changed(obj)]
+    deleted = [obj for obj in session.deleted if isinstance(obj, user_pokemon)]
+    team_changes = _team_changes(session)
+    if not (new or changed or deleted or team_changes):
+        return
+
+    rollup = Rollup()
+    columns = [getattr(user_pokemon, column) for column in TRACKED]
+    with session.no_autoflush:
+        ids = [obj.id for obj in changed + deleted if obj.id is not None]
+        if ids:
+            for row in session.query(*columns + [pokedex.User.team_id]) \
+                    .outerjoin(pokedex.User, pokedex.User.id == user_pokemon.user_id) \
+                    .filter(user_pokemon.id.in_(ids)):
+                rollup.add(dict(zip(TRACKED, row)), row.team_id, -1)
+
+        previous = _teams(session, team_changes)
+        moved = {user_id: team_id for user_id, team_id in team_changes.items() if previous.get(user_id) != team_id}
+        if moved:
+            # rows changed or deleted in this flush were taken out above and are added back below
+            query = session.query(*columns).filter(user_pokemon.user_id.in_(list(moved)))
+            if ids:
+                query = query.filter(~user_pokemon.id.in_(ids))
+            for row in query:
+                values = dict(zip(TRACKED, row))
+                rollup.add(values, previous.get(values['user_id']), -1)
+                rollup.add(values, moved[values['user_id']], 1)
+
+        current = [{column: getattr(obj, column) for column in TRACKED} for obj in new + changed]
+        teams = _teams(session, [values['user_id'] for values in current])
+        teams.update(moved)
+        for values in current:
+            rollup.add(values, teams.get(_int(values['user_id'])), 1)
+        rollup.apply(session)
+
+
+# the listener is global, so an app created after the first one must not add it again
+def setup_rollups(db):
+    if not event.contains(SignallingSession, 'before_flush', track_user_pokemon):
+        event.listen(SignallingSession, 'before_flush', track_user_pokemon)
+
+
+# recomputes the rollups from user_pokemon with one grouped query per table
+def rebuild_rollups(session):
+    user_pokemon = pokedex.UserPokemon
+    team_id = func.coalesce(pokedex.User.team_id, NO_TEAM)
+    grouped = session.query(
+        user_pokemon.pokemon_id, team_id, func.count(), func.count(user_pokemon.cp), func.sum(user_pokemon.cp),
+        func.sum(user_pokemon.cp * user_pokemon.cp), func.count(user_pokemon.hp), func.sum(user_pokemon.hp),
+        func.sum(user_pokemon.hp * user_pokemon.hp)) \
+        .outerjoin(pokedex.User, pokedex.User.id == user_pokemon.user_id) \
+        .group_by(user_pokemon.pokemon_id, team_id)
+    stats = [dict(zip(['pokemon_id', 'team_id'] + STAT_COLUMNS, [value or 0 for value in row])) for row in grouped]
+
+    histograms = []
+    iv = user_pokemon.attack + user_pokemon.defense + user_pokemon.stamina
+    for metric, value in (('cp', user_pokemon.cp), ('hp', user_pokemon.hp), ('iv', iv)):
+        # integer division on integer columns, in sqlite as in postgresql
+        bucket = value / HISTOGRAM_WIDTHS[metric]
+        grouped = session.query(user_pokemon.pokemon_id, team_id, bucket, func.count()) \
+            .outerjoin(pokedex.User, pokedex.User.id == user_pokemon.user_id) \
+            .filter(value.isnot(None)).group_by(user_pokemon.pokemon_id, team_id, bucket)
+        histograms.extend({'pokemon_id': pokemon_id, 'team_id': team, 'metric': metric, 'bucket': int(bucket),
+                           'count': count} for pokemon_id, team, bucket, count in grouped)
+
+    session.query(pokedex.SpeciesStats).delete()
+    session.query(pokedex.SpeciesHistogram).delete()
+    if stats:
+        session.execute(pokedex.SpeciesStats.__table__.insert(), stats)
+    if histograms:
+        session.execute(pokedex.SpeciesHistogram.__table__.insert(), histograms)
+    session.commit()
+    return len(stats), len(histograms)
+
+
+# count, mean and standard deviation of cp and hp over the given species_stats rows, e.g. all teams of a species
+def species_summary(rows):
+    totals = {column: sum(getattr(row, column) for row in rows) for column in STAT_COLUMNS}
+    summary = {'count': totals['count']}
+    for metric in ('cp', 'hp'):
+        count = totals[metric + '_count']
+        if count:
+            mean = totals[metric + '_sum'] / count
+            variance = totals[metric + '_sum_squares'] / count - mean * mean
+            summary[metric + '_mean'] = round(mean, 2)
+            summary[metric + '_stddev'] = round(math.sqrt(max(variance, 0)), 2)
+        else:
+            summary[metric + '_mean'] = summary[metric + '_stddev'] = None
+    return summary
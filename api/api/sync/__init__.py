@@ -0,0 +1,2 @@
+from .changes import changes, prune_tombstones, record_tombstones, setup_sync, sync, Changes, InvalidSyncToken, \
+    Sync, SyncTokens
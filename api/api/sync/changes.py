@@ -0,0 +1,123 @@
+from api.database.models import pokedex
+
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+import calendar
+
+from flask_sqlalchemy import SignallingSession
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import event, func
+
+SYNC_SALT = 'sync-token'
+# rows deleted from these models leave a tombstone behind, keyed by the user owning them
+TRACKED = (pokedex.UserPokemon, pokedex.UserLog)
+
+
+class InvalidSyncToken(Exception):
+    pass
+
+
+# a sync token is the database time a sync was answered at, signed with SECRET_KEY and bound to the user; clients
+# only hand it back
+class SyncTokens:
+    def __init__(self, secret_key):
+        self._serializer = URLSafeSerializer(secret_key, salt=SYNC_SALT)
+
+    def issue(self, user_id, at):
+        return self._serializer.dumps({'uid': user_id, 'at': _microseconds(at)})
+
+    def verify(self, user_id, token):
+        try:
+            claims = self._serializer.loads(token)
+        except BadSignature:
+            raise InvalidSyncToken('Invalid sync token.')
+        if not isinstance(claims, dict) or claims.get('uid') != user_id or not isinstance(claims.get('at'), int):
+            raise InvalidSyncToken('Invalid sync token.')
+        return datetime(1970, 1, 1, tzinfo=timezone.utc) + timedelta(microseconds=claims['at'])
+
+
+def _utc(value):
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def _microseconds(value):
+    value = _utc(value)
+    return calendar.timegm(value.timetuple()) * 1000000 + value.microsecond
+
+
+# what changed in a user's data since a time: None for the user when it did not change, rows inserted or updated,
+# and the ids of deleted rows; reset when the time is older than the tombstones kept, so everything is sent
+Changes = namedtuple('Changes', ['at', 'reset', 'user', 'user_pokemon', 'user_logs', 'deleted_user_pokemon',
+                                 'deleted_user_logs'])
+
+
+class Sync:
+    def __init__(self):
+        self.tokens = None
+        self.overlap = None
+        self.tombstone_ttl = None
+
+    def init_app(self, app, db):
+        # rows are matched from this many seconds before the token, so rows written by a transaction that started
+        # before the previous sync but committed after it, or stamped within the same second by a database clock
+        # like sqlite's, are still sent; clients apply rows idempotently
+        app.config.setdefault('SYNC_OVERLAP', 5)
+        app.config.setdefault('SYNC_TOMBSTONE_TTL', 30 * 24 * 60 * 60)
+        self.tokens = SyncTokens(app.config['SECRET_KEY'])
+        self.overlap = timedelta(seconds=app.config['SYNC_OVERLAP'])
+        self.tombstone_ttl = timedelta(seconds=app.config['SYNC_TOMBSTONE_TTL'])
+
+
+sync = Sync()
+
+
+def changes(session, user_id, since=None, user_pokemon_options=()):
+    at = _utc(session.query(func.now()).scalar())
+    reset = since is not None and since < at - sync.tombstone_ttl
+    if since is None or reset:
+        start = None
+    else:
+        start = since - sync.overlap
+
+    user = session.query(pokedex.User).filter(pokedex.User.id == user_id)
+    user_pokemon = session.query(pokedex.UserPokemon).filter(pokedex.UserPokemon.user_id == user_id) \
+        .options(*user_pokemon_options)
+    user_logs = session.query(pokedex.UserLog).filter(pokedex.UserLog.user_id == user_id)
+    deleted = {}
+    if start is not None:
+        user = user.filter(pokedex.User.last_modified >= start)
+        user_pokemon = user_pokemon.filter(pokedex.UserPokemon.last_modified >= start)
+        user_logs = user_logs.filter(pokedex.UserLog.last_modified >= start)
+        for table_name, row_id in session.query(pokedex.Tombstone.table_name, pokedex.Tombstone.row_id) \
+                .filter(pokedex.Tombstone.user_id == user_id, pokedex.Tombstone.deleted >= start):
+            deleted.setdefault(table_name, []).append(row_id)
+
+    return Changes(at, reset, user.first(), user_pokemon.order_by(pokedex.UserPokemon.id).all(),
+                   user_logs.order_by(pokedex.UserLog.id).all(),
+                   sorted(deleted.get(pokedex.UserPokemon.__tablename__, [])),
+                   sorted(deleted.get(pokedex.UserLog.__tablename__, [])))
+
+
+def record_tombstones(session, flush_context, instances):
+    for obj in session.deleted:
+        if isinstance(obj, TRACKED) and obj.id is not None:
+            session.add(pokedex.Tombstone(user_id=obj.user_id, table_name=obj.__tablename__, row_id=obj.id))
+
+
+# tombstones older than SYNC_TOMBSTONE_TTL, clients that last synced before that get everything again
+def prune_tombstones(session):
+    expired = _utc(session.query(func.now()).scalar()) - sync.tombstone_ttl
+    pruned = session.query(pokedex.Tombstone).filter(pokedex.Tombstone.deleted < expired) \
+        .delete(synchronize_session=False)
+    session.commit()
+    return pruned
+
+
+# the listener is global, so an app created after the first one must not add it again
+def setup_sync(app, db):
+    sync.init_app(app, db)
+    if not event.contains(SignallingSession, 'before_flush', record_tombstones):
+        event.listen(SignallingSession, 'before_flush', record_tombstones)
+    return sync
@@ -1,34 +1,63 @@
-from api.database import setup_database
+from api.auth import auth, owner_required, refuse_unless_admin, refuse_unless_authenticated, refuse_unless_owner, \
+    setup_auth, unauthorized, HasherBusy, InvalidToken, Principal
+from api.benchmark import compare_results, explain_routes, run_benchmark, seed_population, ROUTES
+from api.catalog import catalog, setup_catalog, versioned_response
+from api.catalog.battle import battle_pool, BATTLES, MAX_BATTLES, MAX_REQUEST_BATTLES
+from api.catalog.iv import appraisal_mask
+from api.catalog.search import KINDS, MAX_SEARCH_LIMIT, SEARCH_LIMIT
+from api.data_import.data_import import import_all_data
+from api.database import create_schema, db, insert_ignoring_conflicts, keyset_batches, keyset_page, plan_schema, \
+    read_only, setup_database, setup_statement_counter, statement_budget
 from api.database.models import pokedex
-# from api.data_import.data_import import import_all_data
+from api.export import export, export_query, FORMATS
+from api.jobs import jobs, setup_jobs, DONE, FAILED
+from api.metrics import registry, setup_metrics
+from api.serialize import compile_all, compile_schema, dumps, json_response
+from api.server import serve, stopping
+from api.spawns import locate, rebuild_spawn_cells, record_spawns, tile_range, MAX_ZOOM
+from api.stats import rebuild_rollups, record_user_pokemon, setup_rollups, species_summary, HISTOGRAM_WIDTHS
+from api.sync import changes, prune_tombstones, setup_sync, sync, InvalidSyncToken
 
-from flask import Flask, request, session, abort, jsonify
+from collections import OrderedDict
+import json
+from time import perf_counter, process_time
+
+import click
+from flask import Blueprint, Flask, current_app, request, session, abort, jsonify, stream_with_context
+from flask.cli import AppGroup
 from flask_marshmallow import Marshmallow
-from sqlalchemy.orm import exc
-from werkzeug.security import generate_password_hash, check_password_hash
+from marshmallow import validate, validates, ValidationError
+from marshmallow_sqlalchemy import TableSchema
+from sqlalchemy import func
+from sqlalchemy.orm import exc, subqueryload, Load
 
-from decimal import Decimal
+# routes and commands are registered on the app by create_app
+views = Blueprint('views', __name__)
+commands = AppGroup('commands')
+ma = Marshmallow()
 
-app = Flask(__name__)
-app.config.from_object(__name__)
-app.config.update({
-    'DEBUG': True,
-    'SECRET_KEY': 'development key',
-})
-app.config.from_envvar('API_SERVER_CONFIG', silent=True)
-db = setup_database(app)
-# import_all_data(db)
-ma = Marshmallow(app)
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+NDJSON_MIMETYPE = 'application/x-ndjson'
+# keeps the guid lookup of a batch under the bound variable limit of older sqlite builds
+MAX_BATCH_SIZE = 500
+# tiles one spawn map request may cover, so its cost does not depend on how many catches are stored
+MAX_SPAWN_TILES = 4096
 
 
+# ma.init_app only hands its session to schemas defined after it runs, and create_app runs it after these, so every
+# model schema names the session that loads related objects, e.g. the team of {"team": 2}
 class CategorySchema(ma.ModelSchema):
     class Meta:
         model = pokedex.Category
+        sqla_session = db.session
 
 
 class TypeSchema(ma.ModelSchema):
     class Meta:
         model = pokedex.Type
+        sqla_session = db.session
 
 
 class PokemonSchema(ma.ModelSchema):
@@ -39,11 +68,13 @@ class PokemonSchema(ma.ModelSchema):
 
     class Meta:
         model = pokedex.Pokemon
+        sqla_session = db.session
 
 
 class AttackSchema(ma.ModelSchema):
     class Meta:
         model = pokedex.Attack
+        sqla_session = db.session
 
 
 class UserSchema(ma.ModelSchema):
@@ -53,168 +84,1117 @@ class UserSchema(ma.ModelSchema):
 
     class Meta:
         model = pokedex.User
+        sqla_session = db.session
 
 
 class UserPokemonSchema(ma.ModelSchema):
+    guid = ma.UUID()
     user = ma.Nested('UserSchema')
     pokemon = ma.Nested('PokemonSchema')
 
     class Meta:
         model = pokedex.UserPokemon
+        sqla_session = db.session
+
+
+# the form of a single upload names the species by id, checked against the catalog like a batch upload
+class UserPokemonFormSchema(UserPokemonSchema):
+    pokemon_id = ma.Integer(required=True)
+
+    @validates('pokemon_id')
+    def validate_pokemon_id(self, value):
+        if value not in catalog.snapshot.pokemon:
+            raise ValidationError('Unknown pokemon.')
+
+
+# rows of a delta sync refer to the species by id, clients already have the catalog
+class UserPokemonChangeSchema(ma.ModelSchema):
+    guid = ma.UUID()
+
+    class Meta:
+        model = pokedex.UserPokemon
+        sqla_session = db.session
+        exclude = ('user',)
+
+
+class UserLogSchema(ma.ModelSchema):
+    class Meta:
+        model = pokedex.UserLog
+        sqla_session = db.session
+
+
+class UserPokemonQuerySchema(ma.Schema):
+    after = ma.Integer()
+    limit = ma.Integer(missing=PAGE_SIZE, validate=validate.Range(1, MAX_PAGE_SIZE))
+    pokemon_id = ma.Integer()
+    cp_min = ma.Integer()
+    cp_max = ma.Integer()
+    caught_from = ma.Date()
+    caught_to = ma.Date()
+    format = ma.String(missing='json', validate=validate.OneOf(['json', 'ndjson']))
+
+
+class SearchQuerySchema(ma.Schema):
+    q = ma.String(required=True)
+    kind = ma.String(validate=validate.OneOf(KINDS))
+    limit = ma.Integer(missing=SEARCH_LIMIT, validate=validate.Range(1, MAX_SEARCH_LIMIT))
+
+
+class CountersQuerySchema(ma.Schema):
+    limit = ma.Integer(missing=10, validate=validate.Range(1))
+
+
+class BattlesQuerySchema(ma.Schema):
+    battles = ma.Integer(missing=BATTLES, validate=validate.Range(1, MAX_REQUEST_BATTLES))
+
+
+class StatsQuerySchema(ma.Schema):
+    team_id = ma.Integer()
+    limit = ma.Integer(missing=10, validate=validate.Range(1))
+
+
+class UserPokemonExportSchema(ma.Schema):
+    pokemon_id = ma.Integer()
+    cp_min = ma.Integer()
+    cp_max = ma.Integer()
+    caught_from = ma.Date()
+    caught_to = ma.Date()
+    format = ma.String(missing='csv', validate=validate.OneOf(sorted(FORMATS)))
+
+
+# rows for the batch upload, validated as plain dicts so they can be inserted in a single statement
+class UserPokemonBatchSchema(TableSchema):
+    guid = ma.UUID(required=True)
+
+    class Meta:
+        table = pokedex.UserPokemon.__table__
+        include_fk = True
+        exclude = ('id', 'user_id', 'created', 'last_modified')
 
+    @validates('pokemon_id')
+    def validate_pokemon_id(self, value):
+        if value not in catalog.snapshot.pokemon:
+            raise ValidationError('Unknown pokemon.')
 
-# TODO - implement non session based authentication
-@app.route('/api/login', methods=['POST'])
+    @validates('fast_attack_id')
+    def validate_fast_attack_id(self, value):
+        if value is not None and value not in catalog.snapshot.attacks:
+            raise ValidationError('Unknown attack.')
+
+    @validates('charge_attack_id')
+    def validate_charge_attack_id(self, value):
+        if value is not None and value not in catalog.snapshot.attacks:
+            raise ValidationError('Unknown attack.')
+
+
+class SpawnQuerySchema(ma.Schema):
+    bbox = ma.String(required=True)
+    zoom = ma.Integer(required=True, validate=validate.Range(0, MAX_ZOOM))
+
+    @validates('bbox')
+    def validate_bbox(self, value):
+        if parse_bbox(value) is None:
+            raise ValidationError('Expected west,south,east,north in degrees.')
+
+
+class JobSchema(ma.ModelSchema):
+    class Meta:
+        model = pokedex.Job
+        sqla_session = db.session
+        exclude = ('key', 'result')
+
+
+# parameters of the jobs working on one user's collection
+class UserJobSchema(ma.Schema):
+    user_id = ma.Integer(required=True)
+
+
+class BattleCountersJobSchema(ma.Schema):
+    name = ma.String(required=True)
+    battles = ma.Integer(missing=BATTLES, validate=validate.Range(1, MAX_BATTLES))
+    limit = ma.Integer(missing=20, validate=validate.Range(1))
+
+
+# west, south, east, north
+def parse_bbox(text):
+    try:
+        west, south, east, north = (float(value) for value in text.split(','))
+    except ValueError:
+        return None
+    if not (-180 <= west <= east <= 180 and -90 <= south <= north <= 90):
+        return None
+    return west, south, east, north
+
+
+pokemon_serializer = compile_schema(PokemonSchema)
+attack_serializer = compile_schema(AttackSchema)
+moveset_attack_serializer = compile_schema(AttackSchema, exclude=('pokemon',))
+user_serializer = compile_schema(UserSchema)
+new_user_serializer = compile_schema(UserSchema, only=('username', 'password', 'email'))
+user_pokemon_serializer = compile_schema(UserPokemonSchema)
+# the owner is already known from the url, so listings leave out the nested user and with it the whole collection
+user_pokemon_item_serializer = compile_schema(UserPokemonSchema, exclude=('user',))
+job_serializer = compile_schema(JobSchema)
+user_change_serializer = compile_schema(UserSchema, exclude=('pokemon',))
+user_pokemon_change_serializer = compile_schema(UserPokemonChangeSchema)
+user_log_serializer = compile_schema(UserLogSchema)
+
+
+# eager loading plans matching the nested fields of the schemas above, so that a dump never lazy loads;
+# many-to-one ids are read from the foreign key columns by the compiled serializers and need no loading
+def pokemon_loading_plan(path):
+    return [path.joinedload(pokedex.Pokemon.category)] + [path.subqueryload(relationship) for relationship in (
+        pokedex.Pokemon.attacks, pokedex.Pokemon.fast_attacks, pokedex.Pokemon.charge_attacks, pokedex.Pokemon.egg,
+        pokedex.Pokemon.evolves_to, pokedex.Pokemon.evolves_from, pokedex.Pokemon.types)]
+
+
+def user_pokemon_loading_plan(path):
+    return ([path.subqueryload(pokedex.UserPokemon.appraisal_iv)] +
+            pokemon_loading_plan(path.joinedload(pokedex.UserPokemon.pokemon)))
+
+
+def user_loading_plan(path):
+    return user_pokemon_loading_plan(path.subqueryload(pokedex.User.pokemon))
+
+
+def hasher_busy():
+    response = jsonify(errors={'password': ['Too many password checks in progress, try again.']})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+
+# answers with a signed bearer token; the session is still set for clients of the cookie login
+@views.route('/api/login', methods=['POST'])
+@statement_budget(1)
 def route_login():
-    if request.method == 'POST':
-        try:
-            user = pokedex.User.query.filter_by(username=request.form['username']).one()
-        except exc.NoResultFound:
-            pass  # user not found
-        else:
-            if check_password_hash(user.password, request.form['password']):
-                session['logged_in'] = True
-                session['user_id'] = user.id
-                session['username'] = user.username
-                return jsonify({'message': 'Logged in'})
-    return jsonify({'message': 'Invalid credentials'}), 422
-
-
-@app.route('/api/logout')
+    user = pokedex.User.query.filter_by(username=request.form['username']).first()
+    try:
+        valid = user is not None and auth.hasher.check(user.password, request.form['password'])
+    except HasherBusy:
+        return hasher_busy()
+    if not valid:
+        return jsonify({'message': 'Invalid credentials'}), 422
+    session['logged_in'] = True
+    session['user_id'] = user.id
+    session['username'] = user.username
+    auth.principals.put(Principal(user.id, user.username, user.team_id))
+    return jsonify({
+        'message': 'Logged in',
+        'user_id': user.id,
+        'token': auth.signer.issue(user.id),
+        'expires_in': auth.signer.max_age,
+    })
+
+
+@views.route('/api/logout')
 def route_logout():
-    if session.get('logged_in'):
+    try:
+        claims = auth.request_claims()
+    except InvalidToken:
+        claims = None
+    if claims is not None:
+        auth.revoked.revoke(claims['jti'], claims['exp'])
+    if claims is not None or session.get('logged_in'):
         session.clear()
         return jsonify({'message': 'Logged out'})
     else:
         return jsonify({'message': 'Already logged out'})
 
 
-@app.route('/api/users', methods=['POST'])
+@views.route('/api/me')
+@statement_budget(1)
+def route_me():
+    try:
+        user_id = auth.user_id()
+    except InvalidToken as e:
+        return unauthorized(str(e))
+    principal = auth.principals.get(user_id) if user_id is not None else None
+    if principal is None:
+        return unauthorized('Authentication required.')
+    return jsonify(user=dict(principal._asdict()))
+
+
+@views.route('/api/users', methods=['POST'])
+@statement_budget(2)
 def route_user():
     schema = UserSchema(only=('username', 'password', 'email'))
     user, errors = schema.load(request.form)
     if errors:
         return jsonify(errors=errors), 422
-    user.password = generate_password_hash(user.password)
+    try:
+        user.password = auth.hasher.generate(user.password)
+    except HasherBusy:
+        return hasher_busy()
     try:
         db.session.add(user)
         db.session.commit()
-        return jsonify({'message': 'Created new user.', 'user': schema.dump(user).data})
+        return json_response({'message': 'Created new user.', 'user': new_user_serializer(user)})
     except:
         db.session.rollback()
         raise
 
 
-# TODO - require authentication for most routes below
-@app.route('/api/users/<user_id>', methods=['GET', 'PUT'])
+# a team change moves the rollups of the whole collection, a fixed number of statements more
+@views.route('/api/users/<user_id>', methods=['GET', 'PUT'])
+@read_only
+@statement_budget(10, PUT=20)
+@owner_required
 def route_get_user(user_id):
     schema = UserSchema()
+    query = pokedex.User.query
+    if request.method == 'GET':
+        query = query.options(*user_loading_plan(Load(pokedex.User)))
     try:
-        user = pokedex.User.query.filter_by(id=user_id).one()
+        user = query.filter_by(id=user_id).one()
     except (exc.NoResultFound, exc.MultipleResultsFound):
         abort(404)
 
     if request.method == 'GET':
-        return jsonify({'user': schema.dump(user).data})
+        return json_response({'user': user_serializer(user)})
 
     if request.method == 'PUT':
         user_update, errors = schema.load(request.form, instance=user, partial=True)
         if errors:
             return jsonify(errors=errors), 422
+        if 'password' in request.form:
+            try:
+                user_update.password = auth.hasher.generate(request.form['password'])
+            except HasherBusy:
+                db.session.rollback()
+                return hasher_busy()
+        auth.principals.invalidate(user.id)
         try:
             db.session.add(user_update)
             db.session.commit()
-            return jsonify({'message': 'Updated user.', 'user': schema.dump(user_update).data})
+            user_update = pokedex.User.query.options(*user_loading_plan(Load(pokedex.User))) \
+                .filter_by(id=user_id).one()
+            return json_response({'message': 'Updated user.', 'user': user_serializer(user_update)})
         except:
             db.session.rollback()
             raise
 
 
-@app.route('/api/users/<int:user_id>/pokemon', methods=['GET', 'POST'])
+def filter_user_pokemon(query, args):
+    if 'pokemon_id' in args:
+        query = query.filter(pokedex.UserPokemon.pokemon_id == args['pokemon_id'])
+    if 'cp_min' in args:
+        query = query.filter(pokedex.UserPokemon.cp >= args['cp_min'])
+    if 'cp_max' in args:
+        query = query.filter(pokedex.UserPokemon.cp <= args['cp_max'])
+    if 'caught_from' in args:
+        query = query.filter(pokedex.UserPokemon.caught_date >= args['caught_from'])
+    if 'caught_to' in args:
+        query = query.filter(pokedex.UserPokemon.caught_date <= args['caught_to'])
+    return query
+
+
+# one json document per line, fetched in keyset batches so memory stays flat however large the collection is
+def stream_user_pokemon(query, after):
+    def generate():
+        for user_pokemon in keyset_batches(query, pokedex.UserPokemon.id, STREAM_BATCH_SIZE, after):
+            for item in user_pokemon:
+                yield dumps(user_pokemon_item_serializer(item), pretty=False) + '\n'
+    return current_app.response_class(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
+def export_response(query, export_format, filename):
+    response = current_app.response_class(stream_with_context(export(db.session, query, export_format)),
+                                  mimetype=FORMATS[export_format].mimetype)
+    response.headers['Content-Disposition'] = 'attachment; filename={0}.{1}'.format(
+        filename, FORMATS[export_format].extension)
+    return response
+
+
+# the whole collection with species stats as a file, streamed from a server side cursor
+@views.route('/api/users/<int:user_id>/pokemon/export')
+@read_only
+@statement_budget(2)
+@owner_required
+def route_user_pokemon_export(user_id):
+    args, errors = UserPokemonExportSchema().load(request.args)
+    if errors:
+        return jsonify(errors=errors), 422
+    if pokedex.User.query.filter_by(id=user_id).count() == 0:
+        abort(404)
+    query = filter_user_pokemon(export_query(db.session).filter(pokedex.UserPokemon.user_id == user_id), args)
+    return export_response(query, args['format'], 'user-{0}-pokemon'.format(user_id))
+
+
+@views.route('/api/users/<int:user_id>/pokemon', methods=['GET', 'POST'])
+@read_only
+@statement_budget(10, POST=29)
+@owner_required
 def route_user_pokemon(user_id):
     try:
-        user = pokedex.User.query.filter_by(id=user_id).one()
+        pokedex.User.query.filter_by(id=user_id).one()
     except (exc.NoResultFound, exc.MultipleResultsFound):
         abort(404)
 
     if request.method == 'GET':
-        schema = UserPokemonSchema(many=True)
-        return jsonify({'userPokemon': schema.dump(user.pokemon).data})
+        args, errors = UserPokemonQuerySchema().load(request.args)
+        if errors:
+            return jsonify(errors=errors), 422
+        query = filter_user_pokemon(pokedex.UserPokemon.query.filter_by(user_id=user_id), args) \
+            .options(*user_pokemon_loading_plan(Load(pokedex.UserPokemon)))
+        if args['format'] == 'ndjson' or request.accept_mimetypes.best == NDJSON_MIMETYPE:
+            return stream_user_pokemon(query, args.get('after'))
+        user_pokemon, next_id = keyset_page(query, pokedex.UserPokemon.id, args['limit'], args.get('after'))
+        return json_response({'userPokemon': user_pokemon_item_serializer(user_pokemon, many=True), 'next': next_id})
 
     if request.method == 'POST':
-        schema = UserPokemonSchema()
-        user_pokemon, errors = schema.load(request.form)
-        user_pokemon.user_id = user_id
-        user_pokemon.pokemon_id = request.form['pokemon_id']
+        user_pokemon, errors = UserPokemonFormSchema().load(request.form)
         if errors:
             return jsonify(errors=errors), 422
+        user_pokemon.user_id = user_id
+        if user_pokemon.guid is not None:
+            # a retried upload returns the row stored by the first attempt
+            replayed = pokedex.UserPokemon.query.filter_by(user_id=user_id, guid=user_pokemon.guid).first()
+            if replayed is not None:
+                user_pokemon = replayed
         try:
+            if user_pokemon.id is None and locate(user_pokemon) is not None:
+                record_spawns(db.session, [(user_pokemon.pokemon_id, user_pokemon.caught_latitude,
+                                            user_pokemon.caught_longitude)])
             db.session.add(user_pokemon)
             db.session.commit()
-            return jsonify({'userPokemon': schema.dump(user_pokemon).data})
+            path = Load(pokedex.UserPokemon)
+            plan = user_pokemon_loading_plan(path) + user_loading_plan(path.joinedload(pokedex.UserPokemon.user))
+            user_pokemon = pokedex.UserPokemon.query.options(*plan).filter_by(id=user_pokemon.id).one()
+            return json_response({'userPokemon': user_pokemon_serializer(user_pokemon)})
         except:
             db.session.rollback()
             raise
 
 
-@app.route('/api/users/<int:user_id>/pokemon/<int:pokemon_id>', methods=['GET', 'PUT'])
-def route_get_user_pokemon(user_id, pokemon_id):
-    pass
+# uploads many catches in one request; every item carries a client generated guid, so replaying a batch after a
+# failed sync stores nothing twice
+@views.route('/api/users/<int:user_id>/pokemon/batch', methods=['POST'])
+@statement_budget(21)
+@owner_required
+def route_user_pokemon_batch(user_id):
+    try:
+        pokedex.User.query.filter_by(id=user_id).one()
+    except (exc.NoResultFound, exc.MultipleResultsFound):
+        abort(404)
 
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        return jsonify(errors={'_schema': ['Expected a JSON array of pokemon.']}), 422
+    if len(items) > MAX_BATCH_SIZE:
+        return jsonify(errors={'_schema': ['At most {0} pokemon per batch.'.format(MAX_BATCH_SIZE)]}), 422
+    rows, errors = UserPokemonBatchSchema(many=True).load(items)
+    if errors:
+        return jsonify(errors=errors), 422
 
-@app.route('/api/pokemon/<string:name>')
-def route_pokemon_name(name):
-    pokemon_schema = PokemonSchema()
+    batch = OrderedDict()
+    for row in rows:
+        row['user_id'] = user_id
+        batch.setdefault(row['guid'], row)
+    table = pokedex.UserPokemon.__table__
+    existing = {guid for guid, in db.session.query(pokedex.UserPokemon.guid).filter(
+        pokedex.UserPokemon.user_id == user_id, pokedex.UserPokemon.guid.in_(list(batch)))}
+    submitted = [row for guid, row in batch.items() if guid not in existing]
+    for row in submitted:
+        locate(row)
+    try:
+        # a concurrent upload of the same guids may store some of them first, only the rows stored here count
+        inserted = {guid for _, guid in insert_ignoring_conflicts(db.session, table, submitted, ['user_id', 'guid'])}
+        created = [row for row in submitted if row['guid'] in inserted]
+        record_spawns(db.session, [(row['pokemon_id'], row['caught_latitude'], row['caught_longitude'])
+                                   for row in created if row['caught_latitude'] is not None])
+        record_user_pokemon(db.session, created)
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+
+    user_pokemon = pokedex.UserPokemon.query.options(*user_pokemon_loading_plan(Load(pokedex.UserPokemon))) \
+        .filter(pokedex.UserPokemon.user_id == user_id, pokedex.UserPokemon.guid.in_(list(batch))) \
+        .order_by(pokedex.UserPokemon.id).all()
+    return json_response({
+        'created': [str(row['guid']) for row in created],
+        'duplicates': [str(guid) for guid in batch if guid not in inserted],
+        'userPokemon': user_pokemon_item_serializer(user_pokemon, many=True),
+    })
+
+
+# iv candidates of a user's pokemon from their cp, hp, power up cost and appraisal, read as plain columns so a
+# whole collection is a couple of queries and a single pass of the calculator
+def calculate_ivs(user_id, *criteria):
+    user_pokemon = pokedex.UserPokemon
+    rows = db.session.query(user_pokemon.id, user_pokemon.pokemon_id, user_pokemon.cp, user_pokemon.hp,
+                            user_pokemon.power_up_stardust, user_pokemon.appraisal_overall_id,
+                            user_pokemon.appraisal_stats_id) \
+        .filter(user_pokemon.user_id == user_id, *criteria).order_by(user_pokemon.id).all()
+    appraisals = {}
+    for user_pokemon_id, appraisal_iv_id in db.session.query(pokedex.UserPokemonAppraisalIv.user_pokemon_id,
+                                                             pokedex.UserPokemonAppraisalIv.appraisal_iv_id) \
+            .join(user_pokemon, user_pokemon.id == pokedex.UserPokemonAppraisalIv.user_pokemon_id) \
+            .filter(user_pokemon.user_id == user_id, *criteria):
+        appraisals.setdefault(user_pokemon_id, []).append(appraisal_iv_id)
+    ivs = catalog.snapshot.ivs.calculate(
+        [row.pokemon_id for row in rows], [row.cp for row in rows], [row.hp for row in rows],
+        stardust=[row.power_up_stardust for row in rows],
+        overall=[row.appraisal_overall_id for row in rows],
+        stats=[row.appraisal_stats_id for row in rows],
+        best=[appraisal_mask(appraisals.get(row.id, ())) for row in rows])
+    return rows, ivs
+
+
+def collection_ivs(user_id):
+    rows, ivs = calculate_ivs(user_id)
+    return [iv_summary(row, ivs, i) for i, row in enumerate(rows)]
+
+
+def iv_summary(row, ivs, i):
+    summary = ivs.summary(i) or (0, None, None, None, None, None)
+    count, perfection_min, perfection_max, perfection_average, level_min, level_max = summary
+    return {
+        'user_pokemon_id': row.id,
+        'pokemon_id': row.pokemon_id,
+        'candidates': count,
+        'perfection_min': perfection_min and round(perfection_min, 1),
+        'perfection_max': perfection_max and round(perfection_max, 1),
+        'perfection_average': perfection_average and round(perfection_average, 1),
+        'level_min': level_min,
+        'level_max': level_max,
+    }
+
+
+@views.route('/api/users/<int:user_id>/pokemon/iv')
+@read_only
+@statement_budget(3)
+@owner_required
+def route_user_pokemon_ivs(user_id):
     try:
-        pokemon = pokedex.Pokemon.query.filter_by(name=name).one()
+        pokedex.User.query.filter_by(id=user_id).one()
     except (exc.NoResultFound, exc.MultipleResultsFound):
         abort(404)
-    return pokemon_schema.jsonify(pokemon)
+    return json_response({'ivs': collection_ivs(user_id)})
 
 
-def moveset_key(p1, p2=None):
-    def wrapped_fn(a1):
-        stab = bool(a1.type in p1.types) and 1.25 or 1.0
-        super_effective = p2 and bool(set(a1.type.strong_against) & set(p2.types)) and 1.25 or 1.0
-        not_effective = p2 and bool(set(a1.type.weak_against) & set(p2.types)) and 0.8 or 1.0
-        dps = a1.power / a1.cooldown_time * Decimal(stab) * Decimal(super_effective) * Decimal(not_effective)
-        return dps
-    return wrapped_fn
+@views.route('/api/users/<int:user_id>/pokemon/<int:user_pokemon_id>/iv')
+@read_only
+@statement_budget(2)
+@owner_required
+def route_user_pokemon_iv(user_id, user_pokemon_id):
+    rows, ivs = calculate_ivs(user_id, pokedex.UserPokemon.id == user_pokemon_id)
+    if not rows:
+        abort(404)
+    iv = iv_summary(rows[0], ivs, 0)
+    iv['candidates'] = [{
+        'level': level,
+        'attack': attack,
+        'defense': defense,
+        'stamina': stamina,
+        'perfection': round(perfection, 1),
+    } for level, attack, defense, stamina, perfection in ivs.candidates(0)]
+    return json_response(iv)
 
 
-@app.route('/api/pokemon/<string:name>/ideal-moveset')
-def route_pokemon_ideal_moveset(name):
-    attack_schema = AttackSchema(many=True)
+# every evolution open to the pokemon of a user, with the candy it costs and the cp it would reach
+def evolution_plan(user_id):
+    rows, ivs = calculate_ivs(user_id)
+    candy = db.session.query(pokedex.UserCandy.pokemon_id, pokedex.UserCandy.count).filter_by(user_id=user_id).all()
+    snapshot = catalog.snapshot
+    plan = snapshot.evolutions.plan(snapshot.ivs, [row.pokemon_id for row in rows], ivs, candy)
+    return [{
+        'user_pokemon_id': rows[i].id,
+        'pokemon_id': rows[i].pokemon_id,
+        'evolves_to': evolves_to,
+        'steps': steps,
+        'candy': candy_cost,
+        'candy_owned': candy_owned,
+        'affordable': affordable,
+        'cp_min': cp_min,
+        'cp_max': cp_max,
+    } for i, evolves_to, candy_cost, steps, candy_owned, affordable, cp_min, cp_max in plan]
+
+
+@views.route('/api/users/<int:user_id>/evolutions')
+@read_only
+@statement_budget(4)
+@owner_required
+def route_user_evolutions(user_id):
     try:
-        pokemon = pokedex.Pokemon.query.filter_by(name=name).one()
-        fast_move = max(pokemon.fast_attacks, key=moveset_key(pokemon))
-        charge_move = max(pokemon.charge_attacks, key=moveset_key(pokemon))
+        pokedex.User.query.filter_by(id=user_id).one()
     except (exc.NoResultFound, exc.MultipleResultsFound):
         abort(404)
-    return attack_schema.jsonify([fast_move, charge_move])
+    return json_response({'evolutions': evolution_plan(user_id)})
 
 
-@app.route('/api/pokemon/<string:name1>/vs/<string:name2>')
-def route_pokemon_vs_pokemon(name1, name2):
-    attack_schema = AttackSchema(many=True)
+@views.route('/api/users/<int:user_id>/pokemon/<int:pokemon_id>', methods=['GET', 'DELETE'])
+@read_only
+@statement_budget(10, DELETE=14)
+@owner_required
+def route_get_user_pokemon(user_id, pokemon_id):
+    query = pokedex.UserPokemon.query.filter_by(user_id=user_id, id=pokemon_id)
+    if request.method == 'GET':
+        user_pokemon = query.options(*user_pokemon_loading_plan(Load(pokedex.UserPokemon))).first()
+        if user_pokemon is None:
+            abort(404)
+        return json_response({'userPokemon': user_pokemon_item_serializer(user_pokemon)})
+
+    user_pokemon = query.first()
+    if user_pokemon is None:
+        abort(404)
     try:
-        pokemon1 = pokedex.Pokemon.query.filter_by(name=name1).one()
-        pokemon2 = pokedex.Pokemon.query.filter_by(name=name2).one()
-        fast_move = max(pokemon1.fast_attacks, key=moveset_key(pokemon1, pokemon2))
-        charge_move = max(pokemon1.charge_attacks, key=moveset_key(pokemon1, pokemon2))
-    except (exc.NoResultFound, exc.MultipleResultsFound):
+        pokedex.User.query.filter_by(id=user_id, buddy_pokemon_id=pokemon_id) \
+            .update({'buddy_pokemon_id': None}, synchronize_session=False)
+        # catches with coordinates are the ones counted in the spawn cells
+        if user_pokemon.caught_latitude is not None and user_pokemon.caught_longitude is not None:
+            record_spawns(db.session, [(user_pokemon.pokemon_id, user_pokemon.caught_latitude,
+                                        user_pokemon.caught_longitude)], -1)
+        db.session.delete(user_pokemon)
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+    return '', 204
+
+
+# rows of the user's data inserted, updated or deleted since the sync that returned the token, or everything
+# without one. Answered by the primary: a lagging replica could hand out a token past rows it has not seen yet
+@views.route('/api/users/<int:user_id>/changes')
+@statement_budget(6)
+@owner_required
+def route_user_changes(user_id):
+    since = None
+    if 'since' in request.args:
+        try:
+            since = sync.tokens.verify(user_id, request.args['since'])
+        except InvalidSyncToken as e:
+            return jsonify(errors={'since': [str(e)]}), 422
+    changed = changes(db.session, user_id, since, [subqueryload(pokedex.UserPokemon.appraisal_iv)])
+    if changed.user is None and (since is None or changed.reset):
+        abort(404)
+    return json_response({
+        'user': user_change_serializer(changed.user),
+        'userPokemon': user_pokemon_change_serializer(changed.user_pokemon, many=True),
+        'userLogs': user_log_serializer(changed.user_logs, many=True),
+        'deleted': {
+            'userPokemon': changed.deleted_user_pokemon,
+            'userLogs': changed.deleted_user_logs,
+        },
+        'reset': changed.reset,
+        'next': sync.tokens.issue(user_id, changed.at),
+    })
+
+
+def find_pokemon(**kwargs):
+    snapshot = catalog.snapshot
+    if 'id' in kwargs:
+        pokemon = snapshot.pokemon.get(kwargs['id'])
+    else:
+        pokemon = snapshot.pokemon_by_name.get(kwargs['name'])
+    if pokemon is None:
         abort(404)
-    return attack_schema.jsonify([fast_move, charge_move])
+    return pokemon
+
+
+# autocomplete over the names of pokemon, attacks, types and items, forgiving typos
+@views.route('/api/search')
+@read_only
+@versioned_response
+def route_search():
+    args, errors = SearchQuerySchema().load(request.args)
+    if errors:
+        return jsonify(errors=errors), 422
+    return json_response([{
+        'kind': kind,
+        'id': record_id,
+        'name': name,
+        'score': score,
+    } for kind, record_id, name, score in catalog.snapshot.search.search(args['q'], args.get('kind'),
+                                                                         args['limit'])])
+
+
+@views.route('/api/pokemon/<string:name>')
+@read_only
+@versioned_response
+def route_pokemon_name(name):
+    pokemon = find_pokemon(name=name)
+    return json_response(pokemon_serializer(pokemon))
+
+
+@views.route('/api/pokemon/<string:name>/ideal-moveset')
+@read_only
+@versioned_response
+def route_pokemon_ideal_moveset(name):
+    pokemon = find_pokemon(name=name)
+    fast_move, charge_move = catalog.snapshot.movesets.best_moveset(pokemon)
+    return json_response([attack_serializer(fast_move), attack_serializer(charge_move)])
+
+
+@views.route('/api/pokemon/<string:name1>/vs/<string:name2>')
+@read_only
+@versioned_response
+def route_pokemon_vs_pokemon(name1, name2):
+    pokemon1 = find_pokemon(name=name1)
+    pokemon2 = find_pokemon(name=name2)
+    fast_move, charge_move = catalog.snapshot.battles.best_moveset(pokemon1, pokemon2)
+    return json_response([attack_serializer(fast_move), attack_serializer(charge_move)])
+
+
+@views.route('/api/pokemon/<string:name1>/vs/<string:name2>/battles')
+@read_only
+@versioned_response
+def route_pokemon_battles(name1, name2):
+    args, errors = BattlesQuerySchema().load(request.args)
+    if errors:
+        return jsonify(errors=errors), 422
+    pokemon1 = find_pokemon(name=name1)
+    pokemon2 = find_pokemon(name=name2)
+    return json_response([dict(result, fast_attack=moveset_attack_serializer(fast_move),
+                               charge_attack=moveset_attack_serializer(charge_move))
+                          for fast_move, charge_move, result in catalog.snapshot.battles.movesets_against(
+                              pokemon1, pokemon2, args['battles'])])
+
+
+@views.route('/api/pokemon/<string:name>/counters')
+@read_only
+@versioned_response
+def route_pokemon_counters(name):
+    args, errors = CountersQuerySchema().load(request.args)
+    if errors:
+        return jsonify(errors=errors), 422
+    defender = find_pokemon(name=name)
+    counters = catalog.snapshot.movesets.counters(defender)
+    return json_response([{
+        'id': pokemon.id,
+        'name': pokemon.name,
+        'fast_attack': moveset_attack_serializer(fast_move),
+        'charge_attack': moveset_attack_serializer(charge_move),
+        'dps': round(dps, 2),
+    } for pokemon, fast_move, charge_move, dps in counters[:args['limit']]])
+
+
+@views.route('/api/pokemon/<string:name>/evolutions')
+@read_only
+@versioned_response
+def route_pokemon_evolutions(name):
+    pokemon = find_pokemon(name=name)
+    return json_response([{
+        'id': evolution.id,
+        'name': evolution.name,
+        'candy': candy,
+        'steps': steps,
+    } for evolution, candy, steps in catalog.snapshot.evolutions.chains[pokemon.id]])
+
+
+# catches per map tile; left out of versioned_response as the counts change with every catch, not with imports
+@views.route('/api/pokemon/<string:name>/spawns')
+@read_only
+@statement_budget(1)
+def route_pokemon_spawns(name):
+    args, errors = SpawnQuerySchema().load(request.args)
+    if errors:
+        return jsonify(errors=errors), 422
+    pokemon = find_pokemon(name=name)
+    zoom = args['zoom']
+    min_x, min_y, max_x, max_y = tile_range(*parse_bbox(args['bbox']), zoom=zoom)
+    if (max_x - min_x + 1) * (max_y - min_y + 1) > MAX_SPAWN_TILES:
+        return jsonify(errors={'zoom': ['Too many tiles for this box, use a lower zoom.']}), 422
+    spawn_cell = pokedex.SpawnCell
+    cells = db.session.query(spawn_cell.x, spawn_cell.y, spawn_cell.count) \
+        .filter(spawn_cell.pokemon_id == pokemon.id, spawn_cell.zoom == zoom,
+                spawn_cell.x.between(min_x, max_x), spawn_cell.y.between(min_y, max_y), spawn_cell.count > 0) \
+        .order_by(spawn_cell.x, spawn_cell.y)
+    return json_response({'zoom': zoom, 'cells': [{'x': x, 'y': y, 'count': count} for x, y, count in cells]})
 
 
-@app.route('/api/pokemon/<int:id>')
+@views.route('/api/pokemon/<int:id>')
+@read_only
+@versioned_response
 def route_pokemon_id(id):
-    pokemon_schema = PokemonSchema()
+    pokemon = find_pokemon(id=id)
+    return json_response(pokemon_serializer(pokemon))
+
+
+# dashboards read the rollups kept by api.stats only, never user_pokemon itself
+def stats_entry(pokemon_id, rows, **values):
+    pokemon = catalog.snapshot.pokemon.get(pokemon_id)
+    return dict(species_summary(rows), pokemon_id=pokemon_id, name=pokemon and pokemon.name, **values)
+
+
+@views.route('/api/stats/pokemon')
+@statement_budget(1)
+def route_stats_pokemon():
+    args, errors = StatsQuerySchema(only=('team_id',)).load(request.args)
+    if errors:
+        return jsonify(errors=errors), 422
+    query = pokedex.SpeciesStats.query.filter(pokedex.SpeciesStats.count > 0)
+    if 'team_id' in args:
+        query = query.filter_by(team_id=args['team_id'])
+    species = OrderedDict()
+    for row in query.order_by(pokedex.SpeciesStats.pokemon_id, pokedex.SpeciesStats.team_id):
+        species.setdefault(row.pokemon_id, []).append(row)
+    stats = sorted((stats_entry(pokemon_id, rows) for pokemon_id, rows in species.items()),
+                   key=lambda entry: -entry['count'])
+    return json_response({'stats': stats})
+
+
+@views.route('/api/stats/pokemon/<string:name>')
+@statement_budget(2)
+def route_stats_pokemon_name(name):
+    pokemon = find_pokemon(name=name)
+    rows = pokedex.SpeciesStats.query.filter(pokedex.SpeciesStats.pokemon_id == pokemon.id,
+                                             pokedex.SpeciesStats.count > 0) \
+        .order_by(pokedex.SpeciesStats.team_id).all()
+    histogram = pokedex.SpeciesHistogram
+    histograms = {metric: [] for metric in HISTOGRAM_WIDTHS}
+    for metric, bucket, count in db.session.query(histogram.metric, histogram.bucket, func.sum(histogram.count)) \
+            .filter(histogram.pokemon_id == pokemon.id).group_by(histogram.metric, histogram.bucket) \
+            .order_by(histogram.metric, histogram.bucket):
+        if count and metric in histograms:
+            width = HISTOGRAM_WIDTHS[metric]
+            histograms[metric].append({'min': bucket * width, 'max': bucket * width + width - 1, 'count': int(count)})
+    return json_response(stats_entry(pokemon.id, rows, histograms=histograms,
+                                     teams=[dict(species_summary([row]), team_id=row.team_id) for row in rows]))
+
+
+@views.route('/api/stats/teams')
+@statement_budget(1)
+def route_stats_teams():
+    args, errors = StatsQuerySchema(only=('limit',)).load(request.args)
+    if errors:
+        return jsonify(errors=errors), 422
+    limit = args['limit']
+    teams = OrderedDict()
+    for row in pokedex.SpeciesStats.query.filter(pokedex.SpeciesStats.count > 0) \
+            .order_by(pokedex.SpeciesStats.team_id, pokedex.SpeciesStats.count.desc(),
+                      pokedex.SpeciesStats.pokemon_id):
+        species = teams.setdefault(row.team_id, [])
+        if len(species) < limit:
+            species.append(stats_entry(row.pokemon_id, [row]))
+    return json_response({'teams': [{'team_id': team_id, 'pokemon': species} for team_id, species in teams.items()]})
+
+
+# heavy analytics run on the job workers of api.jobs; identical submissions share one job and its cached result
+@jobs.task('rebuild-stats', admin=True)
+def rebuild_stats_job():
+    stats, histograms = rebuild_rollups(db.session)
+    return {'species_stats': stats, 'species_histograms': histograms}
+
+
+@jobs.task('rebuild-spawns', admin=True)
+def rebuild_spawns_job():
+    return {'catches': rebuild_spawn_cells(db.session)}
+
+
+@jobs.task('user-ivs', UserJobSchema)
+def user_ivs_job(user_id):
+    return {'ivs': collection_ivs(user_id)}
+
+
+@jobs.task('user-evolutions', UserJobSchema)
+def user_evolutions_job(user_id):
+    return {'evolutions': evolution_plan(user_id)}
+
+
+# simulated counters of every species, too many battles for a request; the one user of the battle process pool
+@jobs.task('battle-counters', BattleCountersJobSchema)
+def battle_counters_job(name, battles, limit):
+    defender = catalog.snapshot.pokemon_by_name.get(name)
+    if defender is None:
+        raise ValueError('Unknown pokemon {0!r}.'.format(name))
+    return {'counters': [dict(result, id=pokemon.id, name=pokemon.name,
+                              fast_attack={'id': fast_move.id, 'name': fast_move.name},
+                              charge_attack={'id': charge_move.id, 'name': charge_move.name})
+                         for pokemon, fast_move, charge_move, result in catalog.snapshot.battles.counters(
+                             defender, battles, battle_pool())[:limit]]}
+
+
+# a lookup, then for a new job the timed out one it replaces and the insert
+@views.route('/api/jobs', methods=['POST'])
+@statement_budget(4)
+def route_jobs():
+    data = request.get_json(silent=True) or {}
+    kind = data.get('kind')
+    if kind not in jobs.tasks:
+        return jsonify(errors={'kind': ['Unknown job.']}), 422
+    _, schema = jobs.tasks[kind]
+    params = data.get('params') or {}
+    if schema is not None:
+        params, errors = schema().load(params)
+        if errors:
+            return jsonify(errors={'params': errors}), 422
+    # jobs over a collection are for its owner only, maintenance over everyone's data for admins, the rest for any
+    # signed in user
+    if 'user_id' in params:
+        refused = refuse_unless_owner(params['user_id'])
+    elif kind in jobs.admin_tasks:
+        refused = refuse_unless_admin()
+    else:
+        refused = refuse_unless_authenticated()
+    if refused is not None:
+        return refused
+    job = jobs.submit(kind, params)
+    return json_response({'job': job_serializer(job)}), 202
+
+
+def find_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        abort(404)
+    return job
+
+
+@views.route('/api/jobs/<string:job_id>')
+@statement_budget(1)
+def route_job(job_id):
+    return json_response({'job': job_serializer(find_job(job_id))})
+
+
+# the result as the job stored it; 202 with the job while it is still queued or running
+@views.route('/api/jobs/<string:job_id>/result')
+@statement_budget(1)
+def route_job_result(job_id):
+    job = find_job(job_id)
+    if job.status == FAILED:
+        return jsonify(errors={'job': [job.error]}), 422
+    if job.status != DONE:
+        return json_response({'job': job_serializer(job)}), 202
+    return current_app.response_class((job.result, '\n'), mimetype=current_app.config['JSONIFY_MIMETYPE'])
+
+
+# liveness: the process answers requests
+@views.route('/api/health')
+@statement_budget(0)
+def route_health():
+    return jsonify(status='ok')
+
+
+# readiness: the catalog is loaded, the database answers and the server is not shutting down
+@views.route('/api/ready')
+@statement_budget(1)
+def route_ready():
+    if stopping.is_set():
+        return jsonify(status='stopping'), 503
     try:
-        pokemon = pokedex.Pokemon.query.filter_by(id=id).one()
-    except (exc.NoResultFound, exc.MultipleResultsFound):
+        db.session.execute('SELECT 1')
+    except Exception:
+        return jsonify(status='database unavailable'), 503
+    return jsonify(status='ready', catalog=catalog.snapshot.version)
+
+
+# per process, like everything setup_metrics collects
+@views.route('/metrics')
+@statement_budget(0)
+def route_metrics():
+    return current_app.response_class(registry.expose(), mimetype='text/plain; version=0.0.4')
+
+
+# folded stacks of the latest slow requests, when PROFILE_SLOW_REQUESTS is set
+@views.route('/metrics/profiles')
+@statement_budget(0)
+def route_metrics_profiles():
+    profiler = current_app.extensions['profiler']
+    if profiler is None:
         abort(404)
-    return pokemon_schema.jsonify(pokemon)
+    return jsonify(profiles=list(profiler.profiles))
+
+
+# the schema is only created or extended on request, so starting the app never runs DDL; on an existing database
+# this adds the indexes introduced since it was created
+@commands.command('init-db')
+@click.option('--import-data', is_flag=True, help='Load the data_import CSVs into the new tables.')
+@click.option('--dry-run', is_flag=True, help='Only list the missing tables and indexes.')
+def init_db_command(import_data, dry_run):
+    if dry_run:
+        tables, indexes, skipped = plan_schema(db)
+        for name in tables:
+            click.echo('Would create table {0}.'.format(name))
+        for index in indexes:
+            click.echo('Would create index {0} on {1}({2}).'.format(
+                index.name, index.table.name, ', '.join(column.name for column in index.columns)))
+        for name in skipped:
+            click.echo('Would skip index {0}, its table lacks some of the columns.'.format(name))
+        return
+    created, skipped = create_schema(db)
+    click.echo('Created the missing tables and indexes of {0}{1}.'.format(
+        db.engine.url, ''.join(', index {0}'.format(name) for name in created)))
+    for name in skipped:
+        click.echo('Skipped index {0}, its table lacks some of the columns.'.format(name))
+    if import_data:
+        import_all_data(db)
+        catalog.invalidate()
+        click.echo('Imported the catalog.')
+
+
+@commands.command('prune-tombstones')
+def prune_tombstones_command():
+    click.echo('Pruned {0} tombstones.'.format(prune_tombstones(db.session)))
+
+
+@commands.command('startup-report')
+def startup_report_command():
+    report = OrderedDict(current_app.extensions['startup'])
+    report.update(warm_up())
+    for phase, seconds in report.items():
+        click.echo('{0:<28} {1:>9.1f} ms'.format(phase, seconds * 1000))
+
+
+@commands.command('serve')
+@click.option('--host', default='0.0.0.0')
+@click.option('--port', default=8080)
+@click.option('--threads', default=4, help='Request threads per worker.')
+@click.option('--workers', default=1, help='Worker processes forked after the catalog is loaded.')
+@click.option('--grace', default=30, help='Seconds in-flight requests get to finish on shutdown.')
+def serve_command(host, port, threads, workers, grace):
+    serve(current_app._get_current_object(), host, port, threads=threads, workers=workers, grace=grace)
+
+
+@commands.command('rebuild-stats')
+def rebuild_stats_command():
+    stats, histograms = rebuild_rollups(db.session)
+    click.echo('Rebuilt {0} species stats and {1} histogram buckets.'.format(stats, histograms))
+
+
+@commands.command('rebuild-spawns')
+def rebuild_spawns_command():
+    click.echo('Counted {0} catches.'.format(rebuild_spawn_cells(db.session)))
+
+
+# every user's catches, for extracts too large to page through the api
+@commands.command('export')
+@click.argument('output', type=click.File('wb'))
+@click.option('--format', 'export_format', type=click.Choice(sorted(FORMATS)), default='csv')
+@click.option('--user', 'user_id', type=int, help='Only this user\'s collection.')
+@click.option('--pokemon-id', type=int)
+@click.option('--caught-from', help='YYYY-MM-DD')
+@click.option('--caught-to', help='YYYY-MM-DD')
+def export_command(output, export_format, user_id, pokemon_id, caught_from, caught_to):
+    args, errors = UserPokemonExportSchema().load({key: value for key, value in (
+        ('pokemon_id', pokemon_id), ('caught_from', caught_from), ('caught_to', caught_to)) if value is not None})
+    if errors:
+        raise click.UsageError(json.dumps(errors))
+    query = filter_user_pokemon(export_query(db.session), args)
+    if user_id is not None:
+        query = query.filter(pokedex.UserPokemon.user_id == user_id)
+    for chunk in export(db.session, query, export_format):
+        output.write(chunk)
+
+
+@commands.command('seed-benchmark')
+@click.option('--users', default=100, help='Users to add.')
+@click.option('--pokemon', 'pokemon_per_user', default=100, help='Pokemon per user.')
+@click.option('--seed', default=0)
+@click.option('--import-catalog', is_flag=True, help='Load the data_import CSVs first.')
+def seed_benchmark_command(users, pokemon_per_user, seed, import_catalog):
+    if import_catalog:
+        import_all_data(db)
+    first, last = seed_population(db, users, pokemon_per_user, seed=seed)
+    click.echo('Added users {0} to {1} with {2} pokemon each.'.format(first, last, pokemon_per_user))
+
+
+@commands.command('benchmark')
+@click.option('--requests', default=200, help='Measured requests per route.')
+@click.option('--warmup', default=5, help='Unmeasured requests per route.')
+@click.option('--routes', default='', help='Comma separated route names, all by default.')
+@click.option('--url', default=None, help='Base url of a running server, the test client is used without it.')
+@click.option('--concurrency', default=8, help='Connections used against --url.')
+@click.option('--seed', default=0)
+@click.option('--output', default='benchmark.json', type=click.File('w'))
+def benchmark_command(requests, warmup, routes, url, concurrency, seed, output):
+    routes = [name for name in routes.split(',') if name]
+    unknown = [name for name in routes if name not in ROUTES]
+    if unknown:
+        raise click.BadParameter('unknown routes {0}, expected some of {1}'.format(
+            ', '.join(unknown), ', '.join(ROUTES)), param_hint='--routes')
+    results = run_benchmark(current_app._get_current_object(), db, routes, requests, warmup, url, concurrency, seed)
+    json.dump(results, output, indent=2)
+    for name, result in results['routes'].items():
+        latency = result['latency_ms'] or {}
+        click.echo('{0:<20} {1:>9} req/s  p50 {2:>9} ms  p95 {3:>9} ms  p99 {4:>9} ms  sql {5}'.format(
+            name, result['throughput'], latency.get('p50'), latency.get('p95'), latency.get('p99'),
+            result['sql_statements'] and result['sql_statements']['mean']))
+
+
+@commands.command('benchmark-compare')
+@click.argument('base', type=click.File())
+@click.argument('new', type=click.File())
+def benchmark_compare_command(base, new):
+    for name, metric, before, after, change in compare_results(json.load(base), json.load(new)):
+        click.echo('{0:<20} {1:<10} {2:>10} {3:>10} {4:>8}'.format(
+            name, metric, before, after, '' if change is None else '{0:+.1f}%'.format(change)))
+
+
+# fails when a route reads one of the tables that grow with the users in full, run it against a seeded database
+@commands.command('explain')
+@click.option('--routes', default='', help='Comma separated route names, all by default.')
+@click.option('--verbose', is_flag=True, help='Print every statement with its plan.')
+@click.option('--seed', default=0)
+def explain_command(routes, verbose, seed):
+    routes = [name for name in routes.split(',') if name]
+    unknown = [name for name in routes if name not in ROUTES]
+    if unknown:
+        raise click.BadParameter('unknown routes {0}, expected some of {1}'.format(
+            ', '.join(unknown), ', '.join(ROUTES)), param_hint='--routes')
+    failures = 0
+    for name, statements in explain_routes(current_app._get_current_object(), db, routes, seed).items():
+        scans = sorted({table for statement in statements for table in statement.scans})
+        failures += bool(scans)
+        click.echo('{0:<22} {1:>3} statements  {2}'.format(
+            name, len(statements), 'full scan of ' + ', '.join(scans) if scans else 'ok'))
+        for statement in statements:
+            if verbose or statement.scans:
+                click.echo('    ' + ' '.join(statement.sql.split()))
+                for line in statement.plan:
+                    click.echo('        ' + line)
+    if failures:
+        raise click.ClickException('{0} routes read large tables in full.'.format(failures))
+
+
+def _timed(timings, phase, fn, *args):
+    started = perf_counter()
+    result = fn(*args)
+    timings[phase] = perf_counter() - started
+    return result
+
+
+# the work create_app leaves for first use: connecting, loading the catalog snapshot and compiling the serializers;
+# returns how long each took
+def warm_up():
+    timings = OrderedDict()
+    _timed(timings, 'first connection', lambda: db.session.execute('SELECT 1').scalar())
+    _timed(timings, 'catalog snapshot', lambda: catalog.snapshot)
+    _timed(timings, 'serializers', compile_all)
+    return timings
+
+
+# builds an app without touching the database: tables come from the init-db command, the catalog snapshot is loaded
+# by the first request that needs it and queued jobs are recovered on the first request. Timings of every step are
+# kept in app.extensions['startup'], along with the cpu time the process spent before, mostly on imports
+def create_app(config=None):
+    timings = OrderedDict([('imports (cpu)', process_time())])
+    app = _timed(timings, 'flask', Flask, __name__)
+    app.config.from_object(__name__)
+    app.config.update({
+        'DEBUG': True,
+        'SECRET_KEY': 'development key',
+    })
+    app.config.from_envvar('API_SERVER_CONFIG', silent=True)
+    app.config.update(config or {})
+
+    _timed(timings, 'database', setup_database, app)
+    _timed(timings, 'statement counter', setup_statement_counter, app, db)
+    _timed(timings, 'metrics', setup_metrics, app, db)
+    _timed(timings, 'rollups', setup_rollups, db)
+    _timed(timings, 'catalog', setup_catalog, app, db)
+    _timed(timings, 'jobs', setup_jobs, app, db)
+    _timed(timings, 'auth', setup_auth, app, db)
+    _timed(timings, 'sync', setup_sync, app, db)
+    _timed(timings, 'marshmallow', ma.init_app, app)
+    _timed(timings, 'routes', app.register_blueprint, views)
+    for command in commands.commands.values():
+        app.cli.add_command(command)
+    app.extensions['startup'] = timings
+    return app
+
+
+app = create_app()
 
 
 if __name__ == '__main__':
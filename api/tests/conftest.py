@@ -0,0 +1,58 @@
+# the suite runs against an app of its own with TESTING set, so statement budgets are strict, over a database
+# holding the catalog and a small seeded population
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.auth import auth
+from api.benchmark import seed_population
+from api.data_import.data_import import import_all_data
+from api.database import create_schema, db
+from api.database.models import pokedex
+from app import create_app
+
+from itertools import count
+import json
+
+import pytest
+
+USERS = 10
+POKEMON_PER_USER = 20
+
+_usernames = count()
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    path = tmp_path_factory.mktemp('database').joinpath('pokedex.sqlite')
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///{0}'.format(path)})
+    create_schema(db)
+    import_all_data(db)
+    seed_population(db, USERS, POKEMON_PER_USER)
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def bearer(user_id):
+    return {'Authorization': 'Bearer ' + auth.signer.issue(user_id)}
+
+
+def read_json(response):
+    return json.loads(response.get_data(as_text=True))
+
+
+# a user of its own for tests that change data, so the seeded users stay as seeded
+@pytest.fixture
+def user(app):
+    user = pokedex.User(username='test{0}'.format(next(_usernames)), email='test@example.com', password='-',
+                        team_id=1)
+    db.session.add(user)
+    db.session.commit()
+    user_id = user.id
+    db.session.remove()
+    return user_id
@@ -0,0 +1,63 @@
+from conftest import bearer
+
+from api.auth import auth, HasherBusy, PasswordHasher
+from api.database import db
+from api.database.models import pokedex
+
+from datetime import datetime, timedelta
+from threading import Event
+import time
+
+from itsdangerous import TimestampSigner
+import pytest
+
+
+def test_slow_hash_is_refused():
+    hasher = PasswordHasher(workers=1, queue=0, timeout=0.01)
+    release = Event()
+    try:
+        with pytest.raises(HasherBusy):
+            hasher._run(release.wait)
+    finally:
+        release.set()
+
+
+def test_login_times_out(client, user, monkeypatch):
+    username = db.session.query(pokedex.User.username).filter_by(id=user).scalar()
+    db.session.remove()
+    monkeypatch.setattr(auth.hasher, 'timeout', 0.01)
+    monkeypatch.setattr(auth.hasher, 'check', lambda *args: auth.hasher._run(time.sleep, 0.2))
+    response = client.post('/api/login', data={'username': username, 'password': 'secret'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After']
+
+
+# a revocation lasts as long as the token would have been accepted, counted from when it was issued
+def test_revocation_expires_with_token(client, user, monkeypatch):
+    issued = datetime.utcnow() - timedelta(hours=1)
+    get_timestamp = TimestampSigner.get_timestamp
+    monkeypatch.setattr(TimestampSigner, 'get_timestamp', lambda signer: get_timestamp(signer) - 3600)
+    headers = bearer(user)
+    monkeypatch.undo()
+    assert client.get('/api/logout', headers=headers).status_code == 200
+    expires, = db.session.query(pokedex.RevokedToken.expires).order_by(pokedex.RevokedToken.expires.desc()).first()
+    db.session.remove()
+    assert abs(expires - (issued + timedelta(seconds=auth.signer.max_age))) < timedelta(seconds=5)
+
+
+# a worker that has not loaded the revocations yet, e.g. freshly forked, still refuses a revoked token
+def test_fresh_worker_refuses_revoked_token(client, user, monkeypatch):
+    headers = bearer(user)
+    assert client.get('/api/logout', headers=headers).status_code == 200
+    monkeypatch.setattr(auth.revoked, '_pid', None)
+    monkeypatch.setattr(auth.revoked, '_revoked', frozenset())
+    assert client.get('/api/users/{}/changes'.format(user), headers=headers).status_code == 401
+
+
+def test_revoking_twice_is_a_no_op(client, user):
+    claims = auth.signer.verify(bearer(user)['Authorization'].split()[1])
+    auth.revoked.revoke(claims['jti'], claims['exp'])
+    auth.revoked.revoke(claims['jti'], claims['exp'])
+    assert claims['jti'] in auth.revoked
+    assert db.session.query(pokedex.RevokedToken).filter_by(jti=claims['jti']).count() == 1
+    db.session.remove()
@@ -0,0 +1,58 @@
+from conftest import bearer, read_json
+
+import app as app_module
+from api.database import db, insert_ignoring_conflicts
+from api.database.models import pokedex
+
+import json
+import uuid
+
+
+def species_count(pokemon_id, team_id):
+    count = db.session.query(pokedex.SpeciesStats.count).filter_by(pokemon_id=pokemon_id, team_id=team_id).scalar()
+    db.session.remove()
+    return count or 0
+
+
+def upload(client, user, items):
+    return client.post('/api/users/{0}/pokemon/batch'.format(user), headers=bearer(user),
+                       content_type='application/json', data=json.dumps(items))
+
+
+def test_replayed_batch(client, user):
+    items = [{'guid': str(uuid.uuid4()), 'pokemon_id': 7, 'cp': 10, 'hp': 10} for _ in range(3)]
+    before = species_count(7, 1)
+    assert len(read_json(upload(client, user, items))['created']) == 3
+    response = read_json(upload(client, user, items))
+    assert response['created'] == []
+    assert sorted(response['duplicates']) == sorted(item['guid'] for item in items)
+    assert species_count(7, 1) == before + 3
+
+
+def test_insert_returns_inserted_keys(app, user):
+    table = pokedex.UserPokemon.__table__
+    guids = [uuid.uuid4() for _ in range(3)]
+    rows = [{'user_id': user, 'guid': guid, 'pokemon_id': 1, 'cp': 10, 'hp': 10} for guid in guids]
+    assert insert_ignoring_conflicts(db.session, table, rows[:1], ['user_id', 'guid']) == {(user, guids[0])}
+    assert insert_ignoring_conflicts(db.session, table, rows, ['user_id', 'guid']) == \
+        {(user, guid) for guid in guids[1:]}
+    db.session.rollback()
+    db.session.remove()
+
+
+# a row stored by a concurrent upload after the lookup of existing guids is not counted a second time
+def test_concurrent_batch(client, user, monkeypatch):
+    items = [{'guid': str(uuid.uuid4()), 'pokemon_id': 8, 'cp': 10, 'hp': 10} for _ in range(2)]
+
+    def racing(session, table, rows, keys):
+        db.engine.execute(table.insert(), dict(rows[0]))
+        return insert_ignoring_conflicts(session, table, rows, keys)
+    monkeypatch.setattr(app_module, 'insert_ignoring_conflicts', racing)
+    before = species_count(8, 1)
+    response = read_json(upload(client, user, items))
+    assert response['created'] == [items[1]['guid']]
+    assert response['duplicates'] == [items[0]['guid']]
+    assert species_count(8, 1) == before + 1
+    # the raced row was never counted, without it the rollups match the collection again
+    table = pokedex.UserPokemon.__table__
+    db.engine.execute(table.delete().where(table.c.guid == uuid.UUID(items[0]['guid'])))
@@ -0,0 +1,31 @@
+from conftest import bearer
+
+from api.catalog import catalog
+from api.jobs import jobs
+
+import json
+import uuid
+
+from flask import g
+
+
+# the snapshot is loaded by the first request that needs it, which must still be within its own budget
+def test_cold_catalog_spawns(client):
+    catalog.invalidate()
+    response = client.get('/api/pokemon/Pikachu/spawns?bbox=-122.6,37.2,-121.8,38.0&zoom=10')
+    assert response.status_code == 200
+
+
+def test_cold_catalog_batch(client, user):
+    catalog.invalidate()
+    response = client.post('/api/users/{0}/pokemon/batch'.format(user), headers=bearer(user),
+                           content_type='application/json',
+                           data=json.dumps([{'guid': str(uuid.uuid4()), 'pokemon_id': 25, 'cp': 10, 'hp': 10}]))
+    assert response.status_code == 200
+
+
+def test_job_recovery_is_not_counted(app):
+    with app.test_request_context():
+        g.sql_statements = 0
+        jobs.recover()
+        assert g.sql_statements == 0
@@ -0,0 +1,19 @@
+from api.catalog import catalog
+from api.database import db
+from api.database.models import pokedex
+
+from uuid import uuid4
+
+
+# an import by another process only records a new data version, which the next check picks up
+def test_import_elsewhere_replaces_snapshot(client, monkeypatch):
+    etag = client.get('/api/pokemon/Pikachu').headers['ETag']
+    version = uuid4().hex
+    db.engine.execute(pokedex.DataVersion.__table__.insert(), version=version)
+    assert client.get('/api/pokemon/Pikachu').headers['ETag'] == etag
+
+    monkeypatch.setattr(catalog, '_check_interval', 0)
+    response = client.get('/api/pokemon/Pikachu', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert catalog.snapshot.version == version
@@ -0,0 +1,44 @@
+from api.data_import import data_import
+from api.data_import.data_import import import_all_data, load_table, DATA_DIR, TRUNCATE
+from api.database import db
+from api.database.models import pokedex
+
+import os
+
+import pytest
+
+
+def rowids(table):
+    return sorted(db.engine.execute('SELECT rowid FROM {0}'.format(table)).fetchall())
+
+
+# an upsert updates the rows it finds, INSERT OR REPLACE would delete them and insert them anew
+def test_upsert_keeps_rows(app):
+    before = rowids('pokemon_type')
+    load_table(db.engine, pokedex.PokemonType, os.path.join(DATA_DIR, 'table_pokemon_type.csv'))
+    load_table(db.engine, pokedex.Pokemon, os.path.join(DATA_DIR, 'table_pokemon.csv'))
+    assert rowids('pokemon_type') == before
+
+
+def test_truncate_refused_with_user_data(app):
+    catches = db.engine.execute('SELECT COUNT(*) FROM user_pokemon').scalar()
+    with pytest.raises(ValueError):
+        import_all_data(db, TRUNCATE)
+    assert db.engine.execute('SELECT COUNT(*) FROM user_pokemon').scalar() == catches
+
+
+# the catalog is emptied in the transaction that reloads it, so a load that fails keeps the old catalog
+def test_failed_truncate_keeps_catalog(app, monkeypatch):
+    read_rows = data_import.read_rows
+
+    def failing(table, file):
+        if table.name == 'attack':
+            raise IOError(file)
+        return read_rows(table, file)
+    monkeypatch.setattr(data_import, 'referencing_tables', lambda *args: [])
+    monkeypatch.setattr(data_import, 'read_rows', failing)
+    species = db.engine.execute('SELECT COUNT(*) FROM pokemon').scalar()
+    with pytest.raises(IOError):
+        import_all_data(db, TRUNCATE)
+    assert db.engine.execute('SELECT COUNT(*) FROM pokemon').scalar() == species
+    assert db.engine.execute('SELECT COUNT(*) FROM attack').scalar() > 0
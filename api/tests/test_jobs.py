@@ -0,0 +1,60 @@
+from conftest import bearer
+
+from api.auth import auth
+from api.database import db
+from api.database.models import pokedex
+from api.jobs import jobs
+from api.jobs.runner import job_key, QUEUED
+
+from datetime import datetime
+import json
+from uuid import uuid4
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+
+def submit(client, kind, params=None, headers=None):
+    return client.post('/api/jobs', content_type='application/json', headers=headers or {},
+                       data=json.dumps({'kind': kind, 'params': params or {}}))
+
+
+def test_jobs_need_authentication(client):
+    for kind in ['rebuild-stats', 'rebuild-spawns', 'battle-counters']:
+        assert submit(client, kind, {'name': 'Pikachu'}).status_code == 401
+
+
+def test_maintenance_jobs_need_admin(client, user, monkeypatch):
+    assert submit(client, 'rebuild-stats', headers=bearer(user)).status_code == 403
+    monkeypatch.setattr(auth, 'admins', frozenset([str(user)]))
+    monkeypatch.setattr(jobs._executor, 'submit', lambda *args: None)
+    assert submit(client, 'rebuild-stats', headers=bearer(user)).status_code == 202
+
+
+def test_one_active_job_per_key(app):
+    params = json.dumps({'name': 'Mew'})
+    key = job_key('battle-counters', {'name': 'Mew'})
+    for _ in range(2):
+        db.session.add(pokedex.Job(id=uuid4().hex, kind='battle-counters', params=params, key=key, status=QUEUED,
+                                   created=datetime.utcnow()))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
+    db.session.remove()
+
+
+# a submission losing the race to insert gets the job of the one that won
+def test_submit_race(app, monkeypatch):
+    params = {'name': 'Mewtwo', 'battles': 10, 'limit': 1}
+    monkeypatch.setattr(jobs._executor, 'submit', lambda *args: None)
+    first = jobs.submit('battle-counters', params).id
+    current = jobs._current
+    lookups = []
+
+    def lookup(kind, key, now):
+        lookups.append(kind)
+        return None if len(lookups) == 1 else current(kind, key, now)
+    monkeypatch.setattr(jobs, '_current', lookup)
+    assert jobs.submit('battle-counters', params).id == first
+    assert len(lookups) == 2
+    db.session.remove()
@@ -0,0 +1,84 @@
+from conftest import read_json
+
+from api.catalog import battle, catalog
+from api.catalog.moveset import SCORE_DECIMALS
+
+from decimal import Decimal
+
+
+def ranking_keys(engine, defender):
+    keys = []
+    for pokemon, fast_move, charge_move, score in engine.counters(defender):
+        _, fast_penalties = engine.attack_scores(pokemon, [fast_move], defender)
+        _, charge_penalties = engine.attack_scores(pokemon, [charge_move], defender)
+        keys.append((-round(score, SCORE_DECIMALS), -int(fast_penalties[0] + charge_penalties[0]), pokemon.id))
+    return keys
+
+
+# species tying on score and penalties are ranked by id
+def test_counters_tie_break(app):
+    snapshot = catalog.snapshot
+    engine = snapshot.movesets
+    ties = 0
+    for name in ['Pikachu', 'Gyarados', 'Snorlax']:
+        keys = ranking_keys(engine, snapshot.pokemon_by_name[name])
+        assert keys == sorted(keys)
+        ties += sum(1 for a, b in zip(keys, keys[1:]) if a[:2] == b[:2])
+    assert ties
+
+
+def test_counters_limit(client):
+    assert len(read_json(client.get('/api/pokemon/Pikachu/counters?limit=3'))) == 3
+    for limit in ['abc', '0']:
+        response = client.get('/api/pokemon/Pikachu/counters?limit={0}'.format(limit))
+        assert response.status_code == 422
+        assert 'limit' in read_json(response)['errors']
+
+
+def test_battles_argument(client):
+    for battles in ['abc', '0']:
+        response = client.get('/api/pokemon/Pikachu/vs/Gyarados/battles?battles={0}'.format(battles))
+        assert response.status_code == 422
+        assert 'battles' in read_json(response)['errors']
+
+
+# how the routes scored attacks before the numpy engine, in Decimal; the engine has to pick the same movesets
+def moveset_key(p1, p2=None):
+    def wrapped_fn(a1):
+        stab = bool(a1.type in p1.types) and 1.25 or 1.0
+        super_effective = p2 and bool(set(a1.type.strong_against) & set(p2.types)) and 1.25 or 1.0
+        not_effective = p2 and bool(set(a1.type.weak_against) & set(p2.types)) and 0.8 or 1.0
+        return a1.power / a1.cooldown_time * Decimal(stab) * Decimal(super_effective) * Decimal(not_effective)
+    return wrapped_fn
+
+
+def test_moveset_ranking_matches_decimal(app):
+    snapshot = catalog.snapshot
+    roster = [pokemon for _, pokemon in sorted(snapshot.pokemon.items())
+              if pokemon.fast_attacks and pokemon.charge_attacks]
+    assert len(roster) > 100
+    for attacker in roster:
+        for defender in [None] + roster[::10]:
+            expected = (max(attacker.fast_attacks, key=moveset_key(attacker, defender)),
+                        max(attacker.charge_attacks, key=moveset_key(attacker, defender)))
+            assert snapshot.movesets.best_moveset(attacker, defender) == expected
+
+
+def test_attack_vectors(app):
+    movesets = catalog.snapshot.movesets
+    for i, attack in enumerate(movesets.attacks):
+        assert movesets.attack_dps[i] == float(attack.power) / float(attack.cooldown_time)
+        assert movesets.attack_eps[i] == float(attack.energy) / float(attack.cooldown_time)
+
+
+# requests simulate on their own thread, forking the process pool from one could deadlock
+def test_battles_stay_in_process(client, monkeypatch):
+    def refuse(*args, **kwargs):
+        raise AssertionError('process pool started from a request')
+    monkeypatch.setattr(battle, 'ProcessPoolExecutor', refuse)
+    monkeypatch.setattr(battle, '_pool', None)
+    assert client.get('/api/pokemon/Mew/vs/Gyarados').status_code == 200
+    response = client.get('/api/pokemon/Mew/vs/Gyarados/battles?battles={0}'.format(battle.MAX_REQUEST_BATTLES))
+    assert response.status_code == 200
+    response = client.get('/api/pokemon/Mew/vs/Gyarados/battles?battles={0}'.format(battle.MAX_REQUEST_BATTLES + 1))
+    assert response.status_code == 422
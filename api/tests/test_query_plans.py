@@ -0,0 +1,11 @@
+from api.benchmark import explain_routes
+from api.database import db
+
+
+# no statement of a benchmarked route reads a table that grows with the users in full
+def test_no_full_scans(app):
+    explained = explain_routes(app, db)
+    assert all(statement.plan for statements in explained.values() for statement in statements)
+    scans = {name: [(statement.sql, statement.scans) for statement in statements if statement.scans]
+             for name, statements in explained.items()}
+    assert {name: found for name, found in scans.items() if found} == {}
@@ -0,0 +1,101 @@
+# every route runs under TESTING, where going over a statement budget raises instead of logging
+from conftest import read_json
+
+from api.benchmark import ROUTES
+from api.benchmark.runner import run_client, Targets
+from api.database import db
+from api.jobs import jobs
+
+import json
+import random
+import uuid
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def targets(app):
+    return Targets(db)
+
+
+# the first request of a route may load what is loaded on first use, the second may not rely on it being counted
+@pytest.mark.parametrize('name', list(ROUTES))
+def test_benchmark_route(client, targets, name):
+    rng = random.Random(0)
+    for _ in range(2):
+        method, path, data = ROUTES[name](targets, rng)
+        response = client.open(path, method=method, data=data, headers=targets.headers(path))
+        assert response.status_code < 400, path
+
+
+# the routes the benchmark leaves out, driven through a session of a user of their own
+def test_other_routes(app, client, monkeypatch):
+    monkeypatch.setattr(jobs._executor, 'submit', lambda *args: None)
+    exercised = set()
+    adapter = app.url_map.bind('localhost')
+
+    def call(method, path, status=200, **kwargs):
+        response = client.open(path, method=method, **kwargs)
+        assert response.status_code == status, path
+        exercised.add((adapter.match(path.partition('?')[0], method)[0], method))
+        return response
+
+    username = 'routes{0}'.format(uuid.uuid4().hex[:8])
+    call('POST', '/api/users', data={'username': username, 'password': 'secret', 'email': 'routes@example.com'})
+    login = read_json(call('POST', '/api/login', data={'username': username, 'password': 'secret'}))
+    user = login['user_id']
+    headers = {'Authorization': 'Bearer ' + login['token']}
+    call('GET', '/api/me', headers=headers)
+    call('GET', '/api/users/{0}'.format(user), headers=headers)
+    call('PUT', '/api/users/{0}'.format(user), data={'team': 2}, headers=headers)
+
+    user_pokemon = read_json(call('POST', '/api/users/{0}/pokemon'.format(user), headers=headers, data={
+        'pokemon_id': 4, 'cp': 200, 'hp': 30, 'caught_location': '40.7,-74.0'}))['userPokemon']['id']
+    call('POST', '/api/users/{0}/pokemon/batch'.format(user), headers=headers, content_type='application/json',
+         data=json.dumps([{'guid': str(uuid.uuid4()), 'pokemon_id': 7, 'cp': 100, 'hp': 20}]))
+    for path in ['/api/users/{0}/pokemon', '/api/users/{0}/pokemon/export', '/api/users/{0}/pokemon/iv',
+                 '/api/users/{0}/evolutions', '/api/users/{0}/changes']:
+        call('GET', path.format(user), headers=headers)
+    call('GET', '/api/users/{0}/pokemon/{1}'.format(user, user_pokemon), headers=headers)
+    call('GET', '/api/users/{0}/pokemon/{1}/iv'.format(user, user_pokemon), headers=headers)
+    call('DELETE', '/api/users/{0}/pokemon/{1}'.format(user, user_pokemon), 204, headers=headers)
+
+    job = read_json(call('POST', '/api/jobs', 202, headers=headers, content_type='application/json',
+                         data=json.dumps({'kind': 'user-ivs', 'params': {'user_id': user}})))['job']['id']
+    call('GET', '/api/jobs/{0}'.format(job))
+    call('GET', '/api/jobs/{0}/result'.format(job), 202)
+
+    call('GET', '/api/search?q=pika')
+    call('GET', '/api/pokemon/Pikachu/vs/Gyarados/battles?battles=10')
+    call('GET', '/api/health')
+    call('GET', '/api/ready')
+    call('GET', '/metrics')
+    call('GET', '/metrics/profiles', 404 if app.extensions['profiler'] is None else 200)
+    call('GET', '/api/logout', headers=headers)
+
+    rng = random.Random(0)
+    targets = Targets(db)
+    for route in ROUTES.values():
+        method, path, _ = route(targets, rng)
+        exercised.add((adapter.match(path.partition('?')[0], method)[0], method))
+    endpoints = {(rule.endpoint, method) for rule in app.url_map.iter_rules() if rule.endpoint != 'static'
+                 for method in rule.methods - {'HEAD', 'OPTIONS'}}
+    assert endpoints - exercised == set()
+
+
+# memory is measured per route, from where the route started, not as the peak of the whole process
+def test_client_run_measures_route_rss(app, targets):
+    result = run_client(app, targets, ['health', 'pokemon'], 3, warmup=1)
+    for name in ['health', 'pokemon']:
+        assert result[name]['peak_rss_kb'] > 0
+        assert 0 <= result[name]['rss_growth_kb'] <= result[name]['peak_rss_kb']
+
+
+# a statement that raises leaves no start time behind for the next statement on its connection
+def test_failed_statement_is_not_timed(app):
+    with db.engine.connect() as connection:
+        with pytest.raises(Exception):
+            connection.execute('SELECT * FROM no_such_table')
+        assert 'statement_started' not in connection.connection.info
+        connection.execute('SELECT 1')
+        assert 'statement_started' not in connection.connection.info
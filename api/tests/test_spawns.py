@@ -0,0 +1,41 @@
+from conftest import bearer, read_json
+
+from api.database import db
+from api.database.models import pokedex
+from api.spawns import rebuild_spawn_cells
+
+from datetime import datetime
+
+
+def spawn_counts():
+    counts = {(row.pokemon_id, row.zoom, row.x, row.y): row.count for row in pokedex.SpawnCell.query if row.count}
+    db.session.remove()
+    return counts
+
+
+def test_rebuild_spawn_cells(client, user):
+    response = client.post('/api/users/{0}/pokemon'.format(user), headers=bearer(user),
+                           data={'pokemon_id': 16, 'cp': 100, 'hp': 30, 'caught_location': '48.85,2.35'})
+    located_id = read_json(response)['userPokemon']['id']
+    table = pokedex.UserPokemon.__table__
+    db.engine.execute(table.update().where(table.c.id == located_id), last_modified=datetime(2016, 7, 6))
+    # stored before the coordinates were parsed on insert
+    unlocated_id = db.engine.execute(table.insert(), user_id=user, pokemon_id=16, cp=100, hp=30,
+                                     caught_location='51.5,-0.12').inserted_primary_key[0]
+    kept = spawn_counts()
+
+    rebuild_spawn_cells(db.session)
+    rebuilt = spawn_counts()
+    assert {cell: count for cell, count in rebuilt.items() if cell[0] != 16} == \
+        {cell: count for cell, count in kept.items() if cell[0] != 16}
+    assert sum(count for (pokemon_id, zoom, x, y), count in rebuilt.items() if pokemon_id == 16 and zoom == 0) == \
+        sum(count for (pokemon_id, zoom, x, y), count in kept.items() if pokemon_id == 16 and zoom == 0) + 1
+
+    rows = {row.id: row for row in db.engine.execute(table.select().where(table.c.id.in_([located_id,
+                                                                                       unlocated_id])))}
+    assert rows[unlocated_id].caught_latitude == 51.5
+    assert str(rows[located_id].last_modified).startswith('2016-07-06')
+
+    # the row bypassed the rollups, without it they match the collection again
+    db.engine.execute(table.delete().where(table.c.id == unlocated_id))
+    rebuild_spawn_cells(db.session)
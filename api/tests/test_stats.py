@@ -0,0 +1,57 @@
+from conftest import bearer, read_json
+
+from api.database import db
+from api.database.models import pokedex
+from api.stats import rebuild_rollups
+from api.stats.rollup import STAT_COLUMNS
+
+
+def rollups():
+    stats = {(row.pokemon_id, row.team_id): tuple(getattr(row, column) for column in STAT_COLUMNS)
+             for row in pokedex.SpeciesStats.query}
+    histograms = {(row.pokemon_id, row.team_id, row.metric, row.bucket): row.count
+                  for row in pokedex.SpeciesHistogram.query}
+    db.session.remove()
+    # incremental updates leave rows behind at zero, a rebuild has none
+    return ({key: value for key, value in stats.items() if any(value)},
+            {key: value for key, value in histograms.items() if value})
+
+
+# the rollups kept up to date request by request are the ones a rebuild computes from user_pokemon
+def assert_rollups_rebuild():
+    kept = rollups()
+    rebuild_rollups(db.session)
+    assert kept == rollups()
+
+
+def test_team_change_moves_collection(client, user):
+    headers = bearer(user)
+    response = client.post('/api/users/{0}/pokemon'.format(user), headers=headers,
+                           data={'pokemon_id': 74, 'cp': 500, 'hp': 60})
+    user_pokemon_id = read_json(response)['userPokemon']['id']
+    assert_rollups_rebuild()
+
+    assert client.put('/api/users/{0}'.format(user), data={'team': 3}, headers=headers).status_code == 200
+    assert_rollups_rebuild()
+
+    response = client.delete('/api/users/{0}/pokemon/{1}'.format(user, user_pokemon_id), headers=headers)
+    assert response.status_code == 204
+    assert_rollups_rebuild()
+
+
+def test_team_id_change(client, user):
+    client.post('/api/users/{0}/pokemon'.format(user), headers=bearer(user), data={'pokemon_id': 1, 'cp': 20,
+                                                                                  'hp': 10})
+    pokedex.User.query.get(user).team_id = 2
+    db.session.commit()
+    assert_rollups_rebuild()
+
+
+def test_malformed_arguments(client):
+    for path, field in [('/api/stats/pokemon?team_id=abc', 'team_id'), ('/api/stats/teams?limit=abc', 'limit'),
+                        ('/api/stats/teams?limit=0', 'limit')]:
+        response = client.get(path)
+        assert response.status_code == 422
+        assert field in read_json(response)['errors']
+    assert client.get('/api/stats/pokemon?team_id=1').status_code == 200
+    assert client.get('/api/stats/teams?limit=2').status_code == 200
@@ -0,0 +1,39 @@
+from conftest import bearer, read_json
+
+import json
+import uuid
+
+
+def changes(client, user, since=None):
+    path = '/api/users/{0}/changes'.format(user) + ('?since=' + since if since else '')
+    response = client.get(path, headers=bearer(user))
+    assert response.status_code == 200
+    return read_json(response)
+
+
+# a delta sync sends what changed since the token, and the ids of what was deleted
+def test_delta_sync(client, user):
+    first = changes(client, user)
+    assert first['userPokemon'] == []
+
+    guids = [str(uuid.uuid4()) for _ in range(2)]
+    response = client.post('/api/users/{0}/pokemon/batch'.format(user), headers=bearer(user),
+                           content_type='application/json',
+                           data=json.dumps([{'guid': guid, 'pokemon_id': 25, 'cp': 10, 'hp': 10} for guid in guids]))
+    added = [user_pokemon['id'] for user_pokemon in read_json(response)['userPokemon']]
+    second = changes(client, user, first['next'])
+    assert sorted(user_pokemon['id'] for user_pokemon in second['userPokemon']) == sorted(added)
+    assert second['deleted']['userPokemon'] == []
+
+    response = client.delete('/api/users/{0}/pokemon/{1}'.format(user, added[0]), headers=bearer(user))
+    assert response.status_code == 204
+    third = changes(client, user, second['next'])
+    assert third['deleted']['userPokemon'] == [added[0]]
+    assert added[0] not in [user_pokemon['id'] for user_pokemon in third['userPokemon']]
+    assert not third['reset']
+
+
+def test_foreign_sync_token(client, user):
+    token = changes(client, user)['next']
+    other = client.get('/api/users/{0}/changes?since={1}'.format(user + 1, token), headers=bearer(user + 1))
+    assert other.status_code == 422
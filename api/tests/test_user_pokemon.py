@@ -0,0 +1,49 @@
+from conftest import bearer, read_json
+
+from api.database import db
+from api.database.models import pokedex
+
+
+def spawn_counts(pokemon_id):
+    counts = {(row.zoom, row.x, row.y): row.count
+              for row in pokedex.SpawnCell.query.filter_by(pokemon_id=pokemon_id) if row.count}
+    db.session.remove()
+    return counts
+
+
+def test_get_user_pokemon(client, user):
+    headers = bearer(user)
+    response = client.post('/api/users/{0}/pokemon'.format(user), headers=headers,
+                           data={'pokemon_id': 25, 'cp': 300, 'hp': 40})
+    user_pokemon_id = read_json(response)['userPokemon']['id']
+    path = '/api/users/{0}/pokemon/{1}'.format(user, user_pokemon_id)
+    response = client.get(path, headers=headers)
+    assert response.status_code == 200
+    assert read_json(response)['userPokemon']['id'] == user_pokemon_id
+    assert client.put(path, headers=headers, data={'cp': 301}).status_code == 405
+    assert client.get('/api/users/{0}/pokemon/0'.format(user), headers=headers).status_code == 404
+
+
+# a deleted catch leaves the spawn cells it was counted in
+def test_delete_located_pokemon(client, user):
+    headers = bearer(user)
+    before = spawn_counts(150)
+    response = client.post('/api/users/{0}/pokemon'.format(user), headers=headers,
+                           data={'pokemon_id': 150, 'cp': 3000, 'hp': 150, 'caught_location': '37.77,-122.42'})
+    user_pokemon_id = read_json(response)['userPokemon']['id']
+    assert spawn_counts(150) != before
+    response = client.delete('/api/users/{0}/pokemon/{1}'.format(user, user_pokemon_id), headers=headers)
+    assert response.status_code == 204
+    assert spawn_counts(150) == before
+
+
+def test_invalid_pokemon_id_is_refused(client, user):
+    headers = bearer(user)
+    path = '/api/users/{0}/pokemon'.format(user)
+    for pokemon_id in ['pikachu', '0']:
+        response = client.post(path, headers=headers, data={'pokemon_id': pokemon_id, 'cp': 300, 'hp': 40,
+                                                            'caught_location': '40.7,-74.0'})
+        assert response.status_code == 422
+        assert 'pokemon_id' in read_json(response)['errors']
+    response = client.post(path, headers=headers, data={'cp': 300, 'hp': 40})
+    assert response.status_code == 422
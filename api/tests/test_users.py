@@ -0,0 +1,22 @@
+from conftest import bearer
+
+from api.database import db
+from api.database.models import pokedex
+
+
+# related objects are loaded by id through the schemas, which needs them bound to the database session
+def test_update_user_team(client, user):
+    response = client.put('/api/users/{0}'.format(user), data={'team': 2}, headers=bearer(user))
+    assert response.status_code == 200
+    assert db.session.query(pokedex.User.team_id).filter_by(id=user).scalar() == 2
+    db.session.remove()
+
+
+def test_add_pokemon_with_attacks(client, user):
+    response = client.post('/api/users/{0}/pokemon'.format(user), headers=bearer(user), data={
+        'pokemon_id': 25, 'cp': 300, 'hp': 40, 'fast_attack': 1, 'charge_attack': 2})
+    assert response.status_code == 200
+    user_pokemon = db.session.query(pokedex.UserPokemon.fast_attack_id, pokedex.UserPokemon.charge_attack_id) \
+        .filter_by(user_id=user).one()
+    assert tuple(user_pokemon) == (1, 2)
+    db.session.remove()